@@ -22,13 +22,28 @@
 #
 # Version: 1.0
 
+import logging
+
 from django.apps import AppConfig
 from django.utils.version import get_complete_version
 
 if get_complete_version() < (1, 8):
     raise RuntimeError('MAPR requires Django 1.8+')
 
+logger = logging.getLogger(__name__)
+
 
 class MaprAppConfig(AppConfig):
     name = "omero_mapr"
     label = "mapr"
+
+    def ready(self):
+        from .mapr_settings import mapr_settings
+
+        # behind nginx REMOTE_ADDR is the proxy for every visitor
+        if mapr_settings.RATE_LIMITS and not mapr_settings.TRUSTED_PROXIES:
+            logger.warning(
+                "omero.web.mapr.trusted_proxies is 0: the public user is"
+                " rate limited by REMOTE_ADDR. Behind a reverse proxy all"
+                " the anonymous visitors share one bucket, set it to the"
+                " number of proxies.")
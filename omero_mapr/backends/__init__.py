@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import threading
+
+_backends = {}
+_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Return the query backend configured by omero.web.mapr.backend.
+    Backends are created once per process.
+    """
+    # imported here so that the backends can be used outside of OMERO.web
+    from django.utils.module_loading import import_string
+    from ..mapr_settings import mapr_settings
+
+    path = mapr_settings.BACKEND
+    backend = _backends.get(path)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(path)
+            if backend is None:
+                backend = import_string(path)()
+                _backends[path] = backend
+    return backend
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+
+class MaprBackend(object):
+
+    """
+    Data access used by the mapr views.
+
+    Every method takes the OMERO gateway as the first argument and
+    returns the same marshalled dictionaries as the functions in
+    omero_mapr.tree, so that backends can be swapped without changing
+    the JSON API. See omero_mapr.tree for the description of the
+    parameters.
+    """
+
+    def count_mapannotations(self, conn, mapann_value, query=False,
+                             case_sensitive=False,
+                             mapann_ns=[], mapann_names=[],
+                             group_id=-1, experimenter_id=-1):
+        raise NotImplementedError()
+
+    def marshal_mapannotations(self, conn, mapann_value, query=False,
+                               case_sensitive=False,
+                               mapann_ns=[], mapann_names=[],
+                               group_id=-1, experimenter_id=-1,
+                               page=1, limit=None):
+        raise NotImplementedError()
+
+    def marshal_facets(self, conn, mapann_value, query=False,
+                       case_sensitive=False,
+                       mapann_ns=[], mapann_names=[],
+                       group_id=-1, experimenter_id=-1):
+        raise NotImplementedError()
+
+    def marshal_screens(self, conn, mapann_value, query=False,
+                        mapann_ns=[], mapann_names=[],
+                        group_id=-1, experimenter_id=-1,
+                        page=1, limit=None):
+        raise NotImplementedError()
+
+    def marshal_projects(self, conn, mapann_value, query=False,
+                         mapann_ns=[], mapann_names=[],
+                         group_id=-1, experimenter_id=-1,
+                         page=1, limit=None):
+        raise NotImplementedError()
+
+    def marshal_datasets(self, conn, project_id,
+                         mapann_value, query=False,
+                         mapann_ns=[], mapann_names=[],
+                         group_id=-1, experimenter_id=-1,
+                         page=1, limit=None):
+        raise NotImplementedError()
+
+    def marshal_plates(self, conn, screen_id,
+                       mapann_value, query=False,
+                       mapann_ns=[], mapann_names=[],
+                       group_id=-1, experimenter_id=-1,
+                       page=1, limit=None):
+        raise NotImplementedError()
+
+    def marshal_images(self, conn, parent, parent_id,
+                       mapann_value, query=False,
+                       mapann_ns=[], mapann_names=[],
+                       load_pixels=False,
+                       group_id=-1, experimenter_id=-1,
+                       page=1, date=False, thumb_version=False,
+                       limit=None):
+        raise NotImplementedError()
+
+    def image_ids(self, conn, mapann_value, query=False,
+                  case_sensitive=False,
+                  mapann_ns=[], mapann_names=[],
+                  group_id=-1, experimenter_id=-1):
+        raise NotImplementedError()
+
+    def marshal_images_by_id(self, conn, image_ids, load_pixels=False,
+                             group_id=-1, date=False, thumb_version=False):
+        raise NotImplementedError()
+
+    def load_mapannotation(self, conn, mapann_value,
+                           mapann_ns=[], mapann_names=[],
+                           group_id=-1, experimenter_id=-1,
+                           page=1, limit=None):
+        raise NotImplementedError()
+
+    def count_annotations(self, conn, mapann_value,
+                          mapann_ns=[], mapann_names=[],
+                          group_id=-1, experimenter_id=-1):
+        raise NotImplementedError()
+
+    def marshal_autocomplete(self, conn, mapann_value, query=True,
+                             case_sensitive=False,
+                             mapann_ns=[], mapann_names=None,
+                             group_id=-1, experimenter_id=-1,
+                             page=1, limit=None):
+        raise NotImplementedError()
+
+    def paths_to_object(self, conn, mapann_value,
+                        mapann_ns=[], mapann_names=[],
+                        screen_id=None, plate_id=None,
+                        project_id=None, dataset_id=None,
+                        image_id=None,
+                        experimenter_id=None, group_id=None,
+                        page_size=None, limit=None):
+        raise NotImplementedError()
+
+    def paths_to_objects(self, conn, mapann_value,
+                         mapann_ns=[], mapann_names=[],
+                         screen_ids=[], plate_ids=[],
+                         project_ids=[], dataset_ids=[],
+                         image_ids=[],
+                         experimenter_id=None, group_id=None):
+        """
+        Return the paths to many objects keyed by "type-id".
+        Backends able to do better than one query per object override it.
+        """
+        paths = {}
+        for t, ids in (('screen', screen_ids), ('plate', plate_ids),
+                       ('project', project_ids), ('dataset', dataset_ids),
+                       ('image', image_ids)):
+            for oid in ids or []:
+                paths["%s-%s" % (t, oid)] = self.paths_to_object(
+                    conn, mapann_value,
+                    mapann_ns=mapann_ns, mapann_names=mapann_names,
+                    experimenter_id=experimenter_id, group_id=group_id,
+                    **{'%s_id' % t: oid})
+        return paths
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import os
+import time
+import logging
+import sqlite3
+import tempfile
+
+from copy import deepcopy
+
+import omero
+from omero.rtypes import rlong, unwrap
+
+from omeroweb.webclient.tree import _marshal_date
+
+from .sqlite import create_schema
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+SCREEN_LINKS = """
+    select a.id, ws.image.id, ws.id, pl.id, sl.parent.id
+    from WellAnnotationLink wal join wal.child a
+        join wal.parent w join w.wellSamples ws
+        join w.plate pl join pl.screenLinks sl
+    where a.ns in (:ns) and wal.id > :last
+        and wal.id <= :next
+    """
+
+PROJECT_LINKS = """
+    select a.id, i.id, ds.id, pdl.parent.id
+    from ImageAnnotationLink ial join ial.child a
+        join ial.parent i join i.datasetLinks dil
+        join dil.parent ds join ds.projectLinks pdl
+    where a.ns in (:ns) and ial.id > :last
+        and ial.id <= :next
+    """
+
+
+def _batches(ids):
+    for i in range(0, len(ids), BATCH_SIZE):
+        yield ids[i:i + BATCH_SIZE]
+
+
+class IndexBuilder(object):
+
+    """
+    Copies the map annotations of the configured namespaces, the
+    containers and images they are linked to into a SQLite index
+    served by omero_mapr.backends.sqlite.
+
+    Screens are indexed through the wells and projects through the
+    images, as the HQL backend does. The index is written to a
+    temporary file which atomically replaces the previous one.
+    """
+
+    def __init__(self, conn, path, namespaces):
+        self.conn = conn
+        self.path = path
+        self.namespaces = sorted(set(namespaces))
+        self.service_opts = deepcopy(conn.SERVICE_OPTS)
+        self.service_opts.setOmeroGroup(-1)
+
+    def projection(self, q, params):
+        return unwrap(self.conn.getQueryService().projection(
+            q, params, self.service_opts))
+
+    def _max_link_id(self, link_class):
+        params = omero.sys.ParametersI()
+        params.map['ns'] = omero.rtypes.wrap(self.namespaces)
+        q = """
+            select max(l.id) from %s l join l.child a
+            where a.ns in (:ns)
+            """ % link_class
+        return self.projection(q, params)[0][0] or 0
+
+    def _copy_links(self, db, link_class, query):
+        ''' Pages through the links by id to keep the queries bounded '''
+        max_id = self._max_link_id(link_class)
+        last = 0
+        while last < max_id:
+            params = omero.sys.ParametersI()
+            params.map['ns'] = omero.rtypes.wrap(self.namespaces)
+            params.add('last', rlong(last))
+            params.add('next', rlong(last + BATCH_SIZE))
+            rows = self.projection(query, params)
+            if link_class == 'WellAnnotationLink':
+                rows = [r + [None, None] for r in rows]
+            else:
+                rows = [r[0:2] + [None, None, None] + r[2:4] for r in rows]
+            db.executemany(
+                "INSERT INTO link VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            last += BATCH_SIZE
+
+    def _copy_annotations(self, db):
+        ids = [r[0] for r in db.execute(
+            "SELECT DISTINCT ann_id FROM link ORDER BY ann_id")]
+        qs = self.conn.getQueryService()
+        for batch in _batches(ids):
+            params = omero.sys.ParametersI()
+            params.addIds(batch)
+            q = """
+                select a from MapAnnotation a join fetch a.mapValue
+                    join fetch a.details.updateEvent
+                where a.id in (:ids)
+                """
+            for a in qs.findAllByQuery(q, params, self.service_opts):
+                aid = a.id.val
+                db.execute(
+                    "INSERT INTO annotation VALUES (?, ?, ?, ?, ?)",
+                    (aid, unwrap(a.ns),
+                     a.details.owner.id.val, a.details.group.id.val,
+                     _marshal_date(a.details.updateEvent.time.val)))
+                db.executemany(
+                    "INSERT INTO mapvalue VALUES (?, ?, ?, ?)",
+                    [(aid, idx, nv.name, nv.value)
+                     for idx, nv in enumerate(a.getMapValue())])
+
+    def _copy_containers(self, db):
+        for ctype, klass in (('screen', 'Screen'), ('plate', 'Plate'),
+                             ('project', 'Project'),
+                             ('dataset', 'Dataset')):
+            ids = [r[0] for r in db.execute(
+                "SELECT DISTINCT %s_id FROM link WHERE %s_id IS NOT NULL"
+                % (ctype, ctype))]
+            for batch in _batches(ids):
+                params = omero.sys.ParametersI()
+                params.addIds(batch)
+                q = """
+                    select c.id, c.name, c.details.owner.id,
+                        c.details.group.id
+                    from %s c where c.id in (:ids)
+                    """ % klass
+                db.executemany(
+                    "INSERT INTO container VALUES ('%s', ?, ?, ?, ?)"
+                    % ctype, self.projection(q, params))
+
+    def _copy_images(self, db):
+        ids = [r[0] for r in db.execute(
+            "SELECT DISTINCT image_id FROM link")]
+        for batch in _batches(ids):
+            params = omero.sys.ParametersI()
+            params.addIds(batch)
+            q = """
+                select new map(image.id as id,
+                    image.name as name,
+                    image.details.owner.id as ownerId,
+                    image.details.group.id as groupId,
+                    fs.id as filesetId,
+                    pix.sizeX as sizeX,
+                    pix.sizeY as sizeY,
+                    pix.sizeZ as sizeZ,
+                    image.details.creationEvent.time as date,
+                    image.acquisitionDate as acqDate)
+                from Image image
+                left outer join image.fileset fs
+                left outer join image.pixels pix
+                where image.id in (:ids)
+                """
+            rows = []
+            for e in self.projection(q, params):
+                e = e[0]
+                rows.append((e['id'], e['name'], e['ownerId'],
+                             e['groupId'], e.get('filesetId'),
+                             e.get('sizeX'), e.get('sizeY'),
+                             e.get('sizeZ'),
+                             _marshal_date(e['date'])
+                             if e.get('date') else None,
+                             _marshal_date(e['acqDate'])
+                             if e.get('acqDate') else None))
+            db.executemany(
+                "INSERT INTO image VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+
+    def _copy_experimenters(self, db):
+        ids = [r[0] for r in db.execute(
+            "SELECT DISTINCT owner_id FROM annotation")]
+        for batch in _batches(ids):
+            params = omero.sys.ParametersI()
+            params.addIds(batch)
+            q = """
+                select e.id, e.omeName, e.firstName, e.lastName
+                from Experimenter e where e.id in (:ids)
+                """
+            db.executemany(
+                "INSERT INTO experimenter VALUES (?, ?, ?, ?)",
+                self.projection(q, params))
+
+    def build(self):
+        start = time.time()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(suffix=".sqlite", dir=directory)
+        os.close(fd)
+        try:
+            db = sqlite3.connect(tmp)
+            try:
+                create_schema(db)
+                self._copy_links(db, 'WellAnnotationLink', SCREEN_LINKS)
+                self._copy_links(db, 'ImageAnnotationLink', PROJECT_LINKS)
+                self._copy_annotations(db)
+                self._copy_containers(db)
+                self._copy_images(db)
+                self._copy_experimenters(db)
+                db.execute("INSERT INTO meta VALUES ('built', ?)",
+                           (str(int(time.time())),))
+                db.commit()
+                db.execute("ANALYZE")
+            finally:
+                db.close()
+            os.replace(tmp, self.path)
+        except Exception:
+            os.remove(tmp)
+            raise
+        logger.info("Built mapr index %s in %.1fs"
+                    % (self.path, time.time() - start))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+from .base import MaprBackend
+from .. import tree
+from .. import show
+
+
+class HqlBackend(MaprBackend):
+
+    """
+    Default backend running HQL queries through the OMERO query service.
+    """
+
+    def count_mapannotations(self, conn, *args, **kwargs):
+        return tree.count_mapannotations(conn, *args, **kwargs)
+
+    def marshal_mapannotations(self, conn, *args, **kwargs):
+        return tree.marshal_mapannotations(conn, *args, **kwargs)
+
+    def marshal_facets(self, conn, *args, **kwargs):
+        return tree.marshal_facets(conn, *args, **kwargs)
+
+    def marshal_screens(self, conn, *args, **kwargs):
+        return tree.marshal_screens(conn, *args, **kwargs)
+
+    def marshal_projects(self, conn, *args, **kwargs):
+        return tree.marshal_projects(conn, *args, **kwargs)
+
+    def marshal_datasets(self, conn, *args, **kwargs):
+        return tree.marshal_datasets(conn, *args, **kwargs)
+
+    def marshal_plates(self, conn, *args, **kwargs):
+        return tree.marshal_plates(conn, *args, **kwargs)
+
+    def marshal_images(self, conn, *args, **kwargs):
+        return tree.marshal_images(conn, *args, **kwargs)
+
+    def image_ids(self, conn, *args, **kwargs):
+        return tree.image_ids(conn, *args, **kwargs)
+
+    def marshal_images_by_id(self, conn, *args, **kwargs):
+        return tree.marshal_images_by_id(conn, *args, **kwargs)
+
+    def load_mapannotation(self, conn, *args, **kwargs):
+        return tree.load_mapannotation(conn, *args, **kwargs)
+
+    def count_annotations(self, conn, *args, **kwargs):
+        return tree.count_annotations(conn, *args, **kwargs)
+
+    def marshal_autocomplete(self, conn, *args, **kwargs):
+        return tree.marshal_autocomplete(conn, *args, **kwargs)
+
+    def paths_to_object(self, conn, *args, **kwargs):
+        return show.mapr_paths_to_object(conn, *args, **kwargs)
+
+    def paths_to_objects(self, conn, *args, **kwargs):
+        return show.mapr_paths_to_objects(conn, *args, **kwargs)
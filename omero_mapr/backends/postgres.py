@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import sys
+import logging
+import threading
+
+from contextlib import contextmanager
+
+try:
+    from psycopg2 import InterfaceError, OperationalError
+    from psycopg2.pool import ThreadedConnectionPool
+    from psycopg2.extensions import QueryCanceledError
+except ImportError:  # pragma: no cover
+    ThreadedConnectionPool = None
+    QueryCanceledError = None
+
+from .hql import HqlBackend
+from .. import timing
+
+
+logger = logging.getLogger(__name__)
+
+# ExperimenterGroup.permissions bits, see omero.model.PermissionsI
+GROUP_READ = 64
+GROUP_WRITE = 32
+GROUP_ANNOTATE = 16
+
+
+def _escape_chars_like(query):
+    for c in ("\\", "%", "_"):
+        query = query.replace(c, "\\" + c)
+    return query
+
+
+def _where(mapann_ns=[], mapann_names=[], mapann_value=None,
+           query=False, case_sensitive=True, experimenter_id=-1):
+    ''' Helper to build the WHERE clause and its parameters.
+        Mirrors omero_mapr.tree._set_parameters.
+    '''
+    where_clause = []
+    params = {}
+
+    if mapann_names is not None and len(mapann_names) > 0:
+        params['filter'] = list(mapann_names)
+        where_clause.append("mv.name = ANY(%(filter)s)")
+
+    if mapann_ns is not None and len(mapann_ns) > 0:
+        params['ns'] = list(mapann_ns)
+        where_clause.append("a.ns = ANY(%(ns)s)")
+
+    if experimenter_id is not None and experimenter_id != -1:
+        params['id'] = experimenter_id
+        where_clause.append("a.owner_id = %(id)s")
+
+    if mapann_value:
+        mapann_value = mapann_value if case_sensitive else mapann_value.lower()
+        _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+        if query:
+            params['query'] = "%%%s%%" % _escape_chars_like(mapann_value)
+            where_clause.append("%s LIKE %%(query)s" % _cwc)
+        else:
+            params['value'] = mapann_value
+            where_clause.append("%s = %%(value)s" % _cwc)
+    else:
+        where_clause.append("mv.value != ''")
+
+    return where_clause, params
+
+
+def _paging(params, page, limit):
+    if page is None or page < 1:
+        return ""
+    if limit is None:
+        from django.conf import settings
+        limit = settings.PAGE
+    params['limit'] = limit
+    params['offset'] = (page - 1) * limit
+    return " LIMIT %(limit)s OFFSET %(offset)s"
+
+
+class SecurityContext(object):
+
+    """
+    Visibility rules of the OMERO security system for the current user,
+    translated to SQL: members see all the data of the groups they may
+    read and only their own data in private groups, leaders and admins
+    see everything in their groups.
+    """
+
+    def __init__(self, conn, groups, group_id=-1):
+        ctx = conn.getEventContext()
+        self.user_id = ctx.userId
+        self.is_admin = ctx.isAdmin
+        self.leader_of = set(ctx.leaderOfGroups)
+        self.groups = groups
+        if group_id is None or group_id == -1:
+            member_of = set(ctx.memberOfGroups)
+        elif self.is_admin or group_id in ctx.memberOfGroups:
+            member_of = set([group_id])
+        else:
+            member_of = set()
+        self.group_id = group_id
+        self.full = sorted(
+            g for g in member_of
+            if self.is_admin or g in self.leader_of or
+            groups.get(g, 0) & GROUP_READ)
+        self.own = sorted(member_of - set(self.full))
+
+    def params(self):
+        return {'sec_user': self.user_id,
+                'sec_full': self.full,
+                'sec_own': self.own}
+
+    def clause(self, alias):
+        ''' Restricts the rows of the table aliased `alias` '''
+        if self.is_admin and (self.group_id is None or self.group_id == -1):
+            return "TRUE"
+        return ("(%(a)s.group_id = ANY(%%(sec_full)s) OR"
+                " (%(a)s.group_id = ANY(%%(sec_own)s) AND"
+                " %(a)s.owner_id = %%(sec_user)s))" % {'a': alias})
+
+    def permissions(self, owner_id, group_id):
+        ''' Builds the permissions dictionary parse_permissions_css expects
+        '''
+        perms = self.groups.get(group_id, 0)
+        owner = owner_id == self.user_id
+        leader = group_id in self.leader_of
+        group_write = bool(perms & GROUP_WRITE)
+        return {
+            'canEdit': owner or leader or self.is_admin or group_write,
+            'canAnnotate': (owner or leader or self.is_admin or
+                            bool(perms & (GROUP_WRITE | GROUP_ANNOTATE))),
+            'canLink': owner or leader or self.is_admin or group_write,
+            'canDelete': owner or leader or self.is_admin,
+            'canChgrp': owner or self.is_admin,
+            'canChown': leader or self.is_admin,
+        }
+
+
+class PostgresBackend(HqlBackend):
+
+    """
+    Runs the heavy aggregations as native SQL against a read-only
+    connection to the OMERO database, configured by
+    omero.web.mapr.postgres_dsn. Everything else is delegated to HQL.
+    """
+
+    def __init__(self, dsn=None, pool_size=None):
+        if ThreadedConnectionPool is None:
+            raise ImportError("psycopg2 is required by the postgres backend")
+        if dsn is None or pool_size is None:
+            from ..mapr_settings import mapr_settings
+            dsn = dsn or mapr_settings.POSTGRES_DSN
+            pool_size = pool_size or mapr_settings.POSTGRES_POOL_SIZE
+        self._pool = ThreadedConnectionPool(1, pool_size, dsn)
+        # the pool raises PoolError when exhausted, wait for a connection
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    @contextmanager
+    def _cursor(self):
+        # give up at the deadline of the request, if any
+        if not self._slots.acquire(timeout=timing.remaining() or -1):
+            raise timing.QueryTimeout()
+        try:
+            db = self._pool.getconn()
+            broken = False
+            try:
+                if not db.readonly:
+                    db.set_session(readonly=True, autocommit=True)
+                with db.cursor() as cur:
+                    yield cur
+            except (OperationalError, InterfaceError):
+                broken = True
+                raise
+            finally:
+                self._pool.putconn(db, close=broken or bool(db.closed))
+        finally:
+            self._slots.release()
+
+    def execute(self, cur, q, params):
+        caller = sys._getframe(1).f_code.co_name
+        logger.debug("SQL QUERY: %s\nPARAMS: %r" % (q, params))
+        # the statement is cancelled by the server at the deadline
+        timeout = timing.remaining()
+        with timing.phase('sql', caller):
+            if timeout is not None:
+                cur.execute("SET statement_timeout = %(ms)s",
+                            {'ms': max(int(timeout * 1000), 1)})
+            try:
+                cur.execute(q, params)
+                return cur.fetchall()
+            except QueryCanceledError:
+                raise timing.QueryTimeout()
+            finally:
+                if timeout is not None:
+                    cur.execute("SET statement_timeout = 0")
+
+    def security(self, cur, conn, group_id):
+        ctx = conn.getEventContext()
+        cur.execute(
+            "SELECT id, permissions FROM experimentergroup"
+            " WHERE id = ANY(%(ids)s)", {'ids': list(ctx.memberOfGroups)})
+        groups = dict(cur.fetchall())
+        return SecurityContext(conn, groups, group_id)
+
+    def count_mapannotations(self, conn, mapann_value, query=False,
+                             case_sensitive=False,
+                             mapann_ns=[], mapann_names=[],
+                             group_id=-1, experimenter_id=-1):
+        where_clause, params = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            case_sensitive=case_sensitive,
+            experimenter_id=experimenter_id)
+        with self._cursor() as cur:
+            sec = self.security(cur, conn, group_id)
+            params.update(sec.params())
+            q = """
+                SELECT count(DISTINCT mv.value)
+                FROM imageannotationlink ial
+                    JOIN annotation a ON a.id = ial.child
+                    JOIN annotation_mapvalue mv ON mv.annotation_id = a.id
+                    JOIN image i ON i.id = ial.parent
+                WHERE %s AND %s AND %s AND %s AND
+                    (EXISTS (SELECT 1 FROM wellsample ws
+                             WHERE ws.image = i.id)
+                     OR EXISTS (SELECT 1 FROM datasetimagelink dil
+                                WHERE dil.child = i.id))
+                """ % (" AND ".join(where_clause), sec.clause('a'),
+                       sec.clause('ial'), sec.clause('i'))
+            return self.execute(cur, q, params)[0][0]
+
+    def marshal_mapannotations(self, conn, mapann_value, query=False,
+                               case_sensitive=False,
+                               mapann_ns=[], mapann_names=[],
+                               group_id=-1, experimenter_id=-1,
+                               page=1, limit=None):
+        from ..tree import _marshal_map
+
+        where_clause, params = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            case_sensitive=case_sensitive,
+            experimenter_id=experimenter_id)
+        mapannotations = []
+        with self._cursor() as cur:
+            sec = self.security(cur, conn, group_id)
+            params.update(sec.params())
+            q = """
+                SELECT mv.value,
+                    count(DISTINCT i.id),
+                    count(DISTINCT sl.parent),
+                    count(DISTINCT pdl.parent)
+                FROM imageannotationlink ial
+                    JOIN annotation a ON a.id = ial.child
+                    JOIN annotation_mapvalue mv ON mv.annotation_id = a.id
+                    JOIN image i ON i.id = ial.parent
+                    LEFT JOIN wellsample ws ON ws.image = i.id
+                    LEFT JOIN well w ON w.id = ws.well
+                    LEFT JOIN screenplatelink sl ON sl.child = w.plate
+                    LEFT JOIN datasetimagelink dil ON dil.child = i.id
+                    LEFT JOIN projectdatasetlink pdl
+                        ON pdl.child = dil.parent
+                WHERE %s AND %s AND %s AND %s AND
+                    ((dil.id IS NULL AND sl.id IS NOT NULL)
+                     OR (sl.id IS NULL AND pdl.id IS NOT NULL))
+                GROUP BY mv.value
+                ORDER BY count(DISTINCT i.id) DESC
+                """ % (" AND ".join(where_clause), sec.clause('a'),
+                       sec.clause('ial'), sec.clause('i'))
+            q += _paging(params, page, limit)
+            rows = self.execute(cur, q, params)
+
+        for value, c, screens, projects in rows:
+            mt = _marshal_map(conn, [value, "%s (%d)" % (value, c), None,
+                                     experimenter_id, {}, None,
+                                     screens + projects])
+            mt.update({'extra': {'counter': c}})
+            mapannotations.append(mt)
+        return mapannotations
+
+    def marshal_screens(self, conn, mapann_value, query=False,
+                        mapann_ns=[], mapann_names=[],
+                        group_id=-1, experimenter_id=-1,
+                        page=1, limit=None):
+        from omeroweb.webclient.tree import _marshal_screen
+
+        where_clause, params = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            experimenter_id=experimenter_id)
+        screens = []
+        with self._cursor() as cur:
+            sec = self.security(cur, conn, group_id)
+            params.update(sec.params())
+            q = """
+                SELECT mv.value, s.id, s.name, s.owner_id, s.group_id,
+                    count(DISTINCT w.plate),
+                    count(DISTINCT ws.id)
+                FROM wellannotationlink wal
+                    JOIN annotation a ON a.id = wal.child
+                    JOIN annotation_mapvalue mv ON mv.annotation_id = a.id
+                    JOIN well w ON w.id = wal.parent
+                    JOIN wellsample ws ON ws.well = w.id
+                    JOIN screenplatelink sl ON sl.child = w.plate
+                    JOIN screen s ON s.id = sl.parent
+                WHERE %s AND %s AND %s AND %s
+                GROUP BY s.id, s.name, s.owner_id, s.group_id, mv.value
+                ORDER BY lower(s.name), s.id
+                """ % (" AND ".join(where_clause), sec.clause('a'),
+                       sec.clause('w'), sec.clause('s'))
+            q += _paging(params, page, limit)
+            rows = self.execute(cur, q, params)
+
+        for v, sid, name, owner_id, gid, child_count, c in rows:
+            ms = _marshal_screen(conn, [
+                sid, "%s (%d)" % (name, c), owner_id,
+                sec.permissions(owner_id, gid), child_count])
+            if mapann_value is not None:
+                ms.update({'extra': {'counter': c, 'value': v}})
+            screens.append(ms)
+        return screens
@@ -0,0 +1,717 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import os
+import logging
+import sqlite3
+import threading
+
+from copy import deepcopy
+
+from .base import MaprBackend
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT);
+    CREATE TABLE IF NOT EXISTS experimenter (
+        id INTEGER PRIMARY KEY,
+        omeName TEXT,
+        firstName TEXT,
+        lastName TEXT);
+    CREATE TABLE IF NOT EXISTS annotation (
+        id INTEGER PRIMARY KEY,
+        ns TEXT,
+        owner_id INTEGER,
+        group_id INTEGER,
+        date TEXT);
+    CREATE TABLE IF NOT EXISTS mapvalue (
+        ann_id INTEGER,
+        idx INTEGER,
+        name TEXT,
+        value TEXT);
+    CREATE TABLE IF NOT EXISTS link (
+        ann_id INTEGER,
+        image_id INTEGER,
+        wellsample_id INTEGER,
+        plate_id INTEGER,
+        screen_id INTEGER,
+        dataset_id INTEGER,
+        project_id INTEGER);
+    CREATE TABLE IF NOT EXISTS container (
+        type TEXT,
+        id INTEGER,
+        name TEXT,
+        owner_id INTEGER,
+        group_id INTEGER,
+        PRIMARY KEY (type, id));
+    CREATE TABLE IF NOT EXISTS image (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        owner_id INTEGER,
+        group_id INTEGER,
+        fileset_id INTEGER,
+        size_x INTEGER,
+        size_y INTEGER,
+        size_z INTEGER,
+        date TEXT,
+        acq_date TEXT);
+    CREATE INDEX IF NOT EXISTS mapvalue_value ON mapvalue (value);
+    CREATE INDEX IF NOT EXISTS mapvalue_lower_value
+        ON mapvalue (lower(value));
+    CREATE INDEX IF NOT EXISTS mapvalue_ann ON mapvalue (ann_id);
+    CREATE INDEX IF NOT EXISTS link_ann ON link (ann_id);
+    CREATE INDEX IF NOT EXISTS link_image ON link (image_id);
+    CREATE INDEX IF NOT EXISTS link_plate ON link (plate_id);
+    CREATE INDEX IF NOT EXISTS link_screen ON link (screen_id);
+    CREATE INDEX IF NOT EXISTS link_dataset ON link (dataset_id);
+    CREATE INDEX IF NOT EXISTS link_project ON link (project_id);
+"""
+
+FROM_CLAUSE = """
+    FROM link l
+        JOIN annotation a ON a.id = l.ann_id
+        JOIN mapvalue mv ON mv.ann_id = a.id
+"""
+
+IMAGE_SELECT = """
+    SELECT i.id, i.name, i.owner_id, i.fileset_id,
+        i.size_x, i.size_y, i.size_z, i.date, i.acq_date
+    FROM image i
+"""
+
+
+def create_schema(db):
+    db.executescript(SCHEMA)
+
+
+def _escape_chars_like(query):
+    for c in ("\\", "%", "_"):
+        query = query.replace(c, "\\" + c)
+    return query
+
+
+def _where(mapann_ns=[], mapann_names=[], mapann_value=None,
+           query=False, case_sensitive=True,
+           experimenter_id=-1, group_id=-1):
+    ''' Helper to build the WHERE clause and its arguments.
+        Mirrors omero_mapr.tree._set_parameters.
+    '''
+    where_clause = []
+    args = []
+
+    if mapann_names is not None and len(mapann_names) > 0:
+        where_clause.append(
+            "mv.name IN (%s)" % ",".join("?" * len(mapann_names)))
+        args.extend(mapann_names)
+
+    if mapann_ns is not None and len(mapann_ns) > 0:
+        where_clause.append(
+            "a.ns IN (%s)" % ",".join("?" * len(mapann_ns)))
+        args.extend(mapann_ns)
+
+    if experimenter_id is not None and experimenter_id != -1:
+        where_clause.append("a.owner_id = ?")
+        args.append(experimenter_id)
+
+    if group_id is not None and group_id != -1:
+        where_clause.append("a.group_id = ?")
+        args.append(group_id)
+
+    if mapann_value:
+        mapann_value = mapann_value if case_sensitive else mapann_value.lower()
+        _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+        if query:
+            where_clause.append("%s LIKE ? ESCAPE '\\'" % _cwc)
+            args.append("%%%s%%" % _escape_chars_like(mapann_value))
+        else:
+            where_clause.append("%s = ?" % _cwc)
+            args.append(mapann_value)
+    else:
+        where_clause.append("mv.value != ''")
+
+    return where_clause, args
+
+
+def _paging(page, limit):
+    if page is None or page < 1:
+        return ""
+    if limit is None:
+        from django.conf import settings
+        limit = settings.PAGE
+    return " LIMIT %d OFFSET %d" % (limit, (page - 1) * limit)
+
+
+def _perms_css(conn, owner_id):
+    ''' The index is read-only, so only ownership is reported '''
+    if conn is not None and owner_id == conn.getUserId():
+        return "isOwned"
+    return ""
+
+
+class SqliteBackend(MaprBackend):
+
+    """
+    Serves the mapr API from a SQLite index of the map annotations,
+    see omero_mapr.backends.builder. The index holds no permissions,
+    it is only meant for read-only deployments where every user may
+    see all of the indexed data, and for offline benchmarks.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            from ..mapr_settings import mapr_settings
+            path = mapr_settings.INDEX_PATH
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        db = sqlite3.connect("file:%s?mode=ro" % self.path, uri=True)
+        db.execute("PRAGMA case_sensitive_like = ON")
+        return db
+
+    def execute(self, q, args=()):
+        ''' Runs the query, reopening the index if it was replaced '''
+        inode = os.stat(self.path).st_ino
+        if getattr(self._local, 'inode', None) != inode:
+            self._local.db = self._connect()
+            self._local.inode = inode
+        logger.debug("SQL QUERY: %s\nARGS: %r" % (q, args))
+        return self._local.db.execute(q, args).fetchall()
+
+    def count_mapannotations(self, conn, mapann_value, query=False,
+                             case_sensitive=False,
+                             mapann_ns=[], mapann_names=[],
+                             group_id=-1, experimenter_id=-1):
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            case_sensitive=case_sensitive,
+            experimenter_id=experimenter_id, group_id=group_id)
+        q = "SELECT count(DISTINCT mv.value) %s WHERE %s" % (
+            FROM_CLAUSE, " AND ".join(where_clause))
+        return self.execute(q, args)[0][0]
+
+    def marshal_mapannotations(self, conn, mapann_value, query=False,
+                               case_sensitive=False,
+                               mapann_ns=[], mapann_names=[],
+                               group_id=-1, experimenter_id=-1,
+                               page=1, limit=None):
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            case_sensitive=case_sensitive,
+            experimenter_id=experimenter_id, group_id=group_id)
+        q = """
+            SELECT mv.value,
+                count(DISTINCT l.image_id),
+                count(DISTINCT l.screen_id),
+                count(DISTINCT l.project_id)
+            %s
+            WHERE %s
+            GROUP BY mv.value
+            ORDER BY count(DISTINCT l.image_id) DESC, mv.value
+            """ % (FROM_CLAUSE, " AND ".join(where_clause))
+        q += _paging(page, limit)
+
+        mapannotations = []
+        for value, c, screens, projects in self.execute(q, args):
+            mapannotations.append({
+                'id': value,
+                'name': "%s (%d)" % (value, c),
+                'ownerId': experimenter_id,
+                'permsCss': _perms_css(conn, experimenter_id),
+                'childCount': screens + projects,
+                'extra': {'counter': c},
+            })
+        return mapannotations
+
+    def _marshal_containers(self, conn, ctype, child, count,
+                            mapann_value, query,
+                            mapann_ns, mapann_names,
+                            group_id, experimenter_id,
+                            page, limit):
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            experimenter_id=experimenter_id, group_id=group_id)
+        q = """
+            SELECT mv.value, c.id, c.name, c.owner_id,
+                count(DISTINCT l.%s),
+                count(DISTINCT l.%s)
+            %s
+                JOIN container c ON c.type = '%s' AND c.id = l.%s_id
+            WHERE %s
+            GROUP BY c.id, c.name, mv.value
+            ORDER BY lower(c.name), c.id
+            """ % (child, count, FROM_CLAUSE, ctype, ctype,
+                   " AND ".join(where_clause))
+        q += _paging(page, limit)
+
+        containers = []
+        for v, cid, name, owner_id, child_count, c in self.execute(q, args):
+            container = {
+                'id': cid,
+                'name': "%s (%d)" % (name, c),
+                'ownerId': owner_id,
+                'childCount': child_count,
+                'permsCss': _perms_css(conn, owner_id),
+            }
+            if mapann_value is not None:
+                container['extra'] = {'counter': c, 'value': v}
+            containers.append(container)
+        return containers
+
+    def marshal_facets(self, conn, mapann_value, query=False,
+                       case_sensitive=False,
+                       mapann_ns=[], mapann_names=[],
+                       group_id=-1, experimenter_id=-1):
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            case_sensitive=case_sensitive,
+            experimenter_id=experimenter_id, group_id=group_id)
+        q = """
+            SELECT mv.name, a.ns,
+                count(DISTINCT l.image_id),
+                count(DISTINCT mv.value)
+            %s
+            WHERE %s
+            GROUP BY mv.name, a.ns
+            ORDER BY count(DISTINCT l.image_id) DESC, mv.name
+            """ % (FROM_CLAUSE, " AND ".join(where_clause))
+        return [{'name': name, 'ns': ns, 'imageCount': c,
+                 'valueCount': values}
+                for name, ns, c, values in self.execute(q, args)]
+
+    def marshal_screens(self, conn, mapann_value, query=False,
+                        mapann_ns=[], mapann_names=[],
+                        group_id=-1, experimenter_id=-1,
+                        page=1, limit=None):
+        return self._marshal_containers(
+            conn, 'screen', 'plate_id', 'wellsample_id',
+            mapann_value, query, mapann_ns, mapann_names,
+            group_id, experimenter_id, page, limit)
+
+    def marshal_projects(self, conn, mapann_value, query=False,
+                         mapann_ns=[], mapann_names=[],
+                         group_id=-1, experimenter_id=-1,
+                         page=1, limit=None):
+        return self._marshal_containers(
+            conn, 'project', 'dataset_id', 'image_id',
+            mapann_value, query, mapann_ns, mapann_names,
+            group_id, experimenter_id, page, limit)
+
+    def _marshal_children(self, conn, ctype, parent, parent_id, count,
+                          mapann_value, query,
+                          mapann_ns, mapann_names,
+                          group_id, experimenter_id,
+                          page, limit):
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            experimenter_id=experimenter_id, group_id=group_id)
+        where_clause.append("l.%s_id = ?" % parent)
+        args.append(parent_id)
+        q = """
+            SELECT mv.value, c.id, c.name, c.owner_id,
+                count(DISTINCT l.%s)
+            %s
+                JOIN container c ON c.type = '%s' AND c.id = l.%s_id
+            WHERE %s
+            GROUP BY c.id, c.name, mv.value
+            ORDER BY lower(c.name), c.id, mv.value
+            """ % (count, FROM_CLAUSE, ctype, ctype,
+                   " AND ".join(where_clause))
+        q += _paging(page, limit)
+
+        children = []
+        for v, cid, name, owner_id, child_count in self.execute(q, args):
+            extra = {'node': ctype}
+            if mapann_value is not None:
+                extra['value'] = v
+            children.append({
+                'id': cid,
+                'name': name,
+                'ownerId': owner_id,
+                'childCount': child_count,
+                'permsCss': _perms_css(conn, owner_id),
+                'extra': extra,
+            })
+        return children
+
+    def marshal_datasets(self, conn, project_id,
+                         mapann_value, query=False,
+                         mapann_ns=[], mapann_names=[],
+                         group_id=-1, experimenter_id=-1,
+                         page=1, limit=None):
+        if project_id is None or not isinstance(project_id, int):
+            return []
+        return self._marshal_children(
+            conn, 'dataset', 'project', project_id, 'image_id',
+            mapann_value, query, mapann_ns, mapann_names,
+            group_id, experimenter_id, page, limit)
+
+    def marshal_plates(self, conn, screen_id,
+                       mapann_value, query=False,
+                       mapann_ns=[], mapann_names=[],
+                       group_id=-1, experimenter_id=-1,
+                       page=1, limit=None):
+        if screen_id is None or not isinstance(screen_id, int):
+            return []
+        return self._marshal_children(
+            conn, 'plate', 'screen', screen_id, 'wellsample_id',
+            mapann_value, query, mapann_ns, mapann_names,
+            group_id, experimenter_id, page, limit)
+
+    def marshal_images(self, conn, parent, parent_id,
+                       mapann_value, query=False,
+                       mapann_ns=[], mapann_names=[],
+                       load_pixels=False,
+                       group_id=-1, experimenter_id=-1,
+                       page=1, date=False, thumb_version=False,
+                       limit=None):
+        images = []
+        if (parent_id is None or not isinstance(parent_id, int)) or \
+                parent not in ('plate', 'dataset'):
+            return images
+
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            experimenter_id=experimenter_id, group_id=group_id)
+        where_clause.append("l.%s_id = ?" % parent)
+        args.append(parent_id)
+        q = """
+            %s
+            WHERE i.id IN (SELECT l.image_id %s WHERE %s)
+            ORDER BY lower(i.name), i.id
+            """ % (IMAGE_SELECT, FROM_CLAUSE, " AND ".join(where_clause))
+        q += _paging(page, limit)
+        return self._marshal_images(conn, self.execute(q, args),
+                                    load_pixels=load_pixels,
+                                    group_id=group_id, date=date,
+                                    thumb_version=thumb_version)
+
+    def _marshal_images(self, conn, rows, load_pixels=False,
+                        group_id=-1, date=False, thumb_version=False):
+        images = []
+        for row in rows:
+            iid, name, owner_id, fileset_id = row[0:4]
+            im = {
+                'id': iid,
+                'name': name,
+                'ownerId': owner_id,
+                'permsCss': _perms_css(conn, owner_id),
+            }
+            if fileset_id is not None:
+                im['filesetId'] = fileset_id
+            if load_pixels:
+                im['sizeX'], im['sizeY'], im['sizeZ'] = row[4:7]
+            if date:
+                if row[7] is not None:
+                    im['date'] = row[7]
+                if row[8] is not None:
+                    im['acqDate'] = row[8]
+            images.append(im)
+
+        if thumb_version and conn is not None and len(images) > 0:
+            from ..tree import _set_thumb_versions
+            service_opts = deepcopy(conn.SERVICE_OPTS)
+            service_opts.setOmeroGroup(-1 if group_id is None else group_id)
+            _set_thumb_versions(conn, images, service_opts)
+        return images
+
+    def image_ids(self, conn, mapann_value, query=False,
+                  case_sensitive=False,
+                  mapann_ns=[], mapann_names=[],
+                  group_id=-1, experimenter_id=-1):
+        if not mapann_value:
+            return []
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value, query=query,
+            case_sensitive=case_sensitive,
+            experimenter_id=experimenter_id, group_id=group_id)
+        q = """
+            SELECT DISTINCT l.image_id %s WHERE %s ORDER BY l.image_id
+            """ % (FROM_CLAUSE, " AND ".join(where_clause))
+        return [r[0] for r in self.execute(q, args)]
+
+    def marshal_images_by_id(self, conn, image_ids, load_pixels=False,
+                             group_id=-1, date=False, thumb_version=False):
+        if not image_ids:
+            return []
+        q = """
+            %s
+            WHERE i.id IN (%s)
+            ORDER BY i.id
+            """ % (IMAGE_SELECT, ",".join("?" * len(image_ids)))
+        return self._marshal_images(conn, self.execute(q, list(image_ids)),
+                                    load_pixels=load_pixels,
+                                    group_id=group_id, date=date,
+                                    thumb_version=thumb_version)
+
+    def load_mapannotation(self, conn, mapann_value,
+                           mapann_ns=[], mapann_names=[],
+                           group_id=-1, experimenter_id=-1,
+                           page=1, limit=None):
+        annotations = []
+        experimenters = {}
+        if not mapann_value:
+            return annotations, []
+
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value,
+            experimenter_id=experimenter_id, group_id=group_id)
+        q = """
+            SELECT DISTINCT a.id, a.ns, a.owner_id, a.date
+            FROM annotation a
+                JOIN mapvalue mv ON mv.ann_id = a.id
+            WHERE %s
+            ORDER BY a.ns, a.id
+            """ % " AND ".join(where_clause)
+        q += _paging(page, limit)
+
+        rows = self.execute(q, args)
+        if not rows:
+            return annotations, []
+
+        ids = [r[0] for r in rows]
+        values = dict((i, []) for i in ids)
+        q = """
+            SELECT ann_id, name, value FROM mapvalue
+            WHERE ann_id IN (%s) ORDER BY ann_id, idx
+            """ % ",".join("?" * len(ids))
+        for ann_id, name, value in self.execute(q, ids):
+            values[ann_id].append([name, value])
+
+        owners = set(r[2] for r in rows)
+        q = """
+            SELECT id, omeName, firstName, lastName FROM experimenter
+            WHERE id IN (%s)
+            """ % ",".join("?" * len(owners))
+        for eid, ome_name, first_name, last_name in \
+                self.execute(q, list(owners)):
+            experimenters[eid] = {
+                'id': eid,
+                'omeName': ome_name,
+                'firstName': first_name,
+                'lastName': last_name,
+            }
+
+        for ann_id, ns, owner_id, ann_date in rows:
+            annotations.append({
+                'id': ann_id,
+                'ns': ns,
+                'description': None,
+                'owner': {'id': owner_id},
+                'date': ann_date,
+                'permissions': {'canDelete': False,
+                                'canAnnotate': False,
+                                'canLink': False,
+                                'canEdit': False},
+                'class': 'MapAnnotationI',
+                'values': values[ann_id],
+            })
+        return annotations, list(experimenters.values())
+
+    def count_annotations(self, conn, mapann_value,
+                          mapann_ns=[], mapann_names=[],
+                          group_id=-1, experimenter_id=-1):
+        if not mapann_value:
+            return 0
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value,
+            experimenter_id=experimenter_id, group_id=group_id)
+        q = """
+            SELECT count(DISTINCT a.id)
+            FROM annotation a
+                JOIN mapvalue mv ON mv.ann_id = a.id
+            WHERE %s
+            """ % " AND ".join(where_clause)
+        return self.execute(q, args)[0][0]
+
+    def marshal_autocomplete(self, conn, mapann_value, query=True,
+                             case_sensitive=False,
+                             mapann_ns=[], mapann_names=None,
+                             group_id=-1, experimenter_id=-1,
+                             page=1, limit=None):
+        autocomplete = []
+        if not mapann_value:
+            return autocomplete
+
+        mapann_value = mapann_value if case_sensitive else mapann_value.lower()
+        _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+        escaped = _escape_chars_like(mapann_value)
+
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            experimenter_id=experimenter_id, group_id=group_id)
+        _q = """
+            SELECT mv.value %s
+            WHERE %s
+            GROUP BY mv.value
+            ORDER BY %s
+            """
+
+        # query by value%
+        q = _q % (FROM_CLAUSE,
+                  " AND ".join(where_clause +
+                               ["%s LIKE ? ESCAPE '\\'" % _cwc]),
+                  "length(mv.value), lower(mv.value)")
+        q += _paging(page, limit)
+        for e in self.execute(q, args + ["%s%%" % escaped]):
+            autocomplete.append({'value': e[0]})
+
+        # query by %value% and exclude value%
+        q = _q % (FROM_CLAUSE,
+                  " AND ".join(where_clause +
+                               ["%s LIKE ? ESCAPE '\\'" % _cwc,
+                                "%s NOT LIKE ? ESCAPE '\\'" % _cwc]),
+                  "lower(mv.value)")
+        q += _paging(page, limit)
+        for e in self.execute(
+                q, args + ["%%%s%%" % escaped, "%s%%" % escaped]):
+            autocomplete.append({'value': e[0]})
+
+        return autocomplete
+
+    def paths_to_object(self, conn, mapann_value,
+                        mapann_ns=[], mapann_names=[],
+                        screen_id=None, plate_id=None,
+                        project_id=None, dataset_id=None,
+                        image_id=None,
+                        experimenter_id=None, group_id=None,
+                        page_size=None, limit=None):
+        where_clause, args = _where(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=mapann_value,
+            experimenter_id=experimenter_id, group_id=group_id)
+
+        columns = []
+        if screen_id or plate_id:
+            columns.append('screen_id')
+            if plate_id:
+                columns.append('plate_id')
+        elif project_id or dataset_id:
+            columns.append('project_id')
+            if dataset_id:
+                columns.append('dataset_id')
+        elif image_id:
+            columns.extend(['screen_id', 'plate_id',
+                            'project_id', 'dataset_id', 'image_id'])
+
+        for column, oid in (('image_id', image_id),
+                            ('screen_id', screen_id),
+                            ('plate_id', plate_id),
+                            ('project_id', project_id),
+                            ('dataset_id', dataset_id)):
+            if oid:
+                where_clause.append("l.%s = ?" % column)
+                args.append(oid)
+                break
+
+        q = """
+            SELECT DISTINCT mv.value, i.owner_id %s
+            %s
+                JOIN image i ON i.id = l.image_id
+            WHERE %s
+            """ % ("".join(", l.%s" % c for c in columns), FROM_CLAUSE,
+                   " AND ".join(where_clause))
+
+        paths = []
+        types = [c[:-3] for c in columns]
+        for row in self.execute(q, args):
+            path = [{'type': 'experimenter', 'id': row[1]},
+                    {'type': 'map', 'id': row[0]}]
+            for t in ('screen', 'plate', 'project', 'dataset', 'image'):
+                if t in types and row[2 + types.index(t)] is not None:
+                    path.append({'type': t, 'id': row[2 + types.index(t)]})
+            paths.append(path)
+        return paths
+
+
+class MemoryBackend(SqliteBackend):
+
+    """
+    Loads the whole SQLite index into a shared in-memory database and
+    serves all requests of the process from that copy, through one
+    read-only connection per thread. The copy is reloaded when the
+    index file is replaced.
+    """
+
+    def __init__(self, path=None):
+        super(MemoryBackend, self).__init__(path)
+        # (inode, uri, connection keeping the in-memory database alive)
+        self._snapshot = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _load(self, inode):
+        ''' Copies the index into a new in-memory database '''
+        self._generation += 1
+        uri = "file:mapr_%d_%d?mode=memory&cache=shared" % (
+            id(self), self._generation)
+        db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        source = self._connect()
+        try:
+            source.backup(db)
+        finally:
+            source.close()
+        return inode, uri, db
+
+    def _current(self):
+        inode = os.stat(self.path).st_ino
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[0] != inode:
+            # only loading a new snapshot is serialized
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot[0] != inode:
+                    snapshot = self._load(inode)
+                    old, self._snapshot = self._snapshot, snapshot
+                    if old is not None:
+                        # freed once the threads moved to the new one
+                        old[2].close()
+        return snapshot
+
+    def execute(self, q, args=()):
+        uri = self._current()[1]
+        if getattr(self._local, 'uri', None) != uri:
+            old = getattr(self._local, 'db', None)
+            if old is not None:
+                old.close()
+            db = sqlite3.connect(uri, uri=True)
+            db.execute("PRAGMA query_only = ON")
+            db.execute("PRAGMA read_uncommitted = ON")
+            db.execute("PRAGMA case_sensitive_like = ON")
+            self._local.db = db
+            self._local.uri = uri
+        logger.debug("SQL QUERY: %s\nARGS: %r" % (q, args))
+        return self._local.db.execute(q, args).fetchall()
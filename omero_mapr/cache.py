@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import json
+import logging
+import time
+
+from django_redis import get_redis_connection
+
+from .mapr_settings import mapr_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+DATA_VERSION_KEY = "mapr.data_version"
+
+# seconds the data version is trusted before redis is asked again
+DATA_VERSION_TTL = 5
+
+_data_version = {'value': None, 'expires': 0}
+
+
+def get_redis():
+    """
+    Return the redis connection used by mapr or None if the
+    default cache is not backed by redis.
+    """
+    try:
+        return get_redis_connection("default")
+    except Exception:
+        logger.debug("Redis cache is not available", exc_info=True)
+        return None
+
+
+def get_data_version():
+    """
+    Return the data version token.
+
+    The token combines omero.web.mapr.data_version, set by admins
+    e.g. on each data release, with a counter stored in redis which
+    is bumped whenever the mapr index is updated. Clients use it to
+    invalidate cached responses.
+    """
+    now = time.time()
+    if _data_version['value'] is not None and \
+            _data_version['expires'] > now:
+        return _data_version['value']
+
+    counter = 0
+    cache = get_redis()
+    if cache is not None:
+        try:
+            counter = int(cache.get(DATA_VERSION_KEY) or 0)
+        except Exception:
+            logger.debug("Failed to read data version", exc_info=True)
+    version = "%s.%d" % (mapr_settings.DATA_VERSION or "0", counter)
+    _data_version['value'] = version
+    _data_version['expires'] = now + DATA_VERSION_TTL
+    return version
+
+
+def bump_data_version():
+    """Invalidate all responses cached against the current data version."""
+    cache = get_redis()
+    if cache is not None:
+        cache.incr(DATA_VERSION_KEY)
+    _data_version['value'] = None
+    return get_data_version()
+
+
+def _versioned(key):
+    return "mapr.%s.%s" % (get_data_version(), key)
+
+
+def cache_get(key):
+    """
+    Return the value cached under key for the current data version
+    or None.
+    """
+    cache = get_redis()
+    if cache is None:
+        return None
+    try:
+        value = cache.get(_versioned(key))
+    except Exception:
+        logger.debug("Failed to read %s" % key, exc_info=True)
+        return None
+    if value is None:
+        return None
+    return json.loads(value)
+
+
+def cache_set(key, value, timeout):
+    """
+    Cache the JSON serializable value under key for the current data
+    version, for timeout seconds.
+    """
+    cache = get_redis()
+    if cache is None or timeout <= 0:
+        return
+    try:
+        cache.setex(_versioned(key), timeout, json.dumps(value))
+    except Exception:
+        logger.debug("Failed to cache %s" % key, exc_info=True)
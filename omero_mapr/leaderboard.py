@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import struct
+import logging
+
+from .cache import get_redis, get_data_version
+from .mapr_settings import mapr_settings
+from .tree import _marshal_map
+from .backends import get_backend
+
+
+logger = logging.getLogger(__name__)
+
+# values ordered by image count, image and child counts packed in
+# parallel so that a page is a slice of both
+VALUES_KEY = "mapr.top.%s.%d.%d.values"
+COUNTS_KEY = "mapr.top.%s.%d.%d.counts"
+META_KEY = "mapr.top.%s.%d.%d.meta"
+
+COUNTS = struct.Struct(">II")
+
+
+def _keys(menu, group_id, experimenter_id):
+    args = (menu, -1 if group_id is None else group_id,
+            -1 if experimenter_id is None else experimenter_id)
+    return VALUES_KEY % args, COUNTS_KEY % args, META_KEY % args
+
+
+def refresh_leaderboard(conn, menu, group_id=-1, experimenter_id=-1,
+                        size=None):
+    ''' Stores the top values of the menu as listed by
+        marshal_mapannotations for orphaned maps, from the point of
+        view of the connected user
+
+        @return Number of values stored
+    '''
+    cache = get_redis()
+    if cache is None:
+        raise RuntimeError("The leaderboard requires the redis cache")
+    if size is None:
+        size = mapr_settings.LEADERBOARD_SIZE
+
+    config = mapr_settings.MENUS[menu]
+    version = get_data_version()
+    maps = get_backend().marshal_mapannotations(
+        conn, None,
+        mapann_ns=config.ns,
+        mapann_names=config.keys,
+        group_id=group_id, experimenter_id=experimenter_id,
+        page=1, limit=size)
+
+    keys = _keys(menu, group_id, experimenter_id)
+    tmp = [k + ".tmp" for k in keys[:2]]
+    pipe = cache.pipeline()
+    pipe.delete(*tmp)
+    if maps:
+        pipe.rpush(tmp[0], *[m['id'] for m in maps])
+        pipe.set(tmp[1], b"".join(
+            COUNTS.pack(m['extra']['counter'], m['childCount'])
+            for m in maps))
+        pipe.rename(tmp[0], keys[0])
+        pipe.rename(tmp[1], keys[1])
+    else:
+        pipe.delete(*keys[:2])
+    pipe.delete(keys[2])
+    pipe.hset(keys[2], 'version', version)
+    pipe.hset(keys[2], 'user', conn.getUserId())
+    pipe.hset(keys[2], 'truncated', int(len(maps) >= size))
+    pipe.execute()
+    return len(maps)
+
+
+def load_leaderboard(conn, menu, group_id=-1, experimenter_id=-1,
+                     page=1, limit=None):
+    ''' Returns a page of the leaderboard, marshalled as
+        marshal_mapannotations does, or None if the page is not
+        available for the current data version or the board was built
+        by another user, who may see other data. Anonymous sessions
+        run as the public user and get the boards built by it.
+    '''
+    cache = get_redis()
+    if cache is None or page is None or page < 1 or not limit:
+        return None
+    values_key, counts_key, meta_key = _keys(
+        menu, group_id, experimenter_id)
+    start = (page - 1) * limit
+    try:
+        pipe = cache.pipeline()
+        pipe.hgetall(meta_key)
+        pipe.llen(values_key)
+        pipe.lrange(values_key, start, start + limit - 1)
+        pipe.getrange(counts_key, start * COUNTS.size,
+                      (start + limit) * COUNTS.size - 1)
+        meta, size, values, counts = pipe.execute()
+    except Exception:
+        logger.debug("Failed to read leaderboard", exc_info=True)
+        return None
+
+    version = meta.get(b'version')
+    if version is None or version.decode('utf-8') != get_data_version():
+        return None
+    user = meta.get(b'user')
+    if user is None or int(user) != conn.getUserId():
+        return None
+    # pages past the end of a truncated board are not known
+    if start + limit > size and meta.get(b'truncated') == b'1':
+        return None
+
+    mapannotations = []
+    for i, value in enumerate(values):
+        value = value.decode('utf-8')
+        c, child_count = COUNTS.unpack_from(counts, i * COUNTS.size)
+        mt = _marshal_map(conn, [value, "%s (%d)" % (value, c), None,
+                                 experimenter_id, {}, None, child_count])
+        mt.update({'extra': {'counter': c}})
+        mapannotations.append(mt)
+    return mapannotations
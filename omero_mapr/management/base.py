@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+from django.core.management.base import BaseCommand, CommandError
+
+from omero.gateway import BlitzGateway
+
+
+class GatewayCommand(BaseCommand):
+
+    """
+    Base of the mapr commands reading data from OMERO.server.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--port', type=int, default=4064)
+        parser.add_argument('--user', required=True)
+        parser.add_argument('--password', required=True)
+
+    def connect(self, options):
+        conn = BlitzGateway(options['user'], options['password'],
+                            host=options['host'], port=options['port'],
+                            secure=True)
+        if not conn.connect():
+            raise CommandError("Cannot connect to %s" % options['host'])
+        return conn
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+from django.core.management.base import CommandError
+
+from ..base import GatewayCommand
+from ...mapr_settings import mapr_settings
+from ...backends.builder import IndexBuilder
+
+
+class Command(GatewayCommand):
+
+    help = ("Build the SQLite index served by the sqlite and memory"
+            " mapr backends.")
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--path', default=None,
+            help="Index file, defaults to omero.web.mapr.index_path")
+
+    def handle(self, *args, **options):
+        namespaces = set()
+        for menu in mapr_settings.MENUS.values():
+            namespaces.update(menu.ns)
+        if not namespaces:
+            raise CommandError("omero.web.mapr.config has no namespaces")
+
+        conn = self.connect(options)
+        try:
+            path = options['path'] or mapr_settings.INDEX_PATH
+            IndexBuilder(conn, path, namespaces).build()
+        finally:
+            conn.close()
+        self.stdout.write("Index written to %s" % path)
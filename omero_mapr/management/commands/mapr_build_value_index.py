@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import os
+
+from django.core.management.base import CommandError
+
+from ..base import GatewayCommand
+from ...mapr_settings import mapr_settings
+from ...cache import bump_data_version
+from ...valueindex import build_value_index, update_value_index
+
+
+class Command(GatewayCommand):
+
+    help = ("Write the value indexes of the mapr menus to"
+            " omero.web.mapr.value_index_dir. The indexes are only"
+            " served to the user they are built as, connect as the"
+            " public user to serve the anonymous sessions.")
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--menu', action='append',
+            help="Menu to index, defaults to all the menus")
+        parser.add_argument(
+            '--update', action='store_true',
+            help="Only apply the changes logged since the indexes were"
+                 " written, building the missing ones")
+
+    def handle(self, *args, **options):
+        directory = mapr_settings.VALUE_INDEX_DIR
+        if not directory:
+            raise CommandError("omero.web.mapr.value_index_dir is not set")
+        menus = options['menu'] or list(mapr_settings.CONFIG)
+        for menu in menus:
+            if menu not in mapr_settings.CONFIG:
+                raise CommandError("Unknown menu %s" % menu)
+
+        conn = self.connect(options)
+        try:
+            written = False
+            for menu in menus:
+                path = os.path.join(directory, "%s.idx" % menu)
+                if options['update'] and os.path.exists(path):
+                    count = update_value_index(conn, menu, path)
+                    self.stdout.write("%s: %d links updated" % (menu, count))
+                    written = written or count > 0
+                else:
+                    count = build_value_index(conn, menu, path)
+                    self.stdout.write("%s: %d values" % (menu, count))
+                    written = True
+            # the cached responses may hold counts of the replaced files
+            if written:
+                bump_data_version()
+        finally:
+            conn.close()
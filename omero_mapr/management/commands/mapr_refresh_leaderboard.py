@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+from django.core.management.base import CommandError
+
+from ..base import GatewayCommand
+from ...mapr_settings import mapr_settings
+from ...leaderboard import refresh_leaderboard
+
+
+class Command(GatewayCommand):
+
+    help = ("Refresh the top values listed by the wildcard mapr menus."
+            " The lists are only served to the user they are refreshed"
+            " as, connect as the public user to serve the anonymous"
+            " sessions.")
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--menu', action='append',
+            help="Menu to refresh, defaults to all the wildcard menus")
+        parser.add_argument('--group', type=int, default=-1)
+        parser.add_argument('--experimenter', type=int, default=-1)
+        parser.add_argument(
+            '--size', type=int, default=None,
+            help="Defaults to omero.web.mapr.leaderboard_size")
+
+    def handle(self, *args, **options):
+        menus = options['menu'] or [
+            m.menu for m in mapr_settings.MENUS.values() if m.wildcard]
+        for menu in menus:
+            if menu not in mapr_settings.MENUS:
+                raise CommandError("Unknown menu %s" % menu)
+
+        conn = self.connect(options)
+        try:
+            for menu in menus:
+                count = refresh_leaderboard(
+                    conn, menu, group_id=options['group'],
+                    experimenter_id=options['experimenter'],
+                    size=options['size'])
+                self.stdout.write("%s: %d values" % (menu, count))
+        finally:
+            conn.close()
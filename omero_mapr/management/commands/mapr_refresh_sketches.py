@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+from django.core.management.base import CommandError
+
+from ..base import GatewayCommand
+from ...mapr_settings import mapr_settings
+from ...sketches import refresh_sketches
+
+
+class Command(GatewayCommand):
+
+    help = ("Refresh the HyperLogLog sketches used to estimate the"
+            " number of values of the mapr menus.")
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--menu', action='append',
+            help="Menu to refresh, defaults to all the menus")
+
+    def handle(self, *args, **options):
+        menus = options['menu'] or list(mapr_settings.CONFIG)
+        for menu in menus:
+            if menu not in mapr_settings.CONFIG:
+                raise CommandError("Unknown menu %s" % menu)
+
+        conn = self.connect(options)
+        try:
+            for menu in menus:
+                count = refresh_sketches(conn, menu)
+                self.stdout.write("%s: %d sketches" % (menu, count))
+        finally:
+            conn.close()
@@ -22,10 +22,14 @@
 
 import sys
 import os
+import json
+import tempfile
 
 from django.conf import settings
 from omeroweb.settings import process_custom_settings, report_settings
-from omero_mapr.utils import config_list_to_dict
+from omeroweb.settings import parse_boolean
+from omero_mapr.utils import config_list_to_dict, compile_menus
+from omero_mapr.utils.encoder import check_encoder
 
 
 # load settings
@@ -46,6 +50,186 @@ MAPR_SETTINGS_MAPPING = {
                 " Icons are cached in redis which must be available."
             )
          ],
+    "omero.web.mapr.data_version":
+        ["MAPR_DATA_VERSION",
+         "",
+         str,
+         (
+             "Token identifying the current release of the data, e.g."
+             " the IDR release name. Changing it invalidates responses"
+             " cached by the mapr clients."
+         )
+         ],
+    "omero.web.mapr.server_timing":
+        ["MAPR_SERVER_TIMING",
+         "false",
+         parse_boolean,
+         (
+             "Return the time spent parsing parameters, running each"
+             " query, marshalling and encoding JSON in the Server-Timing"
+             " header of mapr responses."
+         )
+         ],
+    "omero.web.mapr.profile_dir":
+        ["MAPR_PROFILE_DIR",
+         tempfile.gettempdir(),
+         str,
+         (
+             "Directory where profiles requested by admins with"
+             " mapr_profile=true are saved."
+         )
+         ],
+    "omero.web.mapr.slow_query_threshold":
+        ["MAPR_SLOW_QUERY_THRESHOLD",
+         1000,
+         int,
+         (
+             "Queries taking longer than this many milliseconds are"
+             " logged as JSON to the omero_mapr.slow_query logger."
+             " Set to -1 to disable."
+         )
+         ],
+    "omero.web.mapr.backend":
+        ["MAPR_BACKEND",
+         "omero_mapr.backends.hql.HqlBackend",
+         str,
+         (
+             "Class serving the mapr queries. The default runs HQL through"
+             " the OMERO query service; omero_mapr.backends.sqlite."
+             "SqliteBackend and MemoryBackend serve a read-only index"
+             " built by the mapr_build_index management command."
+         )
+         ],
+    "omero.web.mapr.index_path":
+        ["MAPR_INDEX_PATH",
+         os.path.join(tempfile.gettempdir(), "mapr_index.sqlite"),
+         str,
+         (
+             "Location of the SQLite index used by the sqlite and"
+             " memory backends."
+         )
+         ],
+    "omero.web.mapr.postgres_dsn":
+        ["MAPR_POSTGRES_DSN",
+         "",
+         str,
+         (
+             "libpq connection string of a read-only user of the OMERO"
+             " database, used by omero_mapr.backends.postgres."
+             "PostgresBackend."
+         )
+         ],
+    "omero.web.mapr.postgres_pool_size":
+        ["MAPR_POSTGRES_POOL_SIZE",
+         4,
+         int,
+         (
+             "Maximum number of connections opened by the postgres backend."
+             " Queries wait for a free connection until their deadline."
+         )
+         ],
+    "omero.web.mapr.max_workers":
+        ["MAPR_MAX_WORKERS",
+         8,
+         int,
+         (
+             "Threads per process running independent queries of a mapr"
+             " request concurrently, e.g. screens and projects."
+             " Set to 0 to run them one after another."
+         )
+         ],
+    "omero.web.mapr.show_cache_timeout":
+        ["MAPR_SHOW_CACHE_TIMEOUT",
+         3600,
+         int,
+         (
+             "Seconds the objects and tree paths resolved for ?show= and"
+             " ?value= links are cached in redis. Set to 0 to disable."
+         )
+         ],
+    "omero.web.mapr.leaderboard_size":
+        ["MAPR_LEADERBOARD_SIZE",
+         1000,
+         int,
+         (
+             "Number of top values of the wildcard menus stored by the"
+             " mapr_refresh_leaderboard command."
+         )
+         ],
+    "omero.web.mapr.value_index_dir":
+        ["MAPR_VALUE_INDEX_DIR",
+         "",
+         str,
+         (
+             "Directory of the value indexes written by the"
+             " mapr_build_value_index command, one <menu>.idx file per"
+             " menu. The indexes are shared by the OMERO.web workers"
+             " through mmap. Empty to disable them."
+         )
+         ],
+    "omero.web.mapr.query_timeouts":
+        ["MAPR_QUERY_TIMEOUTS",
+         '{"default": 60}',
+         json.loads,
+         (
+             "Seconds each mapr view may spend querying, keyed by view"
+             " name, e.g. {\"default\": 60, \"api_search\": 10}."
+             " Queries still running at the deadline are abandoned and"
+             " the view returns 503. 0 disables the deadline."
+         )
+         ],
+    "omero.web.mapr.max_rows":
+        ["MAPR_MAX_ROWS",
+         100000,
+         int,
+         (
+             "Maximum number of rows returned by an unpaged mapr query."
+             " Responses built from truncated results carry the"
+             " X-Mapr-Truncated header. 0 for no limit."
+         )
+         ],
+    "omero.web.mapr.rate_limits":
+        ["MAPR_RATE_LIMITS",
+         '{"cheap": [20, 200], "expensive": [5, 50]}',
+         json.loads,
+         (
+             "Token buckets of the mapr endpoints as [requests per"
+             " second, burst] per budget, counted per user or, for the"
+             " public user, per client IP in redis. \"cheap\" covers"
+             " the config and favicon, \"expensive\" the queries."
+             " Remove a budget to leave its endpoints unlimited."
+         )
+         ],
+    "omero.web.mapr.trusted_proxies":
+        ["MAPR_TRUSTED_PROXIES",
+         0,
+         int,
+         (
+             "Number of reverse proxies in front of OMERO.web appending"
+             " to X-Forwarded-For. The public user is rate limited by"
+             " the address the outermost one saw, by REMOTE_ADDR if 0."
+         )
+         ],
+    "omero.web.mapr.shed_load":
+        ["MAPR_SHED_LOAD",
+         "false",
+         parse_boolean,
+         (
+             "Reject expensive mapr requests of the public user with 503"
+             " while all the omero.web.mapr.max_workers threads are busy"
+             " and as many expensive requests are in progress in the"
+             " process, keeping capacity for logged in users."
+         )
+         ],
+    "omero.web.mapr.json_encoder":
+        ["MAPR_JSON_ENCODER",
+         "auto",
+         check_encoder,
+         (
+             "Encoder of the mapr JSON responses: orjson, json or auto"
+             " to use orjson when it is installed."
+         )
+         ],
     }
 
 
@@ -67,6 +251,47 @@ class MaprSettings(object):
                                      MAPR_DEFAULT_FAVICON)  # noqa
     FAVICON_WEBSERVICE = prefix_setting('FAVICON_WEBSERVICE',
                                         MAPR_FAVICON_WEBSERVICE)  # noqa
+    DATA_VERSION = prefix_setting('DATA_VERSION', MAPR_DATA_VERSION)  # noqa
+    SERVER_TIMING = prefix_setting('SERVER_TIMING',
+                                   MAPR_SERVER_TIMING)  # noqa
+    PROFILE_DIR = prefix_setting('PROFILE_DIR', MAPR_PROFILE_DIR)  # noqa
+    SLOW_QUERY_THRESHOLD = prefix_setting('SLOW_QUERY_THRESHOLD',
+                                          MAPR_SLOW_QUERY_THRESHOLD)  # noqa
+    BACKEND = prefix_setting('BACKEND', MAPR_BACKEND)  # noqa
+    INDEX_PATH = prefix_setting('INDEX_PATH', MAPR_INDEX_PATH)  # noqa
+    POSTGRES_DSN = prefix_setting('POSTGRES_DSN', MAPR_POSTGRES_DSN)  # noqa
+    POSTGRES_POOL_SIZE = prefix_setting('POSTGRES_POOL_SIZE',
+                                        MAPR_POSTGRES_POOL_SIZE)  # noqa
+    MAX_WORKERS = prefix_setting('MAX_WORKERS', MAPR_MAX_WORKERS)  # noqa
+    SHOW_CACHE_TIMEOUT = prefix_setting('SHOW_CACHE_TIMEOUT',
+                                        MAPR_SHOW_CACHE_TIMEOUT)  # noqa
+    LEADERBOARD_SIZE = prefix_setting('LEADERBOARD_SIZE',
+                                      MAPR_LEADERBOARD_SIZE)  # noqa
+    VALUE_INDEX_DIR = prefix_setting('VALUE_INDEX_DIR',
+                                     MAPR_VALUE_INDEX_DIR)  # noqa
+    QUERY_TIMEOUTS = prefix_setting('QUERY_TIMEOUTS',
+                                    MAPR_QUERY_TIMEOUTS)  # noqa
+    MAX_ROWS = prefix_setting('MAX_ROWS', MAPR_MAX_ROWS)  # noqa
+    RATE_LIMITS = prefix_setting('RATE_LIMITS', MAPR_RATE_LIMITS)  # noqa
+    TRUSTED_PROXIES = prefix_setting('TRUSTED_PROXIES',
+                                     MAPR_TRUSTED_PROXIES)  # noqa
+    SHED_LOAD = prefix_setting('SHED_LOAD', MAPR_SHED_LOAD)  # noqa
+    JSON_ENCODER = prefix_setting('JSON_ENCODER', MAPR_JSON_ENCODER)  # noqa
+
+    _menus = (None, None)
+
+    @property
+    def MENUS(self):
+        """
+        The menus of CONFIG compiled by omero_mapr.utils.compile_menus,
+        once per CONFIG.
+        """
+        config, menus = self._menus
+        if config is not self.CONFIG:
+            config = self.CONFIG
+            menus = compile_menus(config)
+            MaprSettings._menus = (config, menus)
+        return menus
 
 
 mapr_settings = MaprSettings()
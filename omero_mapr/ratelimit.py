@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import math
+import time
+import logging
+
+from functools import wraps
+
+from django.http import HttpResponse
+
+from .cache import get_redis
+from .mapr_settings import mapr_settings
+from .utils.executor import in_progress, overloaded
+
+
+logger = logging.getLogger(__name__)
+
+CHEAP = 'cheap'
+EXPENSIVE = 'expensive'
+
+# token bucket of a budget per client
+BUCKET_KEY = "mapr.rl.%s.%s"
+
+# refills the bucket for the time elapsed since the last request and
+# takes a token if one is left, returns [allowed, tokens left]
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+_scripts = {}
+
+
+def client_key(request, conn=None):
+    ''' Returns the key requests are counted by: the user id or, for
+        the public user, the client address. Behind trusted proxies the
+        address is the X-Forwarded-For entry added by the outermost
+        one, the entries before it being set by the client.
+    '''
+    if conn is not None and not conn.isAnonymous():
+        return "u%d" % conn.getUserId()
+    address = request.META.get('REMOTE_ADDR', '')
+    proxies = mapr_settings.TRUSTED_PROXIES
+    if proxies > 0:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+        if len(forwarded) >= proxies:
+            address = forwarded[-proxies].strip() or address
+    return "ip%s" % address
+
+
+def take_token(budget, key):
+    ''' Takes a token from the bucket of the client for the budget.
+
+        Requests are allowed if the budget is not configured or redis
+        is not available.
+
+        @return Seconds to wait before retrying or 0 if allowed
+    '''
+    limit = mapr_settings.RATE_LIMITS.get(budget)
+    if not limit:
+        return 0
+    rate, burst = float(limit[0]), float(limit[1])
+    cache = get_redis()
+    if cache is None or rate <= 0:
+        return 0
+    try:
+        script = _scripts.get(id(cache))
+        if script is None:
+            script = cache.register_script(TOKEN_BUCKET)
+            _scripts[id(cache)] = script
+        allowed, tokens = script(keys=[BUCKET_KEY % (budget, key)],
+                                 args=[rate, burst, time.time()])
+    except Exception:
+        logger.warning("Rate limit not applied", exc_info=True)
+        return 0
+    if allowed:
+        return 0
+    return int(math.ceil((1 - float(tokens)) / rate)) or 1
+
+
+def _retry_response(status, message, retry_after):
+    response = HttpResponse(message, status=status,
+                            content_type='text/plain')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limited(budget):
+    ''' Limits the requests of each client to the view by the token
+        bucket of the budget and, when the process is overloaded,
+        sheds the expensive requests of the public user first.
+
+        Goes below login_required so that the gateway is known.
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            conn = kwargs.get('conn')
+            anonymous = conn is None or conn.isAnonymous()
+            if budget == EXPENSIVE and anonymous and \
+                    mapr_settings.SHED_LOAD and overloaded():
+                return _retry_response(
+                    503, 'Server busy, please retry later', 5)
+            retry_after = take_token(budget, client_key(request, conn))
+            if retry_after:
+                return _retry_response(
+                    429, 'Too many requests', retry_after)
+            if budget != EXPENSIVE:
+                return view(request, *args, **kwargs)
+            with in_progress():
+                return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -20,18 +20,22 @@
 #
 # Version: 1.0
 
+import json
+import hashlib
 import logging
 import omero
+import omero.gateway
 
 from copy import deepcopy
 
 from django.conf import settings
 from .mapr_settings import mapr_settings
+from .cache import cache_get, cache_set
 
-from omero.rtypes import rint, rlong, unwrap
+from omero.rtypes import rint, rlong, rlist, unwrap
 
 import omeroweb.webclient.show as omeroweb_show
-from .tree import _set_parameters
+from .tree import _set_parameters, _query, _hql
 
 from omeroweb.utils import reverse_with_params
 
@@ -77,6 +81,10 @@ class MapShow(omeroweb_show.Show):
             )
         # if in mapr app hierachy is different
         if self.menu in mapr_settings.CONFIG:
+            cache_key = self._cache_key()
+            cached = cache_get(cache_key)
+            if cached is not None:
+                return self._load_cached(cached)
             first_selected = None
             try:
                 key = m.group('key')
@@ -103,9 +111,58 @@ class MapShow(omeroweb_show.Show):
                     m = self.PATH_REGEX.match(self._initially_open[0])
                     if m.group('object_type') == 'image':
                         self._initially_open.insert(0, "orphaned-0")
+            if first_selected is not None:
+                self._cache(cache_key, first_selected)
             return first_selected
         return super(MapShow, self)._find_first_selected()
 
+    def _cache_key(self):
+        """
+        Objects are resolved in the context of the user and group,
+        the key identifies the requested paths in that context.
+        """
+        key = [self.menu, self.conn.getUserId(),
+               self.conn.SERVICE_OPTS.getOmeroGroup()]
+        key.extend(self._initially_select)
+        return "show.%s" % hashlib.sha1(
+            json.dumps(key).encode('utf-8')).hexdigest()
+
+    def _cache(self, cache_key, first_selected):
+        try:
+            obj = first_selected._obj
+            cached = {
+                'class': obj.__class__.__name__,
+                'id': obj.id.val,
+                'owner': obj.details.owner.id.val,
+                'group': obj.details.group.id.val,
+                'initially_select': self._initially_select,
+                'initially_open': self._initially_open,
+                'initially_open_owner': self._initially_open_owner,
+            }
+        except Exception:
+            logger.debug("Cannot cache %r" % first_selected, exc_info=True)
+            return
+        cache_set(cache_key, cached, mapr_settings.SHOW_CACHE_TIMEOUT)
+
+    def _load_cached(self, cached):
+        """
+        Restores the tree state and returns a stub of the first selected
+        object, only its id, owner and group are known.
+        """
+        self._initially_select = cached['initially_select']
+        self._initially_open = cached['initially_open']
+        self._initially_open_owner = cached['initially_open_owner']
+        # as when resolving, leave the context 'cross-group'
+        self.conn.SERVICE_OPTS.setOmeroGroup('-1')
+        obj = getattr(omero.model, cached['class'])(cached['id'], True)
+        obj.details.setOwner(
+            omero.model.ExperimenterI(cached['owner'], False))
+        obj.details.setGroup(
+            omero.model.ExperimenterGroupI(cached['group'], False))
+        if isinstance(obj, omero.model.MapAnnotationI):
+            return omero.gateway.MapAnnotationWrapper(self.conn, obj)
+        return omero.gateway.BlitzObjectWrapper(self.conn, obj)
+
     def _load_first_selected(self, first_obj, attributes):
         first_selected = None
         if first_obj in ["map"]:
@@ -134,8 +191,7 @@ class MapShow(omeroweb_show.Show):
                  "WHERE mv.value = :mvalue")
 
             qs = self.conn.getQueryService()
-            logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-            m = qs.findByQuery(q, params, service_opts)
+            m = _query(qs.findByQuery, q, params, service_opts)
             # hardcode to always tell to load all users
             return omero.gateway.MapAnnotationWrapper(self.conn, m)
 
@@ -181,7 +237,7 @@ def mapr_paths_to_object(conn, mapann_value,
         q_select.append(" COALESCE(sl.parent.id,null) as screen_id, "
                         " COALESCE(pdl.parent.id,null) as project_id, "
                         " COALESCE(pl.id,null) as plate_id, "
-                        " COALESCE(ds.id,null) as dataset_id "
+                        " COALESCE(ds.id,null) as dataset_id, "
                         " i.id as image_id, ")
 
     if q_select:
@@ -256,13 +312,12 @@ def mapr_paths_to_object(conn, mapann_value,
     if q_groupby:
         q.append(", " + ", ".join(q_groupby))
 
-    query = "".join(q)
+    query = _hql("".join(q))
 
     # Hierarchies for this object
     paths = []
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (query, params))
-    for e in unwrap(qs.projection(query, params, service_opts)):
+    for e in unwrap(_query(qs.projection, query, params, service_opts)):
         path = []
 
         # Experimenter is always present
@@ -331,3 +386,111 @@ def mapr_paths_to_object(conn, mapann_value,
             pass
         paths.append(path)
     return paths
+
+
+PATH_TYPES = ('screen', 'plate', 'project', 'dataset', 'image')
+
+SCREEN_PATHS = """
+    select distinct mv.value, i.details.owner.id, sl.parent.id, pl.id %s
+    from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+        join ial.parent i join i.wellSamples ws join ws.well w
+        join w.plate pl join pl.screenLinks sl
+    where %s
+    """
+
+PROJECT_PATHS = """
+    select distinct mv.value, i.details.owner.id, pdl.parent.id, ds.id %s
+    from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+        join ial.parent i join i.datasetLinks dil join dil.parent ds
+        join ds.projectLinks pdl
+    where %s
+    """
+
+
+def mapr_paths_to_objects(conn, mapann_value,
+                          mapann_ns=[], mapann_names=[],
+                          screen_ids=[], plate_ids=[],
+                          project_ids=[], dataset_ids=[],
+                          image_ids=[],
+                          experimenter_id=None, group_id=None):
+    ''' Finds the paths to many objects of mixed types at once.
+
+        Runs at most four queries: containers and images of the
+        screen and of the project hierarchies.
+
+        @return Dictionary of the paths keyed by "type-id", e.g.
+        "image-1", in the format of mapr_paths_to_object
+    '''
+
+    qs = conn.getQueryService()
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+    if group_id is not None:
+        service_opts.setOmeroGroup(group_id)
+
+    ids = {
+        'screen': set(screen_ids or []),
+        'plate': set(plate_ids or []),
+        'project': set(project_ids or []),
+        'dataset': set(dataset_ids or []),
+        'image': set(image_ids or []),
+    }
+    found = dict(("%s-%s" % (t, i), set())
+                 for t in PATH_TYPES for i in ids[t])
+
+    def _run(template, filters, images):
+        params, where_clause = _set_parameters(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            query=False, mapann_value=mapann_value,
+            params=None, experimenter_id=experimenter_id,
+            page=None)
+        clauses = []
+        for column, name, values in filters:
+            if values:
+                params.add(name, rlist([rlong(v) for v in values]))
+                clauses.append("%s in (:%s)" % (column, name))
+        if not clauses:
+            return []
+        where_clause.append("(%s)" % " or ".join(clauses))
+        q = _hql(template, ", i.id" if images else "", where_clause)
+        return unwrap(_query(qs.projection, q, params, service_opts))
+
+    # Screen and plate rows: value, owner, screen, plate
+    for value, owner, sid, pid in _run(
+            SCREEN_PATHS, [("sl.parent.id", "sids", ids['screen']),
+                           ("pl.id", "pids", ids['plate'])], False):
+        if sid in ids['screen']:
+            found["screen-%s" % sid].add(
+                (owner, value, ('screen', sid)))
+        if pid in ids['plate']:
+            found["plate-%s" % pid].add(
+                (owner, value, ('screen', sid), ('plate', pid)))
+
+    # Project and dataset rows: value, owner, project, dataset
+    for value, owner, pid, did in _run(
+            PROJECT_PATHS, [("pdl.parent.id", "pids", ids['project']),
+                            ("ds.id", "dids", ids['dataset'])], False):
+        if pid in ids['project']:
+            found["project-%s" % pid].add(
+                (owner, value, ('project', pid)))
+        if did in ids['dataset']:
+            found["dataset-%s" % did].add(
+                (owner, value, ('project', pid), ('dataset', did)))
+
+    # Image rows: value, owner, screen or project, plate or dataset, image
+    for template, parents in ((SCREEN_PATHS, ('screen', 'plate')),
+                              (PROJECT_PATHS, ('project', 'dataset'))):
+        for value, owner, cid, pid, iid in _run(
+                template, [("i.id", "iids", ids['image'])], True):
+            found["image-%s" % iid].add(
+                (owner, value, (parents[0], cid), (parents[1], pid),
+                 ('image', iid)))
+
+    paths = {}
+    for key, rows in found.items():
+        paths[key] = []
+        for row in sorted(rows, key=lambda r: (r[0], r[1])):
+            path = [{'type': 'experimenter', 'id': row[0]},
+                    {'type': 'map', 'id': row[1]}]
+            path.extend({'type': t, 'id': i} for t, i in row[2:])
+            paths[key].append(path)
+    return paths
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import logging
+
+from copy import deepcopy
+
+import omero
+from omero.rtypes import unwrap
+
+from .cache import get_redis
+from .mapr_settings import mapr_settings
+from .tree import _set_parameters, _query, _hql
+
+
+logger = logging.getLogger(__name__)
+
+# HyperLogLog of the values of a menu per group and owner
+SKETCH_KEY = "mapr.hll.%s.%d.%d"
+# set of the sketches of a menu
+SKETCH_INDEX = "mapr.hll.%s"
+
+BATCH_SIZE = 10000
+
+
+def _parse_key(key):
+    if isinstance(key, bytes):
+        key = key.decode('utf-8')
+    group_id, owner_id = key.rsplit('.', 2)[1:]
+    return key, int(group_id), int(owner_id)
+
+
+def _private_groups(conn, ctx):
+    ''' Returns the groups of the user where they only see their own
+        data: private groups they do not lead '''
+    ids = set(ctx.memberOfGroups) - set(ctx.leaderOfGroups)
+    if not ids:
+        return set()
+    params = omero.sys.ParametersI()
+    params.addIds(list(ids))
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+    service_opts.setOmeroGroup(-1)
+    groups = conn.getQueryService().findAllByQuery(
+        "select g from ExperimenterGroup g where g.id in (:ids)",
+        params, service_opts)
+    return set(g.id.val for g in groups
+               if not g.details.permissions.isGroupRead())
+
+
+def estimate_count(conn, menu, group_id=-1, experimenter_id=-1):
+    ''' Estimates the number of distinct values of the menu from the
+        sketches built by refresh_sketches, as count_mapannotations
+        would count without a value.
+
+        Only the groups the user is member of are counted and, in
+        private groups the user does not lead, only their own values.
+
+        @return The estimate or None if no sketches are available
+    '''
+    cache = get_redis()
+    if cache is None:
+        return None
+    try:
+        keys = cache.smembers(SKETCH_INDEX % menu)
+    except Exception:
+        logger.debug("Failed to read sketches of %s" % menu, exc_info=True)
+        return None
+    if not keys:
+        return None
+
+    if conn.isAdmin():
+        visible = None
+        private = set()
+    else:
+        ctx = conn.getEventContext()
+        visible = set(ctx.memberOfGroups)
+        private = _private_groups(conn, ctx)
+
+    selected = []
+    for key, gid, oid in (_parse_key(k) for k in keys):
+        if visible is not None and gid not in visible:
+            continue
+        if gid in private and oid != conn.getUserId():
+            continue
+        if group_id is not None and group_id != -1 and gid != group_id:
+            continue
+        if experimenter_id is not None and experimenter_id != -1 \
+                and oid != experimenter_id:
+            continue
+        selected.append(key)
+    if not selected:
+        return 0
+    # the count of several HyperLogLogs is the count of their union
+    return cache.pfcount(*selected)
+
+
+def refresh_sketches(conn, menu):
+    ''' Rebuilds the sketches of the menu from all the values linked
+        to images in screens or datasets, in the same way as
+        count_mapannotations
+
+        @return Number of sketches written
+    '''
+    cache = get_redis()
+    if cache is None:
+        raise RuntimeError("Sketches require the redis cache")
+
+    config = mapr_settings.MENUS[menu]
+    qs = conn.getQueryService()
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+    service_opts.setOmeroGroup(-1)
+
+    q = """
+        select distinct mv.value, a.details.group.id, a.details.owner.id
+        from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+            join ial.parent i
+            left outer join i.wellSamples ws
+            left outer join i.datasetLinks dil
+        where %s AND
+         (
+             (ws is not null)
+             OR
+             (dil is not null)
+         )
+        order by mv.value, a.details.group.id, a.details.owner.id
+        """
+
+    sketches = set()
+    page = 1
+    while True:
+        params, where_clause = _set_parameters(
+            mapann_ns=config.ns,
+            mapann_names=config.keys,
+            params=None, page=page, limit=BATCH_SIZE)
+        rows = unwrap(_query(qs.projection, _hql(q, where_clause),
+                             params, service_opts))
+        values = {}
+        for value, gid, oid in rows:
+            values.setdefault(
+                SKETCH_KEY % (menu, gid, oid), []).append(value)
+        pipe = cache.pipeline()
+        for key, v in values.items():
+            if key not in sketches:
+                pipe.delete(key + ".tmp")
+                sketches.add(key)
+            pipe.pfadd(key + ".tmp", *v)
+        pipe.execute()
+        if len(rows) < BATCH_SIZE:
+            break
+        page += 1
+
+    index = SKETCH_INDEX % menu
+    previous = set(_parse_key(k)[0] for k in cache.smembers(index))
+    pipe = cache.pipeline()
+    for key in sketches:
+        pipe.rename(key + ".tmp", key)
+    for key in previous - sketches:
+        pipe.delete(key)
+    pipe.delete(index)
+    if sketches:
+        pipe.sadd(index, *sketches)
+    pipe.execute()
+    return len(sketches)
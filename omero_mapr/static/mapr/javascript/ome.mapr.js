@@ -105,6 +105,201 @@ $(function () {
     };
 
 
+    // ----- Cache -----
+    // Children of screens, projects, datasets and plates are kept in a
+    // bounded cache keyed by URL, so collapsing and re-expanding a node
+    // doesn't fetch them again. The cache is dropped when the server
+    // reports a new data version.
+    MAPANNOTATIONS.CACHE = (function() {
+        var maxSize = 200;
+        var entries = new Map();
+        var dataVersion = null;
+
+        function key(url) {
+            // ignore jQuery cache busting and the order of parameters
+            var parts = url.split('?');
+            var params = (parts[1] || '').split('&').filter(function(p) {
+                return p.length > 0 && p.indexOf('_=') !== 0;
+            });
+            params.sort();
+            return parts[0] + '?' + params.join('&');
+        }
+
+        return {
+            get: function(url) {
+                var k = key(url);
+                if (!entries.has(k)) {
+                    return undefined;
+                }
+                // most recently used entries are kept at the end
+                var text = entries.get(k);
+                entries.delete(k);
+                entries.set(k, text);
+                return text;
+            },
+            set: function(url, text) {
+                var k = key(url);
+                entries.delete(k);
+                entries.set(k, text);
+                while (entries.size > maxSize) {
+                    entries.delete(entries.keys().next().value);
+                }
+            },
+            setVersion: function(version) {
+                if (!version || version === dataVersion) {
+                    return;
+                }
+                if (dataVersion !== null) {
+                    entries.clear();
+                }
+                dataVersion = version;
+            },
+            clear: function() {
+                entries.clear();
+            }
+        };
+    })();
+
+    function isCacheable(url) {
+        var urls = [WEBCLIENT.URLS.api_plates,
+                    WEBCLIENT.URLS.api_datasets,
+                    WEBCLIENT.URLS.api_images,
+                    MAPANNOTATIONS.URLS.facets];
+        return urls.some(function(u) {
+            return url.split('?')[0] === u;
+        });
+    }
+
+    // serve cached children without going to the server
+    $.ajaxTransport('+*', function(options) {
+        if (options.type !== 'GET' || !isCacheable(options.url)) {
+            return;
+        }
+        var text = MAPANNOTATIONS.CACHE.get(options.url);
+        if (text === undefined) {
+            return;
+        }
+        return {
+            send: function(headers, complete) {
+                complete(200, 'success', {'text': text},
+                         'Content-Type: application/json\r\n');
+            },
+            abort: function() {}
+        };
+    });
+
+    $(document).ajaxSuccess(function(event, xhr, settings) {
+        MAPANNOTATIONS.CACHE.setVersion(
+            xhr.getResponseHeader('X-Mapr-Data-Version'));
+        if (settings.type !== 'GET') {
+            return;
+        }
+        if (isCacheable(settings.url)) {
+            MAPANNOTATIONS.CACHE.set(settings.url, xhr.responseText);
+        } else if (settings.url.split('?')[0] === WEBCLIENT.URLS.tree_top_level) {
+            prefetchChildren(xhr.responseText);
+        }
+    });
+
+    $('#refreshButton').on('click', function() {
+        MAPANNOTATIONS.CACHE.clear();
+    });
+
+    // URL of the first page of children of a node, with the same
+    // payload jstree will send
+    function childrenUrl(url, obj, type) {
+        var payload = {};
+        if (MAPANNOTATIONS.CTX.value.length > 0) {
+            payload['value'] = MAPANNOTATIONS.CTX.value;
+        }
+        $.extend(payload, obj.extra);
+        payload['id'] = obj.id;
+        payload['page'] = 1;
+        if (type === 'dataset') {
+            payload['sizeXYZ'] = true;
+            payload['date'] = true;
+        }
+        payload['group'] = WEBCLIENT.active_group_id;
+        return url + '?' + $.param(payload);
+    }
+
+    // Speculatively load the first page of children of the top few
+    // screens and projects, using the same payload jstree will send.
+    var PREFETCH_SIZE = 3;
+    function prefetchChildren(responseText) {
+        var data;
+        try {
+            data = JSON.parse(responseText);
+        } catch (e) {
+            return;
+        }
+        var containers = [[data.screens || [], WEBCLIENT.URLS.api_plates],
+                          [data.projects || [], WEBCLIENT.URLS.api_datasets]];
+        containers.forEach(function(c) {
+            c[0].slice(0, PREFETCH_SIZE).forEach(function(obj) {
+                var url = childrenUrl(c[1], obj);
+                if (MAPANNOTATIONS.CACHE.get(url) === undefined) {
+                    $.ajax({url: url, type: 'GET', dataType: 'text'});
+                }
+            });
+        });
+    }
+
+
+    // Load in one request the children of the screen or project and
+    // of the plate or dataset on the path, and seed the cache with
+    // them so that opening these nodes doesn't go to the server.
+    function expandPath(path, value, callback) {
+        var container = path.filter(function(n) {
+            return n.type === 'screen' || n.type === 'project';
+        })[0];
+        var child = path.filter(function(n) {
+            return n.type === 'plate' || n.type === 'dataset';
+        })[0];
+        if (!container) {
+            callback();
+            return;
+        }
+        var payload = {'value': value,
+                       'container': container.type + '-' + container.id,
+                       'group': WEBCLIENT.active_group_id};
+        if (child) {
+            payload['child'] = child.type + '-' + child.id;
+            if (child.type === 'dataset') {
+                payload['sizeXYZ'] = true;
+                payload['date'] = true;
+            }
+        }
+        function find(objs, id) {
+            return (objs || []).filter(function(o) { return o.id === id; })[0];
+        }
+        $.getJSON(MAPANNOTATIONS.URLS.expand, payload, function(data) {
+            var isScreen = container.type === 'screen';
+            var parent = find(isScreen ? data.screens : data.projects,
+                              container.id);
+            var children = isScreen ? data.plates : data.datasets;
+            if (parent && children) {
+                var key = isScreen ? 'plates' : 'datasets';
+                var rsp = {};
+                rsp[key] = children;
+                MAPANNOTATIONS.CACHE.set(
+                    childrenUrl(isScreen ? WEBCLIENT.URLS.api_plates :
+                                           WEBCLIENT.URLS.api_datasets,
+                                parent),
+                    JSON.stringify(rsp));
+            }
+            var obj = child && find(children, child.id);
+            if (obj && data.images) {
+                MAPANNOTATIONS.CACHE.set(
+                    childrenUrl(WEBCLIENT.URLS.api_images, obj, child.type),
+                    JSON.stringify({'images': data.images}));
+            }
+        }).always(function() {
+            callback();
+        });
+    }
+
+
     // ----- Show -----
     // e.g. /mapr/gene/?value=CDC5&show=screen-51
     // $('#dataTree').on('loaded.jstree', function(e, data) {
@@ -143,8 +338,11 @@ $(function () {
                             traverse(node, path);
                         });
                     }
-                    // start recursive traversing...
-                    traverse(rootNode, pathToObj);
+                    // start recursive traversing once the children
+                    // on the path are cached
+                    expandPath(pathToObj, value, function() {
+                        traverse(rootNode, pathToObj);
+                    });
                 }
             });
         }
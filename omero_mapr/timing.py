@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import os
+import time
+import logging
+import cProfile
+import threading
+
+from functools import wraps
+from contextlib import contextmanager
+
+from django.http import HttpResponse
+
+from .mapr_settings import mapr_settings
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class QueryTimeout(Exception):
+
+    """
+    Raised when the queries of a request run past its deadline, see
+    omero.web.mapr.query_timeouts.
+    """
+
+
+class RequestTimer(object):
+
+    """
+    Accumulates the time spent in each phase of a single request.
+
+    Phases are either measured explicitly with phase() or closed with
+    mark(), which records the time elapsed since the previous mark
+    excluding the top-level phases measured in between, the phases
+    nested in them being already part of their duration.
+    """
+
+    def __init__(self, request, timeout=0):
+        self.request = request
+        self.started = self._last = time.time()
+        self._inner = 0.0
+        self.depth = 0
+        self.phases = []
+        self.deadline = self.started + timeout if timeout > 0 else None
+        self.truncated = False
+
+    def add(self, name, duration, desc=None, nested=False):
+        self.phases.append((name, duration, desc))
+        if not nested:
+            self._inner += duration
+
+    def mark(self, name):
+        now = time.time()
+        self.phases.append((name, now - self._last - self._inner, None))
+        self._last = now
+        self._inner = 0.0
+
+    def header(self):
+        """Return the phases formatted as Server-Timing header value."""
+        metrics = []
+        totals = {}
+        hql = 0
+        for name, duration, desc in self.phases:
+            if name == 'hql':
+                metrics.append('hql%d;dur=%.1f;desc="%s"' % (
+                    hql, duration * 1000, desc))
+                hql += 1
+            else:
+                totals[name] = totals.get(name, 0) + duration
+        for name, duration in totals.items():
+            metrics.append('%s;dur=%.1f' % (name, duration * 1000))
+        metrics.append('total;dur=%.1f' % (
+            (time.time() - self.started) * 1000))
+        return ', '.join(metrics)
+
+
+class ThreadTimer(object):
+
+    """
+    Records the phases run by a worker thread on behalf of a request.
+    They are reported with the request's phases but do not count
+    towards its marks, as they overlap with the caller waiting.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.request = parent.request
+        self.deadline = parent.deadline
+        self.depth = 0
+
+    @property
+    def truncated(self):
+        return self.parent.truncated
+
+    @truncated.setter
+    def truncated(self, value):
+        self.parent.truncated = value
+
+    def add(self, name, duration, desc=None, nested=False):
+        self.parent.phases.append((name, duration, desc))
+
+    def mark(self, name):
+        pass
+
+
+def call_with_timer(timer, fn, *args, **kwargs):
+    """Call fn in the current thread, recording its phases in timer."""
+    previous = current()
+    _local.timer = None if timer is None else ThreadTimer(timer)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _local.timer = previous
+
+
+def current():
+    """Return the RequestTimer of the request being handled or None."""
+    return getattr(_local, 'timer', None)
+
+
+def current_menu():
+    """Return the mapr menu of the request being handled or None."""
+    timer = current()
+    if timer is None:
+        return None
+    match = getattr(timer.request, 'resolver_match', None)
+    if match is None:
+        return None
+    return match.kwargs.get('menu', match.kwargs.get('c_type'))
+
+
+def mark(name):
+    timer = current()
+    if timer is not None:
+        timer.mark(name)
+
+
+def remaining():
+    """
+    Return the seconds left before the deadline of the request being
+    handled or None if there is none. Raise QueryTimeout if it passed.
+    """
+    timer = current()
+    if timer is None or timer.deadline is None:
+        return None
+    left = timer.deadline - time.time()
+    if left <= 0:
+        raise QueryTimeout()
+    return left
+
+
+def truncated():
+    """Flag the response of the request being handled as truncated."""
+    timer = current()
+    if timer is not None:
+        timer.truncated = True
+
+
+@contextmanager
+def phase(name, desc=None):
+    timer = current()
+    if timer is None:
+        yield
+        return
+    start = time.time()
+    timer.depth += 1
+    try:
+        yield
+    finally:
+        timer.depth -= 1
+        timer.add(name, time.time() - start, desc, nested=timer.depth > 0)
+
+
+def server_timing(view):
+    """
+    Wraps the mapr views to time each request.
+    If omero.web.mapr.server_timing is enabled the phases are returned
+    in the Server-Timing header. Requests whose queries run past the
+    deadline of the view get a 503 response.
+    """
+    timeouts = mapr_settings.QUERY_TIMEOUTS
+    timeout = timeouts.get(view.__name__, timeouts.get('default', 0))
+
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        _local.timer = RequestTimer(request, timeout)
+        try:
+            try:
+                rsp = view(request, *args, **kwargs)
+            except QueryTimeout:
+                logger.warning("%s ran past its %ss deadline" % (
+                    request.get_full_path(), timeout))
+                rsp = HttpResponse("The query took too long", status=503,
+                                   content_type="text/plain")
+                rsp['Retry-After'] = "60"
+            if _local.timer.truncated:
+                rsp['X-Mapr-Truncated'] = "true"
+            if mapr_settings.SERVER_TIMING:
+                rsp['Server-Timing'] = _local.timer.header()
+            return rsp
+        finally:
+            _local.timer = None
+    return wrapped
+
+
+def profiled(view):
+    """
+    Records the time spent to authenticate the request and, if an
+    admin passes mapr_profile=true, dumps a cProfile of the view to
+    omero.web.mapr.profile_dir.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        mark('auth')
+        conn = kwargs.get('conn')
+        if (request.GET.get('mapr_profile') not in ('true', '1') or
+                conn is None or not conn.isAdmin()):
+            return view(request, *args, **kwargs)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(view, request, *args, **kwargs)
+        finally:
+            path = os.path.join(
+                mapr_settings.PROFILE_DIR, "%s.%d.%d.prof" % (
+                    view.__name__, os.getpid(), time.time() * 1000))
+            try:
+                profile.dump_stats(path)
+                logger.info("Profile of %s saved to %s" % (
+                    request.path, path))
+            except (IOError, OSError):
+                logger.error("Failed to save profile to %s" % path,
+                             exc_info=True)
+    return wrapped
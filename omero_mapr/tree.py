@@ -20,25 +20,37 @@
 #
 # Version: 1.0
 
+import sys
+import json
+import time
 import logging
+import Ice
 import omero
 import copy
 
 from omero.rtypes import rstring, rlist, unwrap, wrap
 from django.conf import settings
 from copy import deepcopy
+from functools import lru_cache
 from past.builtins import long
 
-from omeroweb.webclient.tree import build_clause
 from omeroweb.webclient.tree import parse_permissions_css
 from omeroweb.webclient.tree import _marshal_screen
 from omeroweb.webclient.tree import _marshal_plate
 from omeroweb.webclient.tree import _marshal_image
-from omeroweb.webclient.tree import _marshal_annotation, _marshal_exp_obj
+from omeroweb.webclient.tree import _marshal_date
+
+from . import timing
+from .mapr_settings import mapr_settings
 
 
 logger = logging.getLogger(__name__)
 
+slow_query_logger = logging.getLogger('omero_mapr.slow_query')
+
+# page size of the queries reading whole ID sets, which are not capped
+ID_BATCH_SIZE = 10000
+
 
 def _escape_chars_like(query):
     escape_chars = {
@@ -51,6 +63,99 @@ def _escape_chars_like(query):
     return query
 
 
+def _with_timeout(method, timeout):
+    ''' Returns the query service method called on a proxy abandoning
+        the call after timeout seconds. The gateway wraps the methods
+        of the proxy, which are kept in the f attribute of the wrapper.
+    '''
+    f = getattr(method, 'f', method)
+    proxy = getattr(f, '__self__', None)
+    if proxy is None or not hasattr(proxy, 'ice_invocationTimeout'):
+        return method
+    proxy = proxy.ice_invocationTimeout(max(int(timeout * 1000), 1))
+    return getattr(proxy, getattr(method, 'attr', f.__name__))
+
+
+def _query(method, q, params, service_opts):
+    ''' Runs the HQL query using the given query service method,
+        e.g. qs.projection, recording how long it took
+
+        The query is abandoned at the deadline of the request, raising
+        timing.QueryTimeout, and unpaged queries return at most
+        omero.web.mapr.max_rows rows. Queries whose complete results
+        are needed, e.g. the ID sets combined by api_image_query, page
+        explicitly with ID_BATCH_SIZE instead.
+
+        @param method Query service method to call
+        @type method L{callable}
+        @param q The HQL query
+        @type q L{string}
+        @param params Instance of ParametersI
+        @type params L{omero.sys.ParametersI}
+        @param service_opts The service options (call context)
+        @type service_opts L{omero.gateway.ServiceOptsDict}
+    '''
+    caller = sys._getframe(1).f_code.co_name
+    timeout = timing.remaining()
+    if timeout is not None:
+        method = _with_timeout(method, timeout)
+    max_rows = mapr_settings.MAX_ROWS
+    capped = max_rows > 0 and params is not None and (
+        params.theFilter is None or params.theFilter.limit is None)
+    if capped:
+        params.page(0, max_rows + 1)
+    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
+    start = time.time()
+    with timing.phase('hql', caller):
+        try:
+            rv = method(q, params, service_opts)
+        except Ice.TimeoutException:
+            raise timing.QueryTimeout()
+    if capped and isinstance(rv, list) and len(rv) > max_rows:
+        logger.warning("%s returned more than %d rows" % (caller, max_rows))
+        rv = rv[:max_rows]
+        timing.truncated()
+    duration = (time.time() - start) * 1000
+    threshold = mapr_settings.SLOW_QUERY_THRESHOLD
+    if threshold >= 0 and duration >= threshold:
+        _log_slow_query(caller, q, params, service_opts, rv, duration)
+    return rv
+
+
+def _normalize_parameters(params):
+    ''' Returns ParametersI as a plain dictionary '''
+    normalized = {}
+    if params is None:
+        return normalized
+    for k, v in params.map.items():
+        normalized[k] = unwrap(v)
+    f = params.theFilter
+    if f is not None:
+        normalized['offset'] = unwrap(f.offset)
+        normalized['limit'] = unwrap(f.limit)
+    return normalized
+
+
+def _log_slow_query(caller, q, params, service_opts, rv, duration):
+    ''' Logs a query slower than omero.web.mapr.slow_query_threshold
+        as a single JSON line '''
+    if isinstance(rv, list):
+        rows = len(rv)
+    else:
+        rows = 0 if rv is None else 1
+    record = {
+        'function': caller,
+        'menu': timing.current_menu(),
+        'params': _normalize_parameters(params),
+        'rows': rows,
+        'duration': round(duration, 1),
+        'group': service_opts.getOmeroGroup(),
+        'query': " ".join(q.split()),
+    }
+    slow_query_logger.warning(json.dumps(record, sort_keys=True,
+                                         default=str))
+
+
 def _set_parameters(mapann_ns=[], mapann_names=[],
                     mapann_value=None, query=False, case_sensitive=True,
                     params=None, experimenter_id=-1,
@@ -86,39 +191,86 @@ def _set_parameters(mapann_ns=[], mapann_names=[],
     if page is not None and page > 0:
         params.page((page-1) * limit, limit)
 
-    where_clause = []
-
-    if mapann_names is not None and len(mapann_names) > 0:
-        manlist = [rstring(n) for n in mapann_names]
-        params.add('filter', rlist(manlist))
-        where_clause.append("mv.name in (:filter)")
+    has_names = mapann_names is not None and len(mapann_names) > 0
+    if has_names:
+        params.add('filter', _rstrings(tuple(mapann_names)))
 
-    if mapann_ns is not None and len(mapann_ns) > 0:
-        mnslist = [rstring(n) for n in mapann_ns]
-        params.add("ns", rlist(mnslist))
-        where_clause.append("a.ns in (:ns)")
+    has_ns = mapann_ns is not None and len(mapann_ns) > 0
+    if has_ns:
+        params.add("ns", _rstrings(tuple(mapann_ns)))
 
-    if experimenter_id is not None and experimenter_id != -1:
+    has_owner = experimenter_id is not None and experimenter_id != -1
+    if has_owner:
         params.addId(experimenter_id)
-        where_clause.append("a.details.owner.id = :id")
 
     if mapann_value:
         mapann_value = mapann_value if case_sensitive else mapann_value.lower()
-        _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
         if query:
             params.addString(
                 "query",
                 rstring("%%%s%%" % _escape_chars_like(mapann_value)))
-            where_clause.append("%s like :query" % _cwc)
         else:
             params.addString('value', mapann_value)
-            where_clause.append("%s  = :value" % _cwc)
-    else:
-        where_clause.append("mv.value != '' ")
+
+    where_clause = list(_where_clause(
+        has_names, has_ns, has_owner, bool(mapann_value),
+        bool(query), bool(case_sensitive)))
 
     return params, where_clause
 
 
+@lru_cache(maxsize=256)
+def _rstrings(values):
+    ''' The rlist parameter of the names or namespaces of a menu, built
+        once and shared by the queries '''
+    return rlist([rstring(v) for v in values])
+
+
+@lru_cache(maxsize=None)
+def _where_clause(has_names, has_ns, has_owner, has_value, query,
+                  case_sensitive):
+    ''' The where clauses bound by _set_parameters for a combination of
+        filters '''
+    where_clause = []
+    if has_names:
+        where_clause.append("mv.name in (:filter)")
+    if has_ns:
+        where_clause.append("a.ns in (:ns)")
+    if has_owner:
+        where_clause.append("a.details.owner.id = :id")
+    if has_value:
+        _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+        if query:
+            where_clause.append("%s like :query" % _cwc)
+        else:
+            where_clause.append("%s = :value" % _cwc)
+    else:
+        where_clause.append("mv.value != ''")
+    return tuple(where_clause)
+
+
+@lru_cache(maxsize=1024)
+def _compile_hql(template, args):
+    args = tuple(" and ".join(a) if isinstance(a, tuple) else a
+                 for a in args)
+    if args:
+        template = template % args
+    return " ".join(template.split())
+
+
+def _hql(template, *args):
+    ''' Returns the query text of the template formatted with the args,
+        lists of where clauses being joined with "and".
+
+        The text is built once per distinct template and args and its
+        whitespace is normalized, so that identical queries reach the
+        server as the same string and hit its query plan cache. Only
+        the parameters change from call to call.
+    '''
+    return _compile_hql(template, tuple(
+        tuple(a) if isinstance(a, list) else a for a in args))
+
+
 def _marshal_map(conn, row):
     ''' Given a Map row (list) marshals it into a dictionary.  Order
         and type of columns in row is:
@@ -193,7 +345,7 @@ def count_mapannotations(conn, mapann_value, query=False,
 
     qs = conn.getQueryService()
 
-    q = """
+    q = _hql("""
         select
             count(distinct mv.value) as childCount
         from ImageAnnotationLink ial join ial.child a join a.mapValue mv
@@ -206,10 +358,9 @@ def count_mapannotations(conn, mapann_value, query=False,
              OR
              (dil is not null)
          )
-        """ % (" and ".join(where_clause))
+        """, where_clause)
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    counter = unwrap(qs.projection(q, params, service_opts))[0][0]
+    counter = unwrap(_query(qs.projection, q, params, service_opts))[0][0]
     return counter
 
 
@@ -262,7 +413,7 @@ def marshal_mapannotations(conn, mapann_value, query=False,
 
     qs = conn.getQueryService()
 
-    q = """
+    q = _hql("""
         select
             mv.value as value,
             count(distinct i.id) as imgCount,
@@ -292,10 +443,9 @@ def marshal_mapannotations(conn, mapann_value, query=False,
          )
         group by mv.value
         order by count(distinct i.id) DESC
-        """ % (" and ".join(where_clause))
+        """, where_clause)
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for e in qs.projection(q, params, service_opts):
+    for e in _query(qs.projection, q, params, service_opts):
         e = unwrap(e)
         if e[1] > 0:
             c = e[1]
@@ -313,6 +463,81 @@ def marshal_mapannotations(conn, mapann_value, query=False,
     return mapannotations
 
 
+def marshal_facets(conn, mapann_value, query=False,
+                   case_sensitive=False,
+                   mapann_ns=[], mapann_names=[],
+                   group_id=-1, experimenter_id=-1):
+    ''' Marshals the number of images and values matching per
+        Map annotation name and namespace
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param mapann_ns The Map annotation namespace to filter by.
+        @type mapann_ns L{string}
+        @param mapann_names The Map annotation names to filter by.
+        @type mapann_names L{string}
+        @param mapann_value The Map annotation value to filter by.
+        @type mapann_value L{string}
+        @param query Flag allowing to search for value patters.
+        @type query L{boolean}
+        @param group_id The Group ID to filter by or -1 for all groups,
+        defaults to -1
+        @type group_id L{long}
+        @param experimenter_id The Experimenter (user) ID to filter by
+        or -1 for all experimenters
+        @type experimenter_id L{long}
+    '''
+
+    facets = []
+
+    params, where_clause = _set_parameters(
+        mapann_ns=mapann_ns, mapann_names=mapann_names,
+        query=query, mapann_value=mapann_value,
+        case_sensitive=case_sensitive,
+        params=None, experimenter_id=experimenter_id,
+        page=None, limit=None)
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = conn.getQueryService()
+
+    q = _hql("""
+        select
+            mv.name as name,
+            a.ns as ns,
+            count(distinct i.id) as imgCount,
+            count(distinct mv.value) as valueCount
+        from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+            join ial.parent i
+            left outer join i.wellSamples ws
+            left outer join i.datasetLinks dil
+        where %s AND
+         (
+             (ws is not null)
+             OR
+             (dil is not null)
+         )
+        group by mv.name, a.ns
+        order by count(distinct i.id) DESC, mv.name
+        """, where_clause)
+
+    for e in _query(qs.projection, q, params, service_opts):
+        name, ns, c, values = unwrap(e)
+        facets.append({
+            'name': name,
+            'ns': ns,
+            'imageCount': c,
+            'valueCount': values,
+        })
+
+    return facets
+
+
 def marshal_screens(conn, mapann_value, query=False,
                     mapann_ns=[], mapann_names=[],
                     group_id=-1, experimenter_id=-1,
@@ -367,7 +592,7 @@ def marshal_screens(conn, mapann_value, query=False,
     # -     join ial.parent i join i.wellSamples ws join ws.well w
     # -     join w.plate pl join pl.screenLinks sl join sl.parent screen
     qs = conn.getQueryService()
-    q = """
+    q = _hql("""
         select new map(mv.value as value,
             screen.id as id,
             screen.name as name,
@@ -382,10 +607,9 @@ def marshal_screens(conn, mapann_value, query=False,
         where %s
         group by screen.id, screen.name, mv.value
         order by lower(screen.name), screen.id
-        """ % (" and ".join(where_clause))
+        """, where_clause)
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for e in qs.projection(q, params, service_opts):
+    for e in _query(qs.projection, q, params, service_opts):
         e = unwrap(e)
         v = e[0]['value']
         c = e[0]['imgCount']
@@ -451,7 +675,7 @@ def marshal_projects(conn, mapann_value, query=False,
     service_opts.setOmeroGroup(group_id)
 
     qs = conn.getQueryService()
-    q = """
+    q = _hql("""
         select new map(mv.value as value,
             project.id as id,
             project.name as name,
@@ -466,10 +690,9 @@ def marshal_projects(conn, mapann_value, query=False,
         where %s
         group by project.id, project.name, mv.value
         order by lower(project.name), project.id
-        """ % (" and ".join(where_clause))
+        """, where_clause)
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for e in qs.projection(q, params, service_opts):
+    for e in _query(qs.projection, q, params, service_opts):
         e = unwrap(e)
         v = e[0]['value']
         c = e[0]['imgCount']
@@ -544,7 +767,7 @@ def marshal_datasets(conn, project_id,
     service_opts.setOmeroGroup(group_id)
 
     qs = conn.getQueryService()
-    q = """
+    q = _hql("""
         select new map(mv.value as value,
             dataset.id as id,
             dataset.name as name,
@@ -558,10 +781,9 @@ def marshal_datasets(conn, project_id,
         where %s
         group by dataset.id, dataset.name, mv.value
         order by lower(dataset.name), dataset.id, mv.value
-        """ % (" and ".join(where_clause))
+        """, where_clause)
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for e in qs.projection(q, params, service_opts):
+    for e in _query(qs.projection, q, params, service_opts):
         e = unwrap(e)
         v = e[0]['value']
         e = [e[0]['id'],
@@ -644,7 +866,7 @@ def marshal_plates(conn, screen_id,
     # - from ImageAnnotationLink ial join ial.child a join a.mapValue mv
     # -     join ial.parent i join i.wellSamples ws join ws.well w
     # -     join w.plate plate join plate.screenLinks sl join sl.parent screen
-    q = """
+    q = _hql("""
         select new map(mv.value as value,
             plate.id as id,
             plate.name as name,
@@ -658,10 +880,9 @@ def marshal_plates(conn, screen_id,
         where %s
         group by plate.id, plate.name, mv.value
         order by lower(plate.name), plate.id, mv.value
-        """ % (" and ".join(where_clause))
+        """, where_clause)
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for e in qs.projection(q, params, service_opts):
+    for e in _query(qs.projection, q, params, service_opts):
         e = unwrap(e)
         v = e[0]['value']
         e = [e[0]['id'],
@@ -679,6 +900,100 @@ def marshal_plates(conn, screen_id,
     return plates
 
 
+def marshal_counted_containers(conn, ctype, counts, mapann_value,
+                               group_id=-1, page=1, limit=settings.PAGE):
+
+    ''' Marshals plates or datasets whose number of images annotated
+        with the value is known, as marshal_plates and marshal_datasets
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param ctype 'plate' or 'dataset'
+        @type ctype L{string}
+        @param counts The number of images keyed by container ID
+        @type counts L{dict}
+        @param mapann_value The Map annotation value of the counts.
+        @type mapann_value L{string}
+        @param group_id The Group ID to filter by or -1 for all groups,
+        defaults to -1
+        @type group_id L{long}
+        @param page Page number of results to get. `None` or 0 for no paging
+        defaults to 1
+        @type page L{long}
+        @param limit The limit of results per page to get
+        defaults to the value set in settings.PAGE
+        @type page L{long}
+    '''
+    containers = []
+    if not counts:
+        return containers
+
+    params = omero.sys.ParametersI()
+    params.addIds([long(i) for i in counts])
+    if page is not None and page > 0:
+        params.page((page-1) * limit, limit)
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = conn.getQueryService()
+    q = _hql("""
+        select new map(c.id as id,
+            c.name as name,
+            c.details.owner.id as ownerId,
+            c as details_permissions)
+        from %s c
+        where c.id in (:ids)
+        order by lower(c.name), c.id
+        """, ctype.title())
+
+    for e in _query(qs.projection, q, params, service_opts):
+        e = unwrap(e)[0]
+        mp = _marshal_plate(conn, [e['id'],
+                                   e['name'],
+                                   e['ownerId'],
+                                   e['details_permissions'],
+                                   counts[e['id']]])
+        mp.update({'extra': {'node': ctype, 'value': mapann_value}})
+        containers.append(mp)
+
+    return containers
+
+
+def _set_thumb_versions(conn, images, service_opts):
+    ''' Load thumbnails separately
+        We want version of most recent thumbnail (max thumbId) owned by user
+    '''
+    qs = conn.getQueryService()
+    user_id = conn.getUserId()
+    iids = [i['id'] for i in images]
+    params = omero.sys.ParametersI()
+    params.addIds(iids)
+    params.add('thumbOwner', wrap(user_id))
+    q = """select image.id, thumbs.version from Image image
+        join image.pixels pix join pix.thumbnails thumbs
+        where image.id in (:ids)
+        and thumbs.id = (
+            select max(t.id)
+            from Thumbnail t
+            where t.pixels = pix.id
+            and t.details.owner.id = :thumbOwner
+        )
+        """
+    thumb_versions = {}
+    for t in _query(qs.projection, q, params, service_opts):
+        iid, tv = unwrap(t)
+        thumb_versions[iid] = tv
+    # For all images, set thumb version if we have it...
+    for i in images:
+        if i['id'] in thumb_versions:
+            i['thumbVersion'] = thumb_versions[i['id']]
+
+
 def marshal_images(conn, parent, parent_id,
                    mapann_value, query=False,
                    mapann_ns=[], mapann_names=[],
@@ -735,10 +1050,52 @@ def marshal_images(conn, parent, parent_id,
         group_id = -1
     service_opts.setOmeroGroup(group_id)
 
-    from_join_clauses = []
-
     qs = conn.getQueryService()
 
+    if parent == 'plate':
+        from_join = """
+            ImageAnnotationLink ial
+            join ial.child a
+            join a.mapValue mv
+            join ial.parent image
+            join image.wellSamples ws join ws.well well
+            join well.plate plate
+        """
+        params.addLong("pid", parent_id)
+        where_clause.append('plate.id = :pid')
+    elif parent == 'dataset':
+        from_join = """
+            ImageAnnotationLink ial
+            join ial.child a
+            join a.mapValue mv
+            join ial.parent image
+            join image.datasetLinks dil join dil.parent dataset
+        """
+        params.addLong("did", parent_id)
+        where_clause.append('dataset.id = :did')
+    else:
+        return images
+
+    q = _hql(_images_select(load_pixels, date) + """
+        where image.id in (
+            select image.id from %s
+            where %s
+            order by lower(image.name))
+        """, from_join, where_clause)
+
+    images = _marshal_image_rows(
+        conn, _query(qs.projection, q, params, service_opts),
+        load_pixels=load_pixels, date=date)
+
+    if thumb_version and len(images) > 0:
+        _set_thumb_versions(conn, images, service_opts)
+
+    return images
+
+
+def _images_select(load_pixels=False, date=False):
+    ''' The select clause of the image queries '''
+
     extra_values = []
     if load_pixels:
         extra_values.append("""
@@ -767,40 +1124,14 @@ def marshal_images(conn, parent, parent_id,
         # We use 'left outer join', since we still want images if no pixels
         q += ' left outer join image.pixels pix '
 
-    q += """
-        where image.id in (
-        """
+    return q
 
-    if parent == 'plate':
-        from_join_clauses.append("""
-            ImageAnnotationLink ial
-            join ial.child a
-            join a.mapValue mv
-            join ial.parent image
-            join image.wellSamples ws join ws.well well
-            join well.plate plate
-        """)
-        params.addLong("pid", parent_id)
-        where_clause.append('plate.id = :pid')
-    if parent == 'dataset':
-        from_join_clauses.append("""
-            ImageAnnotationLink ial
-            join ial.child a
-            join a.mapValue mv
-            join ial.parent image
-            join image.datasetLinks dil join dil.parent dataset
-        """)
-        params.addLong("did", parent_id)
-        where_clause.append('dataset.id = :did')
 
-    q += """
-        %s %s
-        order by lower(image.name))
-        """ % (' select image.id from ' + ' '.join(from_join_clauses),
-               build_clause(where_clause, 'where', 'and'))
+def _marshal_image_rows(conn, rows, load_pixels=False, date=False):
+    ''' Marshals the rows returned by a query built on _images_select '''
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for e in qs.projection(q, params, service_opts):
+    images = []
+    for e in rows:
         e = unwrap(e)[0]
         d = [e["id"],
              e["name"],
@@ -815,40 +1146,120 @@ def marshal_images(conn, parent, parent_id,
             kwargs['acqDate'] = e['acqDate']
             kwargs['date'] = e['date']
 
-        im = _marshal_image(**kwargs)
-        images.append(im)
+        images.append(_marshal_image(**kwargs))
+    return images
+
+
+def marshal_images_by_id(conn, image_ids, load_pixels=False,
+                         group_id=-1, date=False, thumb_version=False):
+
+    ''' Marshals the given images, in the order of their IDs
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param image_ids The IDs of the images to marshal.
+        @type image_ids L{list}
+        @param load_pixels Whether to load the X,Y,Z dimensions
+        @type load_pixels Boolean
+        @param group_id The Group ID to filter by or -1 for all groups,
+        defaults to -1
+        @type group_id L{long}
+    '''
+    images = []
+    if not image_ids:
+        return images
+
+    params = omero.sys.ParametersI()
+    params.addIds([long(i) for i in image_ids])
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = conn.getQueryService()
+
+    q = _hql(_images_select(load_pixels, date) + """
+        where image.id in (:ids)
+        order by image.id
+        """)
+
+    images = _marshal_image_rows(
+        conn, _query(qs.projection, q, params, service_opts),
+        load_pixels=load_pixels, date=date)
 
-    # Load thumbnails separately
-    # We want version of most recent thumbnail (max thumbId) owned by user
     if thumb_version and len(images) > 0:
-        user_id = conn.getUserId()
-        iids = [i['id'] for i in images]
-        params = omero.sys.ParametersI()
-        params.addIds(iids)
-        params.add('thumbOwner', wrap(user_id))
-        q = """select image.id, thumbs.version from Image image
-            join image.pixels pix join pix.thumbnails thumbs
-            where image.id in (:ids)
-            and thumbs.id = (
-                select max(t.id)
-                from Thumbnail t
-                where t.pixels = pix.id
-                and t.details.owner.id = :thumbOwner
-            )
-            """
-        thumb_versions = {}
-        logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-        for t in qs.projection(q, params, service_opts):
-            iid, tv = unwrap(t)
-            thumb_versions[iid] = tv
-        # For all images, set thumb version if we have it...
-        for i in images:
-            if i['id'] in thumb_versions:
-                i['thumbVersion'] = thumb_versions[i['id']]
+        _set_thumb_versions(conn, images, service_opts)
 
     return images
 
 
+def image_ids(conn, mapann_value, query=False,
+              case_sensitive=False,
+              mapann_ns=[], mapann_names=[],
+              group_id=-1, experimenter_id=-1):
+
+    ''' Returns the sorted IDs of all the images annotated with a value.
+        The IDs are read by pages so that omero.web.mapr.max_rows does
+        not truncate the set, which is combined with the sets of other
+        values.
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param mapann_value The Map annotation value to filter by.
+        @type mapann_value L{string}
+        @param query Flag allowing to search for value patters.
+        @type query L{boolean}
+        @param mapann_ns The Map annotation namespace to filter by.
+        @type mapann_ns L{string}
+        @param mapann_names The Map annotation names to filter by.
+        @type mapann_names L{string}
+        @param group_id The Group ID to filter by or -1 for all groups,
+        defaults to -1
+        @type group_id L{long}
+        @param experimenter_id The Experimenter (user) ID to filter by
+        or -1 for all experimenters
+        @type experimenter_id L{long}
+    '''
+    if not mapann_value:
+        return []
+
+    params, where_clause = _set_parameters(
+        mapann_ns=mapann_ns, mapann_names=mapann_names,
+        query=query, mapann_value=mapann_value,
+        case_sensitive=case_sensitive,
+        params=None, experimenter_id=experimenter_id,
+        page=None, limit=None)
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = conn.getQueryService()
+
+    q = _hql("""
+        select distinct ial.parent.id
+        from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+        where %s
+        order by ial.parent.id
+        """, where_clause)
+
+    ids = []
+    offset = 0
+    while True:
+        params.page(offset, ID_BATCH_SIZE)
+        rows = _query(qs.projection, q, params, service_opts)
+        ids.extend(unwrap(e)[0] for e in rows)
+        if len(rows) < ID_BATCH_SIZE:
+            return ids
+        offset += ID_BATCH_SIZE
+
+
 def load_mapannotation(conn, mapann_value,
                        mapann_ns=[], mapann_names=[],
                        group_id=-1, experimenter_id=-1,
@@ -880,10 +1291,10 @@ def load_mapannotation(conn, mapann_value,
     '''
 
     annotations = []
+    experimenters = {}
     if not mapann_value:
-        return annotations
+        return annotations, []
 
-    experimenters = {}
     params, where_clause = _set_parameters(
         mapann_ns=mapann_ns, mapann_names=mapann_names,
         query=False, mapann_value=mapann_value,
@@ -899,27 +1310,115 @@ def load_mapannotation(conn, mapann_value,
 
     qs = conn.getQueryService()
 
-    q = """
-        select distinct a
-            from Annotation a
-            join fetch a.details.creationEvent
-            join fetch a.details.owner
-            join a.mapValue mv where %s
-            order by a.ns asc
-        """ % (" and ".join(where_clause))
-
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for ann in qs.findAllByQuery(q, params, service_opts):
-        d = _marshal_annotation(conn, ann, None)
-        exp = _marshal_exp_obj(ann.details.owner)
-        experimenters[exp['id']] = exp
-        annotations.append(d)
+    # Only the fields shown by the metadata panel are loaded
+    q = _hql("""
+        select new map(ann.id as id,
+            ann.ns as ns,
+            ann.description as description,
+            owner.id as ownerId,
+            owner.omeName as omeName,
+            owner.firstName as firstName,
+            owner.lastName as lastName,
+            ce.time as date,
+            ann as ann_details_permissions)
+        from MapAnnotation ann
+            join ann.details.owner owner
+            join ann.details.creationEvent ce
+        where ann.id in (
+            select a.id from MapAnnotation a join a.mapValue mv where %s)
+        order by ann.ns asc, ann.id
+        """, where_clause)
+
+    for e in _query(qs.projection, q, params, service_opts):
+        e = unwrap(e)[0]
+        perms = e['ann_details_permissions']
+        annotations.append({
+            'id': e['id'],
+            'ns': e['ns'],
+            'description': e['description'],
+            'owner': {'id': e['ownerId']},
+            'date': _marshal_date(e['date']),
+            'permissions': {'canDelete': perms['canDelete'],
+                            'canAnnotate': perms['canAnnotate'],
+                            'canLink': perms['canLink'],
+                            'canEdit': perms['canEdit']},
+            'class': 'MapAnnotationI',
+            'values': [],
+        })
+        experimenters[e['ownerId']] = {
+            'id': e['ownerId'],
+            'omeName': e['omeName'],
+            'firstName': e['firstName'],
+            'lastName': e['lastName'],
+        }
+
+    if annotations:
+        values = dict((a['id'], a['values']) for a in annotations)
+        params = omero.sys.ParametersI()
+        params.addIds(list(values))
+        q = """
+            select a.id, mv.name, mv.value
+            from MapAnnotation a join a.mapValue mv
+            where a.id in (:ids)
+            order by a.id, index(mv)
+            """
+        for e in _query(qs.projection, q, params, service_opts):
+            aid, name, value = unwrap(e)
+            values[aid].append([name, value])
 
     experimenters = list(experimenters.values())
 
     return annotations, experimenters
 
 
+def count_annotations(conn, mapann_value,
+                      mapann_ns=[], mapann_names=[],
+                      group_id=-1, experimenter_id=-1):
+    ''' Counts the map annotations load_mapannotation pages through
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param mapann_ns The Map annotation namespace to filter by.
+        @type mapann_ns L{string}
+        @param mapann_names The Map annotation names to filter by.
+        @type mapann_names L{string}
+        @param mapann_value The Map annotation value to filter by.
+        @type mapann_value L{string}
+        @param group_id The Group ID to filter by or -1 for all groups,
+        defaults to -1
+        @type group_id L{long}
+        @param experimenter_id The Experimenter (user) ID to filter by
+        or -1 for all experimenters
+        @type experimenter_id L{long}
+    '''
+
+    if not mapann_value:
+        return 0
+
+    params, where_clause = _set_parameters(
+        mapann_ns=mapann_ns, mapann_names=mapann_names,
+        query=False, mapann_value=mapann_value,
+        params=None, experimenter_id=experimenter_id,
+        page=None, limit=None)
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = conn.getQueryService()
+
+    q = _hql("""
+        select count(distinct a.id)
+        from MapAnnotation a join a.mapValue mv
+        where %s
+        """, where_clause)
+
+    return unwrap(_query(qs.projection, q, params, service_opts))[0][0]
+
+
 def marshal_autocomplete(conn, mapann_value, query=True,
                          case_sensitive=False,
                          mapann_ns=[], mapann_names=None,
@@ -972,7 +1471,7 @@ def marshal_autocomplete(conn, mapann_value, query=True,
     params.addString(
         "query",
         rstring("%s%%" % _escape_chars_like(mapann_value)))
-    where_clause.append(' %s like :query ' % _cwc)
+    where_clause.append('%s like :query' % _cwc)
     order_by = "length(mv.value) ASC, lower(mv.value) ASC"
 
     params2.addString(
@@ -997,24 +1496,20 @@ def marshal_autocomplete(conn, mapann_value, query=True,
     _q = """
         select new map(mv.value as value)
         from ImageAnnotationLink ial join ial.child a join a.mapValue mv
-        where {where_clause}
+        where %s
         group by mv.value
-        order by {order_by}
+        order by %s
         """
 
     # query by value%
-    q = _q.format(
-        where_clause=(" and ".join(where_clause)), order_by=order_by)
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for e in qs.projection(q, params, service_opts):
+    q = _hql(_q, where_clause, order_by)
+    for e in _query(qs.projection, q, params, service_opts):
         e = unwrap(e)
         autocomplete.append({'value': e[0]["value"]})
 
     # query by %value% and exclude value%
-    q = _q.format(
-        where_clause=(" and ".join(where_clause2)), order_by=order_by2)
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for e in qs.projection(q, params2, service_opts):
+    q = _hql(_q, where_clause2, order_by2)
+    for e in _query(qs.projection, q, params2, service_opts):
         e = unwrap(e)
         autocomplete.append({'value': e[0]["value"]})
 
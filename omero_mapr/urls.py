@@ -28,6 +28,7 @@ from django.views.generic import RedirectView
 from django.views.decorators.cache import never_cache
 
 from .mapr_settings import mapr_settings
+from .timing import server_timing
 
 reverse_lazy = lazy(reverse, str)
 
@@ -41,7 +42,7 @@ urlpatterns = []
 for m in mapr_settings.CONFIG:
     urlpatterns.append(
         url(r'^(?i)%s/$' % m,
-            views.index, {'menu': m},
+            server_timing(views.index), {'menu': m},
             name="maprindex_%s" % m)
         )
 
@@ -55,46 +56,60 @@ urlpatterns += [
             query_string=True)),
         name="maprindex"),
 
-    url(r'^api/config/$', views.api_mapr_config, name='mapr_config'),
+    url(r'^api/config/$', server_timing(views.api_mapr_config),
+        name='mapr_config'),
+    url(r'^api/search/$', server_timing(views.api_search),
+        name='mapr_search'),
+    url(r'^api/query/$', server_timing(views.api_image_query),
+        name='mapr_image_query'),
 
     url(r'^api/(?P<menu>%s)/count/$' % (CONFIG_REGEX),
-        views.api_experimenter_list,
+        server_timing(views.api_experimenter_list),
         name='mapannotations_api_experimenters'),
+    url(r'^api/(?P<menu>%s)/expand/$' % CONFIG_REGEX,
+        server_timing(views.api_expand),
+        name='mapannotations_api_expand'),
+    url(r'^api/(?P<menu>%s)/facets/$' % CONFIG_REGEX,
+        server_timing(views.api_facets),
+        name='mapannotations_api_facets'),
     url(r'^api/(?P<menu>%s)/datasets/$' % CONFIG_REGEX,
-        views.api_datasets_list,
+        server_timing(views.api_datasets_list),
         name='mapannotations_api_datasets'),
     url(r'^api/(?P<menu>%s)/plates/$' % CONFIG_REGEX,
-        views.api_plate_list,
+        server_timing(views.api_plate_list),
         name='mapannotations_api_plates'),
     url(r'^api/(?P<menu>%s)/images/$' % CONFIG_REGEX,
-        views.api_image_list,
+        server_timing(views.api_image_list),
         name='mapannotations_api_images'),
 
     url(r'^api/(?P<menu>%s)/paths_to_object/$' % CONFIG_REGEX,
-        views.api_paths_to_object,
+        server_timing(views.api_paths_to_object),
         name='mapannotations_api_paths_to_object'),
+    url(r'^api/(?P<menu>%s)/paths_to_objects/$' % CONFIG_REGEX,
+        server_timing(views.api_paths_to_objects),
+        name='mapannotations_api_paths_to_objects'),
 
     url(r'^metadata_details/(?P<c_type>%s)/$' % CONFIG_REGEX,
-        views.load_metadata_details,
+        server_timing(views.load_metadata_details),
         name="mapannotations_load_metadata_details"),
 
     url(r'^api/(?P<menu>%s)/annotations/$' % CONFIG_REGEX,
-        views.api_annotations,
+        server_timing(views.api_annotations),
         name='mapannotations_api_annotations'),
 
     # must be last on the list
     url(r'^api/(?P<menu>%s)/$' % CONFIG_REGEX,
-        views.api_mapannotation_list,
+        server_timing(views.api_mapannotation_list),
         name='mapannotations_api_mapannotations'),
 
     # autocomplete
     url(r'^api/autocomplete/(?P<menu>%s)/$' % CONFIG_REGEX,
-        views.mapannotations_autocomplete,
+        server_timing(views.mapannotations_autocomplete),
         name='mapannotations_autocomplete'),
 
     # favicon
     url(r'^favicon/$',
-        views.mapannotations_favicon,
+        server_timing(views.mapannotations_favicon),
         name='mapannotations_favicon'),
 
 ]
@@ -21,7 +21,13 @@
 # Version: 1.0
 
 import json
-from collections import OrderedDict
+from types import MappingProxyType
+from collections import OrderedDict, namedtuple
+
+
+# omero.web.mapr.config of a menu, compiled by compile_menus
+Menu = namedtuple('Menu', ['menu', 'label', 'default', 'keys', 'ns',
+                           'case_sensitive', 'wildcard', 'wildcard_limit'])
 
 
 def config_list_to_dict(config_list):
@@ -31,4 +37,57 @@ def config_list_to_dict(config_list):
         if k is not None:
             if i.get('config', None) is not None:
                 config_dict[k] = i['config']
+    # reject malformed menus when the setting is loaded
+    compile_menus(config_dict)
     return config_dict
+
+
+def _to_boolean(value):
+    return str(value).lower() in ('true', 'yes', 'y', 't', '1')
+
+
+def _strings(menu, config, key, default=None):
+    value = config.get(key, default)
+    if not isinstance(value, list) or \
+            not all(isinstance(v, str) for v in value):
+        raise ValueError("Menu %s: %s must be a list of strings"
+                         % (menu, key))
+    return tuple(value)
+
+
+def compile_menu(menu, config):
+    """
+    Validate the config of a menu and return it as a Menu.
+    Raise ValueError if it is malformed.
+    """
+    if not isinstance(config, dict):
+        raise ValueError("Menu %s: config must be an object" % menu)
+    label = config.get('label')
+    if not isinstance(label, str):
+        raise ValueError("Menu %s: label must be a string" % menu)
+    wildcard = config.get('wildcard', {})
+    if not isinstance(wildcard, dict):
+        raise ValueError("Menu %s: wildcard must be an object" % menu)
+    limit = wildcard.get('limit', 0)
+    if not isinstance(limit, int) or isinstance(limit, bool):
+        raise ValueError("Menu %s: wildcard limit must be an integer"
+                         % menu)
+    return Menu(menu=menu,
+                label=label,
+                default=_strings(menu, config, 'default'),
+                keys=_strings(menu, config, 'all'),
+                ns=_strings(menu, config, 'ns', []),
+                case_sensitive=_to_boolean(
+                    config.get('case_sensitive', False)),
+                wildcard=_to_boolean(wildcard.get('enabled', False)),
+                wildcard_limit=limit)
+
+
+def compile_menus(config_dict):
+    """
+    Return the Menu of each menu of omero.web.mapr.config in order
+    as a read-only mapping.
+    """
+    return MappingProxyType(OrderedDict(
+        (menu, compile_menu(menu, config))
+        for menu, config in config_dict.items()))
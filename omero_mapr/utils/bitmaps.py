@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+"""
+Set algebra over image IDs, used to combine the images matching
+several map annotation values.
+
+ID sets are sorted arrays of unique IDs. NumPy is used when it is
+installed, the operations fall back to Python sets otherwise.
+"""
+
+from functools import reduce
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def from_ids(ids):
+    """ Return the ID set of the given IDs """
+    if numpy is not None:
+        if not isinstance(ids, numpy.ndarray):
+            ids = list(ids)
+        return numpy.unique(numpy.asarray(ids, dtype=numpy.int64))
+    return sorted(set(ids))
+
+
+def intersection(sets):
+    """ Return the IDs present in all of the sets """
+    if numpy is not None:
+        return reduce(
+            lambda a, b: numpy.intersect1d(a, b, assume_unique=True), sets)
+    return sorted(reduce(lambda a, b: a & b, (set(s) for s in sets)))
+
+
+def union(sets):
+    """ Return the IDs present in any of the sets """
+    if numpy is not None:
+        return reduce(numpy.union1d, sets)
+    return sorted(reduce(lambda a, b: a | b, (set(s) for s in sets)))
+
+
+def difference(a, b):
+    """ Return the IDs of a which are not in b """
+    if numpy is not None:
+        return numpy.setdiff1d(a, b, assume_unique=True)
+    b = set(b)
+    return [i for i in a if i not in b]
+
+
+def evaluate(all_sets=[], any_sets=[], none_sets=[]):
+    """
+    Return the IDs present in all of all_sets and in at least one of
+    any_sets but in none of none_sets. Either all_sets or any_sets
+    must not be empty.
+    """
+    terms = list(all_sets)
+    if any_sets:
+        terms.append(union(any_sets))
+    if not terms:
+        raise ValueError("At least one set to select from is required")
+    # intersect the smallest sets first
+    ids = intersection(sorted(terms, key=len))
+    if none_sets:
+        ids = difference(ids, union(none_sets))
+    return ids
+
+
+def page_ids(ids, page=1, limit=None):
+    """ Return a page of the ID set as a list of ints """
+    if page is not None and page > 0 and limit:
+        ids = ids[(page - 1) * limit:page * limit]
+    return [int(i) for i in ids]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+"""
+Columnar encoding of marshalled rows, returned with format=columns.
+
+A list of dictionaries becomes one array per field::
+
+    {"count": 2,
+     "columns": {"id": [1, 2], "permsCss": [0, 0],
+                 "extra.counter": [3, 5]},
+     "dictionaries": {"permsCss": ["canLink"]}}
+
+Nested dictionaries are flattened into dotted field names and fields
+missing from a row are null. String fields repeating values are
+dictionary-encoded: the column holds indexes into the array of their
+distinct values listed under "dictionaries".
+"""
+
+
+def _flatten(row, prefix=''):
+    for key, value in row.items():
+        if isinstance(value, dict) and value:
+            for item in _flatten(value, prefix + key + '.'):
+                yield item
+        else:
+            yield prefix + key, value
+
+
+def _encode_dictionary(values):
+    """
+    Return (dictionary, indexes) of a column of strings with fewer
+    distinct values than half its length, None otherwise.
+    """
+    dictionary = {}
+    for value in values:
+        if value is not None and not isinstance(value, str):
+            return None
+        if value not in dictionary:
+            dictionary[value] = len(dictionary)
+            if len(dictionary) * 2 > len(values):
+                return None
+    return list(dictionary), [dictionary[v] for v in values]
+
+
+def to_columns(rows):
+    """ Return the rows, a list of dictionaries, as columns """
+    columns = {}
+    for i, row in enumerate(rows):
+        for key, value in _flatten(row):
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * len(rows)
+            column[i] = value
+
+    dictionaries = {}
+    for key, values in columns.items():
+        encoded = _encode_dictionary(values)
+        if encoded is not None:
+            dictionaries[key], columns[key] = encoded
+    return {'count': len(rows), 'columns': columns,
+            'dictionaries': dictionaries}
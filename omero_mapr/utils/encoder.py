@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+"""
+JSON encoders of the mapr responses.
+
+Encoders turn the marshalled data into UTF-8 bytes. orjson is used when
+it is installed, the standard library encoder otherwise.
+"""
+
+import json
+import datetime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if hasattr(obj, 'tolist'):
+        # NumPy arrays and scalars, e.g. image IDs
+        return obj.tolist()
+    raise TypeError("Object of type %s is not JSON serializable"
+                    % type(obj).__name__)
+
+
+def dumps_json(data):
+    """ Encode data with the standard library encoder """
+    return json.dumps(data, default=_default, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+
+
+def dumps_orjson(data):
+    """ Encode data with orjson """
+    return orjson.dumps(
+        data, default=_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+ENCODERS = {
+    'json': dumps_json,
+}
+if orjson is not None:
+    ENCODERS['orjson'] = dumps_orjson
+
+
+def get_encoder(name='auto'):
+    """
+    Return the encoder called name, the fastest installed one for
+    'auto'. Raise ValueError for unknown or missing encoders.
+    """
+    if name == 'auto':
+        return ENCODERS.get('orjson', dumps_json)
+    try:
+        return ENCODERS[name]
+    except KeyError:
+        raise ValueError("JSON encoder %s is not available" % name)
+
+
+def check_encoder(name):
+    """ Return name if it is an available encoder, raise ValueError """
+    get_encoder(name)
+    return name
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+import threading
+
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from .. import timing
+from ..mapr_settings import mapr_settings
+
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+# expensive requests in progress in this process
+_requests = 0
+_requests_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Return the executor running the blocking gateway calls of the mapr
+    views, sized by omero.web.mapr.max_workers, or None if disabled.
+    """
+    global _executor, _slots
+    if _executor is None and mapr_settings.MAX_WORKERS > 0:
+        with _lock:
+            if _executor is None:
+                _slots = threading.BoundedSemaphore(
+                    mapr_settings.MAX_WORKERS)
+                _executor = ThreadPoolExecutor(
+                    max_workers=mapr_settings.MAX_WORKERS,
+                    thread_name_prefix='mapr')
+    return _executor
+
+
+def _run(slot, timer, fn, kwargs):
+    try:
+        return timing.call_with_timer(timer, fn, **kwargs)
+    finally:
+        if slot:
+            _slots.release()
+
+
+def run_concurrently(*calls):
+    """
+    Run independent (callable, kwargs) calls concurrently and return
+    their results in order. Calls that find the executor busy run in
+    the calling thread, so requests never queue behind each other.
+    The first exception raised by a call is re-raised.
+    """
+    executor = get_executor()
+    if executor is None or len(calls) < 2:
+        return [fn(**kwargs) for fn, kwargs in calls]
+
+    timer = timing.current()
+    with timing.phase('concurrent'):
+        futures = []
+        inline = []
+        # keep the last call for the calling thread
+        for fn, kwargs in calls[:-1]:
+            if _slots.acquire(False):
+                futures.append(
+                    executor.submit(_run, True, timer, fn, kwargs))
+            else:
+                futures.append(None)
+                inline.append((len(futures) - 1, fn, kwargs))
+        fn, kwargs = calls[-1]
+        last = timing.call_with_timer(timer, fn, **kwargs)
+        results = [None] * len(futures)
+        for i, fn, kwargs in inline:
+            results[i] = timing.call_with_timer(timer, fn, **kwargs)
+        for i, future in enumerate(futures):
+            if future is not None:
+                results[i] = future.result()
+    return results + [last]
+
+
+@contextmanager
+def in_progress():
+    """
+    Count a request as in progress while the block runs, see
+    overloaded.
+    """
+    global _requests
+    with _requests_lock:
+        _requests += 1
+    try:
+        yield
+    finally:
+        with _requests_lock:
+            _requests -= 1
+
+
+def overloaded():
+    """
+    Return True if every thread of the executor is busy and at least
+    as many requests are in progress as it has threads, so that a new
+    request would wait on its own thread. A single request or a few
+    concurrent ones filling the threads with their calls are not an
+    overload.
+    """
+    if get_executor() is None:
+        return False
+    if _requests < mapr_settings.MAX_WORKERS:
+        return False
+    if _slots.acquire(False):
+        _slots.release()
+        return False
+    return True
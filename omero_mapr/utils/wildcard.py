@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+"""
+Paging of wildcard listings bounded by the wildcard limit of a menu.
+"""
+
+
+def window(wc_limit, page, limit):
+    """
+    Bound a page of a wildcard listing to the first wc_limit results.
+
+    Return the limit to query and the number of its results that may
+    be returned, None if there is no wildcard limit.
+    """
+    if wc_limit <= 0:
+        return limit, None
+    limit = min(limit, wc_limit)
+    return limit, max(wc_limit - (page - 1) * limit, 0)
+
+
+def fetch_window(fetch, wc_limit, page, limit):
+    """
+    Return (rows, truncated) for a page of the listing returned by
+    fetch(page=page, limit=limit), bounded by the wildcard limit.
+
+    truncated is True if the page reaches the wildcard limit and the
+    listing goes on past it, which is checked by fetching the first
+    row after the limit.
+    """
+    limit, remaining = window(wc_limit, page, limit)
+    if remaining is None:
+        return fetch(page=page, limit=limit), False
+    rows = fetch(page=page, limit=limit)[:remaining] if remaining else []
+    if remaining > limit or len(rows) < remaining:
+        return rows, False
+    return rows, len(fetch(page=wc_limit + 1, limit=1)) > 0
@@ -0,0 +1,689 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Aleksandra Tarkowska <A(dot)Tarkowska(at)dundee(dot)ac(dot)uk>,
+#
+# Version: 1.0
+
+"""
+Read-only index of the images annotated with each value of a menu.
+
+The index is a single file holding the sorted values, their offsets,
+the sorted image IDs of every value and the number of wells of each
+plate and images of each dataset annotated with it, which the OMERO.web
+workers mmap so that they all share one copy in the page cache. A new
+index is written to a temporary file which atomically replaces the
+previous one, the workers reopen the file when its inode changes.
+
+An index holds the data seen by the user it was built as and is only
+served to that user. The annotation links and containers the index was
+built from and the last event seen are kept too, so that the index can
+be updated from the events logged since, see update_value_index.
+
+Values are sorted ignoring case first, so that the case variants of a
+value are next to each other. Layout, in native byte order::
+
+    header       magic, number of values, strings, postings and counts
+                 sizes, number of link, container and well link rows,
+                 last event ID, ID of the user the index was read as
+    values       number of values + 1 byte offsets into strings (Q)
+    postings     number of values + 1 offsets into image ids (Q)
+    counts       number of values + 1 offsets into count rows (Q)
+    strings      utf-8 values, padded to 8 bytes
+    image ids    sorted image IDs of each value (q)
+    count rows   sorted kind, parent, group, container IDs and count
+                 of the containers of each value (5q)
+    link ids     link ID of each link row, sorted (q)
+    link images  image ID of each link row (q)
+    link values  value number of each link row (Q)
+    containers   image, kind, parent, group and container IDs of each
+                 container row (5q)
+    well links   well annotation link ID of each well link row, sorted (q)
+    well plates  plate ID of each well link row (q)
+"""
+
+import os
+import mmap
+import struct
+import bisect
+import logging
+import tempfile
+import threading
+
+import omero
+
+from array import array
+from copy import deepcopy
+from collections import Counter
+from omero.rtypes import rlong, unwrap
+
+from .mapr_settings import mapr_settings
+from .tree import marshal_counted_containers
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MAPRVIX5"
+HEADER = struct.Struct("=8sQQQQQQQQq")
+BATCH_SIZE = 5000
+
+# kinds of containers, with their parents
+PLATE = 0       # in a screen
+DATASET = 1     # in a project
+
+EVENT_TYPES = ['ome.model.annotations.ImageAnnotationLink',
+               'ome.model.annotations.WellAnnotationLink',
+               'ome.model.annotations.MapAnnotation']
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _sort_key(value):
+    return (value.lower().encode('utf-8'), value.encode('utf-8'))
+
+
+def write_value_index(path, links, containers={}, plates={},
+                      well_links={}, event_id=0, user_id=-1):
+    ''' Writes the index of the image IDs of each value
+
+        @param path The file to replace
+        @param links The image ID and the values of each annotation
+        link, keyed by link ID
+        @type links L{dict}
+        @param containers The (kind, parent ID, group ID, container ID)
+        of the datasets of each image, keyed by image ID
+        @type containers L{dict}
+        @param plates The number of wells annotated with each value,
+        keyed by (value, screen ID, group ID, plate ID)
+        @type plates L{dict}
+        @param well_links The plate ID of each well annotation link,
+        keyed by link ID
+        @type well_links L{dict}
+        @param event_id The ID of the last event applied to the index
+        @type event_id L{long}
+        @param user_id The ID of the user the data was read as
+        @type user_id L{long}
+    '''
+    rows = []
+    postings = {}
+    for link_id, (image_id, values) in links.items():
+        for value in set(values):
+            rows.append((link_id, image_id, value))
+            postings.setdefault(value, set()).add(image_id)
+    rows.sort()
+    # the wells of a plate are counted as marshal_plates does
+    plate_counts = {}
+    for (value, screen_id, group_id, plate_id), count in plates.items():
+        plate_counts.setdefault(value, []).append(
+            (PLATE, screen_id, group_id, plate_id, count))
+    for value in plate_counts:
+        postings.setdefault(value, set())
+    items = sorted(postings.items(), key=lambda item: _sort_key(item[0]))
+    numbers = dict((value, i) for i, (value, ids) in enumerate(items))
+
+    value_offsets = array('Q', [0])
+    posting_offsets = array('Q', [0])
+    count_offsets = array('Q', [0])
+    strings = bytearray()
+    image_ids = array('q')
+    counts = array('q')
+    for value, ids in items:
+        strings += value.encode('utf-8')
+        value_offsets.append(len(strings))
+        image_ids.extend(sorted(ids))
+        posting_offsets.append(len(image_ids))
+        c = Counter(t for image_id in ids
+                    for t in containers.get(image_id, ()))
+        for row in sorted([t + (c[t],) for t in c] +
+                          plate_counts.get(value, [])):
+            counts.extend(row)
+        count_offsets.append(len(counts) // 5)
+    strings += b"\0" * (-len(strings) % 8)
+
+    link_ids = array('q', [r[0] for r in rows])
+    link_images = array('q', [r[1] for r in rows])
+    link_values = array('Q', [numbers[r[2]] for r in rows])
+    well_link_ids = array('q', sorted(well_links))
+    well_plates = array('q', [well_links[i] for i in well_link_ids])
+
+    # only the containers of indexed images are kept
+    container_rows = array('q')
+    for image_id in sorted(set(r[1] for r in rows)):
+        for t in sorted(set(containers.get(image_id, ()))):
+            container_rows.extend((image_id,) + t)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(suffix=".idx", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(items), len(strings),
+                                len(image_ids), len(counts) // 5,
+                                len(rows), len(container_rows) // 5,
+                                len(well_link_ids), event_id, user_id))
+            f.write(value_offsets.tobytes())
+            f.write(posting_offsets.tobytes())
+            f.write(count_offsets.tobytes())
+            f.write(strings)
+            f.write(image_ids.tobytes())
+            f.write(counts.tobytes())
+            f.write(link_ids.tobytes())
+            f.write(link_images.tobytes())
+            f.write(link_values.tobytes())
+            f.write(container_rows.tobytes())
+            f.write(well_link_ids.tobytes())
+            f.write(well_plates.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+    return len(items)
+
+
+class _Keys(object):
+
+    ''' The values ignoring case, as a sequence for bisect '''
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.index._value(i).lower().encode('utf-8')
+
+
+class _Containers(object):
+
+    ''' The (kind, parent) of count rows, as a sequence for bisect '''
+
+    def __init__(self, counts):
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.counts) // 5
+
+    def __getitem__(self, i):
+        return (self.counts[5 * i], self.counts[5 * i + 1])
+
+
+class ValueIndex(object):
+
+    """
+    A value index mapped in memory, see write_value_index.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, strings_size, postings_size, count_rows, link_rows, \
+            container_rows, well_link_rows, event_id, user_id = \
+            HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError("%s is not a mapr value index" % path)
+        self._size = n
+        self.event_id = event_id
+        self.user_id = user_id
+        view = memoryview(self._mm)
+        self._pos = HEADER.size
+
+        def section(size, fmt=None):
+            s = view[self._pos:self._pos + size]
+            self._pos += size
+            return s.cast(fmt) if fmt else s
+
+        self._value_offsets = section(8 * (n + 1), 'Q')
+        self._posting_offsets = section(8 * (n + 1), 'Q')
+        self._count_offsets = section(8 * (n + 1), 'Q')
+        self._strings = section(strings_size)
+        self._postings_pos = self._pos
+        self._postings = section(8 * postings_size, 'q')
+        self._counts = section(40 * count_rows, 'q')
+        self._link_ids = section(8 * link_rows, 'q')
+        self._link_images = section(8 * link_rows, 'q')
+        self._link_values = section(8 * link_rows, 'Q')
+        self._containers = section(40 * container_rows, 'q')
+        self._well_link_ids = section(8 * well_link_rows, 'q')
+        self._well_plates = section(8 * well_link_rows, 'q')
+
+    def __len__(self):
+        return self._size
+
+    def _value(self, i):
+        return bytes(self._strings[
+            self._value_offsets[i]:self._value_offsets[i + 1]]).decode('utf-8')
+
+    def _find(self, value, case_sensitive=False):
+        ''' Returns the range of the numbers of the matching values '''
+        key = value.lower().encode('utf-8')
+        keys = _Keys(self)
+        start = bisect.bisect_left(keys, key)
+        end = start
+        while end < self._size and keys[end] == key:
+            end += 1
+        if case_sensitive:
+            for i in range(start, end):
+                if self._value(i) == value:
+                    return i, i + 1
+            return start, start
+        return start, end
+
+    def _postings_of(self, i):
+        start = self._posting_offsets[i]
+        end = self._posting_offsets[i + 1]
+        if numpy is not None:
+            return numpy.frombuffer(
+                self._mm, dtype=numpy.int64, count=end - start,
+                offset=self._postings_pos + 8 * start)
+        return self._postings[start:end].tolist()
+
+    def image_ids(self, value, case_sensitive=False):
+        ''' Returns the sorted IDs of the images annotated with the
+            value, as a NumPy array if available
+        '''
+        start, end = self._find(value, case_sensitive)
+        if end - start == 1:
+            return self._postings_of(start)
+        postings = [self._postings_of(i) for i in range(start, end)]
+        if numpy is not None:
+            return numpy.unique(numpy.concatenate(
+                postings or [numpy.empty(0, dtype=numpy.int64)]))
+        return sorted(set(i for p in postings for i in p))
+
+    def container_counts(self, value, kind, parent_id, group_id=-1):
+        ''' Returns the number of wells or images annotated with the
+            value, case sensitive, keyed by ID of the containers of the
+            given kind and parent, in the given group or -1 for all
+        '''
+        start, end = self._find(value, case_sensitive=True)
+        if start == end:
+            return {}
+        lo = self._count_offsets[start]
+        hi = self._count_offsets[start + 1]
+        containers = _Containers(self._counts)
+        i = bisect.bisect_left(containers, (kind, parent_id), lo, hi)
+        counts = {}
+        while i < hi and containers[i] == (kind, parent_id):
+            if group_id == -1 or self._counts[5 * i + 2] == group_id:
+                counts[self._counts[5 * i + 3]] = self._counts[5 * i + 4]
+            i += 1
+        return counts
+
+    def values(self, prefix="", limit=None):
+        ''' Returns the values starting with prefix, ignoring case '''
+        key = prefix.lower().encode('utf-8')
+        keys = _Keys(self)
+        values = []
+        i = bisect.bisect_left(keys, key)
+        while i < self._size and (limit is None or len(values) < limit):
+            if not keys[i].startswith(key):
+                break
+            values.append(self._value(i))
+            i += 1
+        return values
+
+    def links(self):
+        ''' Returns the image ID and the values of each annotation link,
+            keyed by link ID, as taken by write_value_index
+        '''
+        links = {}
+        values = {}
+        for link_id, image_id, number in zip(
+                self._link_ids, self._link_images, self._link_values):
+            value = values.get(number)
+            if value is None:
+                value = values[number] = self._value(number)
+            links.setdefault(link_id, (image_id, set()))[1].add(value)
+        return links
+
+    def containers(self):
+        ''' Returns the containers of each image, keyed by image ID, as
+            taken by write_value_index
+        '''
+        containers = {}
+        rows = self._containers
+        for i in range(0, len(rows), 5):
+            containers.setdefault(rows[i], []).append(tuple(rows[i + 1:i + 5]))
+        return containers
+
+    def plates(self):
+        ''' Returns the number of wells of each plate, keyed by value
+            and plate, as taken by write_value_index
+        '''
+        plates = {}
+        rows = self._counts
+        for number in range(self._size):
+            value = None
+            for i in range(self._count_offsets[number],
+                           self._count_offsets[number + 1]):
+                if rows[5 * i] != PLATE:
+                    continue
+                if value is None:
+                    value = self._value(number)
+                plates[(value,) + tuple(rows[5 * i + 1:5 * i + 4])] = \
+                    rows[5 * i + 4]
+        return plates
+
+    def well_links(self):
+        ''' Returns the plate ID of each well annotation link, keyed by
+            link ID, as taken by write_value_index
+        '''
+        return dict(zip(self._well_link_ids, self._well_plates))
+
+
+def get_value_index(conn, menu):
+    ''' Returns the value index of the menu or None if there is none
+        or it was built as another user, who may see other data.
+        Anonymous sessions run as the public user and get the indexes
+        built as it. The index is reopened when it has been replaced.
+    '''
+    directory = mapr_settings.VALUE_INDEX_DIR
+    if not directory:
+        return None
+    path = os.path.join(directory, "%s.idx" % menu)
+    try:
+        inode = os.stat(path).st_ino
+    except OSError:
+        return None
+    index = _indexes.get(path)
+    if index is None or index.inode != inode:
+        with _lock:
+            index = _indexes.get(path)
+            if index is None or index.inode != inode:
+                try:
+                    index = ValueIndex(path)
+                except (OSError, ValueError):
+                    logger.error("Failed to open %s" % path, exc_info=True)
+                    return None
+                _indexes[path] = index
+    if index.user_id != conn.getUserId():
+        return None
+    return index
+
+
+def load_containers(conn, menu, ctype, parent_id, mapann_value,
+                    group_id=-1, experimenter_id=-1, page=1, limit=None):
+    ''' Returns a page of the plates of a screen or the datasets of a
+        project, marshalled as marshal_plates and marshal_datasets do,
+        with the numbers of images read from the value index, or None
+        if the index cannot answer.
+    '''
+    # the indexes hold the containers of all users
+    if experimenter_id != -1 or not mapann_value or parent_id is None:
+        return None
+    index = get_value_index(conn, menu)
+    if index is None:
+        return None
+    if group_id is None:
+        group_id = -1
+    kind = PLATE if ctype == 'plate' else DATASET
+    counts = index.container_counts(mapann_value, kind, parent_id,
+                                    group_id)
+
+    return marshal_counted_containers(
+        conn, ctype, counts, mapann_value,
+        group_id=group_id, page=page, limit=limit)
+
+
+class _LinkReader(object):
+
+    ''' Reads the annotation links of a menu from the point of view of
+        the connected user
+    '''
+
+    def __init__(self, conn, menu):
+        self.config = mapr_settings.MENUS[menu]
+        self.user_id = conn.getUserId()
+        self.service_opts = deepcopy(conn.SERVICE_OPTS)
+        self.service_opts.setOmeroGroup(-1)
+        self.qs = conn.getQueryService()
+        self.where_clause = "a.ns in (:ns) and mv.value != ''"
+        if self.config.keys:
+            self.where_clause += " and mv.name in (:filter)"
+
+    def projection(self, q, params):
+        return unwrap(self.qs.projection(q, params, self.service_opts))
+
+    def params(self):
+        p = omero.sys.ParametersI()
+        p.map['ns'] = omero.rtypes.wrap(list(self.config.ns))
+        if self.config.keys:
+            p.map['filter'] = omero.rtypes.wrap(list(self.config.keys))
+        return p
+
+    def last_event_id(self):
+        q = "select max(el.id) from EventLog el"
+        return self.projection(q, omero.sys.ParametersI())[0][0] or 0
+
+    def _add(self, links, rows):
+        for link_id, value, image_id in rows:
+            links.setdefault(link_id, (image_id, set()))[1].add(value)
+
+    def _read_all(self, link_type, columns):
+        ''' Pages through the links by id to keep the queries bounded '''
+        q = """
+            select max(l.id)
+            from %s l join l.child a join a.mapValue mv
+            where %s
+            """ % (link_type, self.where_clause)
+        max_id = self.projection(q, self.params())[0][0] or 0
+
+        q = """
+            select %s
+            from %s l join l.child a join a.mapValue mv
+            where %s and l.id > :last and l.id <= :next
+            """ % (columns, link_type, self.where_clause)
+        last = 0
+        while last < max_id:
+            p = self.params()
+            p.add('last', rlong(last))
+            p.add('next', rlong(last + BATCH_SIZE))
+            for row in self.projection(q, p):
+                yield row
+            last += BATCH_SIZE
+
+    def read_all(self, links, well_links):
+        self._add(links, self._read_all(
+            "ImageAnnotationLink", "l.id, mv.value, l.parent.id"))
+        well_links.update(self._read_all(
+            "WellAnnotationLink", "l.id, l.parent.plate.id"))
+
+    def read_links(self, links, link_ids):
+        q = """
+            select ial.id, mv.value, ial.parent.id
+            from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+            where %s and ial.id in (:ids)
+            """ % self.where_clause
+        for i in range(0, len(link_ids), BATCH_SIZE):
+            p = self.params()
+            p.addIds(link_ids[i:i + BATCH_SIZE])
+            self._add(links, self.projection(q, p))
+
+    def read_well_links(self, well_links, link_ids):
+        q = """
+            select wal.id, wal.parent.plate.id
+            from WellAnnotationLink wal join wal.child a join a.mapValue mv
+            where %s and wal.id in (:ids)
+            """ % self.where_clause
+        for i in range(0, len(link_ids), BATCH_SIZE):
+            p = self.params()
+            p.addIds(link_ids[i:i + BATCH_SIZE])
+            well_links.update(self.projection(q, p))
+
+    def read_containers(self, containers, image_ids):
+        ''' Reads the datasets of the images '''
+        q = """
+            select dil.child.id, pdl.parent.id, ds.details.group.id, ds.id
+            from DatasetImageLink dil join dil.parent ds
+                join ds.projectLinks pdl
+            where dil.child.id in (:ids)
+            """
+        for i in range(0, len(image_ids), BATCH_SIZE):
+            p = omero.sys.ParametersI()
+            p.addIds(image_ids[i:i + BATCH_SIZE])
+            for image_id, parent_id, group_id, dataset_id in \
+                    self.projection(q, p):
+                containers.setdefault(image_id, []).append(
+                    (DATASET, parent_id, group_id, dataset_id))
+
+    def read_plates(self, plates, plate_ids):
+        ''' Counts the annotated wells of the plates as marshal_plates
+            does, the wells rather than the images being annotated
+        '''
+        q = """
+            select mv.value, sl.parent.id, pl.details.group.id, pl.id,
+                count(distinct ws.id)
+            from WellAnnotationLink wal join wal.child a join a.mapValue mv
+                join wal.parent w join w.wellSamples ws join w.plate pl
+                join pl.screenLinks sl
+            where %s and pl.id in (:ids)
+            group by mv.value, sl.parent.id, pl.details.group.id, pl.id
+            """ % self.where_clause
+        for i in range(0, len(plate_ids), BATCH_SIZE):
+            p = self.params()
+            p.addIds(plate_ids[i:i + BATCH_SIZE])
+            for value, screen_id, group_id, plate_id, count in \
+                    self.projection(q, p):
+                plates[(value, screen_id, group_id, plate_id)] = count
+
+    def changed_links(self, since, until):
+        ''' Returns the IDs of the image and of the well annotation links
+            created, updated or deleted, or to the annotations changed,
+            between two events
+        '''
+        link_ids = set()
+        well_link_ids = set()
+        ann_ids = set()
+        q = """
+            select el.entityType, el.entityId from EventLog el
+            where el.id > :since and el.id <= :until
+                and el.entityType in (:types)
+            order by el.id
+            """
+        offset = 0
+        while True:
+            p = omero.sys.ParametersI()
+            p.addLong('since', since)
+            p.addLong('until', until)
+            p.map['types'] = omero.rtypes.wrap(EVENT_TYPES)
+            p.page(offset, BATCH_SIZE)
+            rows = self.projection(q, p)
+            for entity_type, entity_id in rows:
+                if entity_type == EVENT_TYPES[0]:
+                    link_ids.add(entity_id)
+                elif entity_type == EVENT_TYPES[1]:
+                    well_link_ids.add(entity_id)
+                else:
+                    ann_ids.add(entity_id)
+            if len(rows) < BATCH_SIZE:
+                break
+            offset += BATCH_SIZE
+
+        ann_ids = sorted(ann_ids)
+        for ids, link_type in ((link_ids, "ImageAnnotationLink"),
+                               (well_link_ids, "WellAnnotationLink")):
+            q = "select l.id from %s l where l.child.id in (:ids)" \
+                % link_type
+            for i in range(0, len(ann_ids), BATCH_SIZE):
+                p = omero.sys.ParametersI()
+                p.addIds(ann_ids[i:i + BATCH_SIZE])
+                ids.update(r[0] for r in self.projection(q, p))
+        return link_ids, well_link_ids
+
+
+def build_value_index(conn, menu, path):
+    ''' Writes the value index of the menu from the point of view of
+        the connected user
+
+        @return Number of values indexed
+    '''
+    reader = _LinkReader(conn, menu)
+    # events logged while reading are applied by the next update
+    event_id = reader.last_event_id()
+    links = {}
+    well_links = {}
+    reader.read_all(links, well_links)
+    containers = {}
+    reader.read_containers(
+        containers, sorted(set(i for i, v in links.values())))
+    plates = {}
+    reader.read_plates(plates, sorted(set(well_links.values())))
+    return write_value_index(path, links, containers, plates, well_links,
+                             event_id, reader.user_id)
+
+
+def update_value_index(conn, menu, path):
+    ''' Applies the changes logged since the value index was written.
+        Only the links created, updated or deleted since, and those of
+        the annotations changed since, are read again, and the wells of
+        the plates of the changed well links counted again.
+
+        An index built as another user is built again.
+
+        @return Number of links updated
+    '''
+    index = ValueIndex(path)
+    reader = _LinkReader(conn, menu)
+    if reader.user_id != index.user_id:
+        return build_value_index(conn, menu, path)
+    event_id = reader.last_event_id()
+    if event_id <= index.event_id:
+        return 0
+    link_ids, well_link_ids = reader.changed_links(index.event_id, event_id)
+    if not link_ids and not well_link_ids:
+        return 0
+
+    links = index.links()
+    for link_id in link_ids:
+        links.pop(link_id, None)
+    changed = {}
+    reader.read_links(changed, sorted(link_ids))
+    links.update(changed)
+
+    # the containers of the images of the changed links are read again
+    image_ids = set(i for i, v in changed.values())
+    containers = index.containers()
+    for image_id in image_ids:
+        containers.pop(image_id, None)
+    reader.read_containers(containers, sorted(image_ids))
+
+    # the plates the changed well links were and are in are counted again
+    well_links = index.well_links()
+    plate_ids = set(well_links.pop(link_id)
+                    for link_id in well_link_ids if link_id in well_links)
+    changed = {}
+    reader.read_well_links(changed, sorted(well_link_ids))
+    well_links.update(changed)
+    plate_ids.update(changed.values())
+    plates = dict((k, count) for k, count in index.plates().items()
+                  if k[3] not in plate_ids)
+    reader.read_plates(plates, sorted(plate_ids))
+
+    write_value_index(path, links, containers, plates, well_links,
+                      event_id, reader.user_id)
+    return len(link_ids) + len(well_link_ids)
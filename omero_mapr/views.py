@@ -24,6 +24,7 @@ import logging
 import traceback
 import requests
 from io import BytesIO
+from functools import partial
 try:
     from urllib.parse import urlparse
 except ImportError:
@@ -34,10 +35,15 @@ from omero import ApiUsageException, ServerError
 
 from django.conf import settings
 from .mapr_settings import mapr_settings
+from .cache import get_data_version
+from .sketches import estimate_count
+from .leaderboard import load_leaderboard
+from . import timing
+from .ratelimit import rate_limited, CHEAP, EXPENSIVE
 
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseServerError, HttpResponseBadRequest
-from django.http import JsonResponse
+from django.http import HttpResponse
 from django.http import Http404
 
 from django.core.validators import URLValidator
@@ -47,22 +53,18 @@ from django.utils.html import strip_tags
 
 from django_redis import get_redis_connection
 
-from omero.gateway.utils import toBoolean
-
-from .show import mapr_paths_to_object
 from .show import MapShow as Show
-from .tree import count_mapannotations, \
-                  marshal_mapannotations, \
-                  marshal_screens, \
-                  marshal_projects, \
-                  marshal_datasets, \
-                  marshal_plates, \
-                  marshal_images, \
-                  load_mapannotation, \
-                  marshal_autocomplete
+from .backends import get_backend
+from .utils.executor import run_concurrently
+from .utils import bitmaps
+from .utils.encoder import get_encoder
+from .utils.columns import to_columns
+from .utils import wildcard
+from .valueindex import get_value_index, load_containers
 
 from omeroweb.webclient.decorators import login_required, render_response
 from omeroweb.webclient.views import get_long_or_default, get_bool_or_default
+from omeroweb.webgateway.util import get_longs
 
 from omeroweb.webclient import tree as webclient_tree
 from omeroweb.webclient.views import _load_template as _webclient_load_template
@@ -123,49 +125,52 @@ def get_unicode_or_default(request, name, default):
     return val
 
 
-def _get_wildcard(mapr_settings, menu):
-    wc = False
-    try:
-        wc = mapr_settings.CONFIG[menu]['wildcard']['enabled']
-    except KeyError:
-        pass
-    return wc
+def _get_menu(menu):
+    return mapr_settings.MENUS[menu]
 
 
-def _get_wildcard_limit(mapr_settings, menu):
-    wc = 0
-    try:
-        wc = mapr_settings.CONFIG[menu]['wildcard']['limit']
-    except KeyError:
-        pass
-    return wc
+class MaprJsonResponse(HttpResponse):
+    """
+    JsonResponse writing the bytes of the encoder set by
+    omero.web.mapr.json_encoder.
+    """
 
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set'
+                ' the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        encoder = get_encoder(mapr_settings.JSON_ENCODER)
+        super(MaprJsonResponse, self).__init__(
+            content=encoder(data), **kwargs)
 
-def _get_ns(mapr_settings, menu):
-    ns = []
-    try:
-        ns = mapr_settings.CONFIG[menu]['ns']
-    except KeyError:
-        pass
-    return ns
+
+def _json_response(data, **kwargs):
+    """
+    Return data as MaprJsonResponse tagged with the mapr data version
+    so that clients can tell when their cached responses are stale.
+    """
+    timing.mark('marshal')
+    with timing.phase('json'):
+        rsp = MaprJsonResponse(data, **kwargs)
+    rsp['X-Mapr-Data-Version'] = get_data_version()
+    return rsp
 
 
-def _get_keys(mapr_settings, menu):
-    keys = None
-    try:
-        keys = mapr_settings.CONFIG[menu]['all']
-    except KeyError:
-        pass
-    return keys
+def _get_columns(request):
+    """
+    Return True if the rows are requested with format=columns, see
+    omero_mapr.utils.columns
+    """
+    fmt = get_unicode_or_default(request, 'format', None)
+    if fmt not in (None, '', 'rows', 'columns'):
+        raise ValueError("Unknown format %s" % fmt)
+    return fmt == 'columns'
 
 
-def _get_case_sensitive(mapr_settings, menu):
-    cs = False
-    try:
-        cs = toBoolean(mapr_settings.CONFIG[menu]['case_sensitive'])
-    except KeyError:
-        pass
-    return cs
+def _rows(rows, columns):
+    return to_columns(rows) if columns else rows
 
 
 def _get_page(request):
@@ -186,7 +191,7 @@ def index(request, menu, conn=None, url=None, **kwargs):
     try:
         value = get_unicode_or_default(request, 'value', None)
         query = get_bool_or_default(request, 'query', False)
-        if _get_case_sensitive(mapr_settings, menu):
+        if _get_menu(menu).case_sensitive:
             case_sensitive = get_bool_or_default(
                 request, 'case_sensitive', False)
         else:
@@ -202,9 +207,9 @@ def index(request, menu, conn=None, url=None, **kwargs):
     context['active_user'] = context.get('active_user', {'id': -1})
     context['mapr_conf'] = {
         'menu': menu,
-        'menu_all': mapr_settings.CONFIG[menu]['all'],
-        'menu_default': mapr_settings.CONFIG[menu]['default'],
-        'case_sensitive': _get_case_sensitive(mapr_settings, menu)}
+        'menu_all': _get_menu(menu).keys,
+        'menu_default': _get_menu(menu).default,
+        'case_sensitive': _get_menu(menu).case_sensitive}
     context['map_ctx'] = \
         {'label': menu, 'value': value or "", 'query': query or "",
          'case_sensitive': case_sensitive or ""}
@@ -213,12 +218,15 @@ def index(request, menu, conn=None, url=None, **kwargs):
     return context
 
 
+@rate_limited(CHEAP)
 def api_mapr_config(request):
     """Return mapr_settings.CONFIG as JSON."""
-    return JsonResponse(mapr_settings.CONFIG)
+    return MaprJsonResponse(mapr_settings.CONFIG)
 
 
 @login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
 def api_paths_to_object(request, menu=None, conn=None, **kwargs):
     """
     This override omeroweb.webclient.api_paths_to_object
@@ -226,8 +234,8 @@ def api_paths_to_object(request, menu=None, conn=None, **kwargs):
     """
 
     try:
-        mapann_ns = _get_ns(mapr_settings, menu)
-        mapann_names = _get_keys(mapr_settings, menu)
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
 
         mapann_value = get_unicode_or_default(request, 'map.value', None)
     except ValueError:
@@ -246,8 +254,9 @@ def api_paths_to_object(request, menu=None, conn=None, **kwargs):
             group_id = get_long_or_default(request, 'group', None)
         except ValueError:
             return HttpResponseBadRequest('Invalid parameter value')
+        timing.mark('params')
 
-        paths = mapr_paths_to_object(
+        paths = get_backend().paths_to_object(
             conn=conn, mapann_value=mapann_value,
             mapann_ns=mapann_ns, mapann_names=mapann_names,
             screen_id=screen_id, plate_id=plate_id,
@@ -255,7 +264,7 @@ def api_paths_to_object(request, menu=None, conn=None, **kwargs):
             image_id=image_id,
             experimenter_id=experimenter_id, group_id=group_id)
 
-        return JsonResponse({'paths': paths})
+        return _json_response({'paths': paths})
     return webclient_api_paths_to_object(request, conn=conn, **kwargs)
 
 
@@ -263,12 +272,56 @@ omeroweb.webclient.views.api_paths_to_object = api_paths_to_object
 
 
 @login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
+def api_paths_to_objects(request, menu, conn=None, **kwargs):
+    """
+    Returns the paths to many screens, plates, projects, datasets
+    and images at once, keyed by "type-id"
+    """
+
+    try:
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
+
+        mapann_value = get_unicode_or_default(request, 'map.value', None)
+        experimenter_id = get_long_or_default(request, 'experimenter', None)
+        group_id = get_long_or_default(request, 'group', None)
+        ids = {}
+        for t in ('screen', 'plate', 'project', 'dataset', 'image'):
+            ids['%s_ids' % t] = get_longs(request, t)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
+
+    if not mapann_value:
+        return HttpResponseBadRequest('map.value is required')
+
+    try:
+        paths = get_backend().paths_to_objects(
+            conn=conn, mapann_value=mapann_value,
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            experimenter_id=experimenter_id, group_id=group_id,
+            **ids)
+    except ApiUsageException as e:
+        return HttpResponseBadRequest(e.serverStackTrace)
+    except ServerError as e:
+        return HttpResponseServerError(e.serverStackTrace)
+    except IceException as e:
+        return HttpResponseServerError(e.message)
+
+    return _json_response({'paths': paths})
+
+
+@login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
 def api_experimenter_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
     try:
-        mapann_ns = _get_ns(mapr_settings, menu)
-        mapann_names = _get_keys(mapr_settings, menu)
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
 
         # page = _get_page(request)
         # limit = get_long_or_default(request, 'limit', settings.PAGE)
@@ -277,13 +330,15 @@ def api_experimenter_list(request, menu, conn=None, **kwargs):
         mapann_value = get_unicode_or_default(request, 'value', None) \
             or get_unicode_or_default(request, 'id', None)
         query = get_bool_or_default(request, 'query', False)
-        if _get_case_sensitive(mapr_settings, menu):
+        if _get_menu(menu).case_sensitive:
             case_sensitive = get_bool_or_default(
                 request, 'case_sensitive', False)
         else:
             case_sensitive = False
+        exact = get_bool_or_default(request, 'exact', False)
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
 
     experimenter = {}
     try:
@@ -294,23 +349,31 @@ def api_experimenter_list(request, menu, conn=None, **kwargs):
         else:
             # fake experimenter -1
             experimenter = fake_experimenter(
-                mapr_settings.CONFIG[menu]['label'])
+                _get_menu(menu).label)
 
-        if _get_wildcard(mapr_settings, menu) or mapann_value:
+        if _get_menu(menu).wildcard or mapann_value:
             experimenter['extra'] = {'case_sensitive': case_sensitive}
             if query:
                 experimenter['extra']['query'] = query
 
-            # count children
-            experimenter['childCount'] = count_mapannotations(
-                conn=conn,
-                mapann_value=mapann_value,
-                query=query,
-                case_sensitive=case_sensitive,
-                mapann_ns=mapann_ns,
-                mapann_names=mapann_names,
-                group_id=group_id,
-                experimenter_id=experimenter_id)
+            # count children, estimated from the sketches if available
+            count = None
+            if not mapann_value and not exact:
+                count = estimate_count(conn, menu, group_id=group_id,
+                                       experimenter_id=experimenter_id)
+            if count is not None:
+                experimenter['extra']['approximate'] = True
+            else:
+                count = get_backend().count_mapannotations(
+                    conn=conn,
+                    mapann_value=mapann_value,
+                    query=query,
+                    case_sensitive=case_sensitive,
+                    mapann_ns=mapann_ns,
+                    mapann_names=mapann_names,
+                    group_id=group_id,
+                    experimenter_id=experimenter_id)
+            experimenter['childCount'] = count
 
             if experimenter['childCount'] > 0 and mapann_value:
                 experimenter['extra']['value'] = mapann_value
@@ -322,16 +385,18 @@ def api_experimenter_list(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'experimenter': experimenter})
+    return _json_response({'experimenter': experimenter})
 
 
 @login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
 def api_mapannotation_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
     try:
-        mapann_ns = _get_ns(mapr_settings, menu)
-        mapann_names = _get_keys(mapr_settings, menu)
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
 
         page = page = _get_page(request)
         limit = get_long_or_default(request, 'limit', settings.PAGE)
@@ -340,57 +405,243 @@ def api_mapannotation_list(request, menu, conn=None, **kwargs):
         mapann_value = get_unicode_or_default(request, 'id', None) \
             or get_unicode_or_default(request, 'value', None)
         query = get_bool_or_default(request, 'query', False)
-        if _get_case_sensitive(mapr_settings, menu):
+        if _get_menu(menu).case_sensitive:
             case_sensitive = get_bool_or_default(
                 request, 'case_sensitive', False)
         else:
             case_sensitive = False
         orphaned = get_bool_or_default(request, 'orphaned', False)
+        columns = _get_columns(request)
     except ValueError:
         logger.error(traceback.format_exc())
         return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
+
+    wc_limit = 0
+    if not mapann_value or query:
+        wc_limit = _get_menu(menu).wildcard_limit
 
     mapannotations = []
     screens = []
     projects = []
+    truncated = False
     try:
-        if _get_wildcard(mapr_settings, menu) or mapann_value:
+        if _get_menu(menu).wildcard or mapann_value:
+            backend = get_backend()
+            params = {
+                'conn': conn,
+                'mapann_value': mapann_value,
+                'query': query,
+                'mapann_ns': mapann_ns,
+                'mapann_names': mapann_names,
+                'group_id': group_id,
+                'experimenter_id': experimenter_id}
             # Get attributes from map annotation
             if orphaned:
-                # offset = _get_wildcard_limit(mapr_settings, menu)
-                mapannotations = marshal_mapannotations(
-                    conn=conn,
-                    mapann_value=mapann_value,
-                    query=query,
-                    case_sensitive=case_sensitive,
-                    mapann_ns=mapann_ns,
-                    mapann_names=mapann_names,
-                    group_id=group_id,
-                    experimenter_id=experimenter_id,
-                    page=page,
-                    limit=limit)
+                def list_maps(page, limit):
+                    # the top values of wildcard menus are precomputed
+                    if not mapann_value:
+                        leaderboard = load_leaderboard(
+                            conn, menu, group_id=group_id,
+                            experimenter_id=experimenter_id,
+                            page=page, limit=limit)
+                        if leaderboard is not None:
+                            return leaderboard
+                    return backend.marshal_mapannotations(
+                        case_sensitive=case_sensitive,
+                        page=page, limit=limit, **params)
+                mapannotations, truncated = wildcard.fetch_window(
+                    list_maps, wc_limit, page, limit)
             else:
-                screens = marshal_screens(
-                    conn=conn,
-                    mapann_value=mapann_value,
-                    query=query,
-                    mapann_ns=mapann_ns,
-                    mapann_names=mapann_names,
-                    group_id=group_id,
-                    experimenter_id=experimenter_id,
-                    page=page,
-                    limit=limit)
-                projects = marshal_projects(
-                    conn=conn,
-                    mapann_value=mapann_value,
-                    query=query,
-                    mapann_ns=mapann_ns,
-                    mapann_names=mapann_names,
-                    group_id=group_id,
-                    experimenter_id=experimenter_id,
-                    page=page,
-                    limit=limit)
+                window = {'wc_limit': wc_limit, 'page': page,
+                          'limit': limit}
+                (screens, s_truncated), (projects, p_truncated) = \
+                    run_concurrently(
+                        (wildcard.fetch_window, dict(
+                            fetch=partial(backend.marshal_screens,
+                                          **params), **window)),
+                        (wildcard.fetch_window, dict(
+                            fetch=partial(backend.marshal_projects,
+                                          **params), **window)))
+                truncated = s_truncated or p_truncated
+
+    except ApiUsageException as e:
+        return HttpResponseBadRequest(e.serverStackTrace)
+    except ServerError as e:
+        return HttpResponseServerError(e.serverStackTrace)
+    except IceException as e:
+        return HttpResponseServerError(e.message)
+
+    return _json_response({'maps': _rows(mapannotations, columns),
+                           'screens': _rows(screens, columns),
+                           'projects': _rows(projects, columns),
+                           'truncated': truncated})
+
+
+def _get_object(request, name, types):
+    """
+    Return the (type, id) of a <type>-<id> parameter or (None, None)
+    """
+    obj = get_unicode_or_default(request, name, None)
+    if not obj:
+        return None, None
+    otype, sep, oid = obj.partition('-')
+    if otype not in types:
+        raise ValueError("Invalid %s %r" % (name, obj))
+    return otype, int(oid)
+
+
+def _marshal_children(conn, menu, ctype, parent_id, mapann_value,
+                      **kwargs):
+    """
+    Marshal the plates or datasets of a screen or project, the image
+    counts of exact values being read from the value index if possible
+    """
+    counted = None
+    if mapann_value and not kwargs.get('query'):
+        counted = load_containers(
+            conn, menu, ctype, parent_id, mapann_value,
+            group_id=kwargs['group_id'],
+            experimenter_id=kwargs['experimenter_id'],
+            page=kwargs['page'], limit=kwargs['limit'])
+    if counted is not None:
+        return counted
+    if ctype == 'plate':
+        return get_backend().marshal_plates(
+            conn=conn, screen_id=parent_id, mapann_value=mapann_value,
+            **kwargs)
+    return get_backend().marshal_datasets(
+        conn=conn, project_id=parent_id, mapann_value=mapann_value,
+        **kwargs)
+
+
+@login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
+def api_expand(request, menu, conn=None, **kwargs):
+    """
+    Return in one response what the tree loads when a value is opened:
+    the count of the value, its screens and projects, the first page
+    of plates or datasets of the `container` and the first page of
+    images of the `child`, e.g. ?value=CDC20&container=screen-3&child=
+    plate-4. The queries run concurrently.
+    """
+
+    # Get parameters
+    try:
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
+
+        limit = get_long_or_default(request, 'limit', settings.PAGE)
+        group_id = get_long_or_default(request, 'group', -1)
+        experimenter_id = get_long_or_default(request, 'experimenter_id', -1)
+        mapann_value = get_unicode_or_default(request, 'value', None)
+        query = get_bool_or_default(request, 'query', False)
+        if _get_menu(menu).case_sensitive:
+            case_sensitive = get_bool_or_default(
+                request, 'case_sensitive', False)
+        else:
+            case_sensitive = False
+        container, container_id = _get_object(
+            request, 'container', ('screen', 'project'))
+        child, child_id = _get_object(
+            request, 'child', ('plate', 'dataset'))
+        load_pixels = get_bool_or_default(request, 'sizeXYZ', False)
+        thumb_version = get_bool_or_default(request, 'thumbVersion', False)
+        date = get_bool_or_default(request, 'date', False)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid parameter value')
+    if not mapann_value:
+        return HttpResponseBadRequest('Missing value')
+    timing.mark('params')
+
+    params = {
+        'conn': conn,
+        'mapann_value': mapann_value,
+        'query': query,
+        'mapann_ns': mapann_ns,
+        'mapann_names': mapann_names,
+        'group_id': group_id,
+        'experimenter_id': experimenter_id}
+    paged = dict(params, page=1, limit=limit)
+    calls = [
+        (get_backend().count_mapannotations,
+         dict(params, case_sensitive=case_sensitive)),
+        (get_backend().marshal_screens, paged),
+        (get_backend().marshal_projects, paged)]
+    if container is not None:
+        calls.append((_marshal_children, dict(
+            paged, menu=menu, parent_id=container_id,
+            ctype='plate' if container == 'screen' else 'dataset')))
+    if child is not None:
+        calls.append((get_backend().marshal_images, dict(
+            paged, parent=child, parent_id=child_id,
+            load_pixels=load_pixels, date=date,
+            thumb_version=thumb_version)))
+
+    try:
+        results = run_concurrently(*calls)
+    except ApiUsageException as e:
+        return HttpResponseBadRequest(e.serverStackTrace)
+    except ServerError as e:
+        return HttpResponseServerError(e.serverStackTrace)
+    except IceException as e:
+        return HttpResponseServerError(e.message)
+
+    experimenter = fake_experimenter(_get_menu(menu).label)
+    experimenter['extra'] = {'case_sensitive': case_sensitive}
+    if query:
+        experimenter['extra']['query'] = query
+    experimenter['childCount'] = results.pop(0)
+    if experimenter['childCount'] > 0:
+        experimenter['extra']['value'] = mapann_value
+
+    rsp = {'experimenter': experimenter,
+           'screens': results.pop(0),
+           'projects': results.pop(0)}
+    if container is not None:
+        rsp['plates' if container == 'screen' else 'datasets'] = \
+            results.pop(0)
+    if child is not None:
+        rsp['images'] = results.pop(0)
+    return _json_response(rsp)
+
+
+@login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
+def api_facets(request, menu, conn=None, **kwargs):
+
+    # Get parameters
+    try:
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
+
+        group_id = get_long_or_default(request, 'group', -1)
+        experimenter_id = get_long_or_default(request, 'experimenter_id', -1)
+        mapann_value = get_unicode_or_default(request, 'value', None)
+        query = get_bool_or_default(request, 'query', False)
+        if _get_menu(menu).case_sensitive:
+            case_sensitive = get_bool_or_default(
+                request, 'case_sensitive', False)
+        else:
+            case_sensitive = False
+    except ValueError:
+        return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
 
+    facets = []
+    try:
+        if mapann_value:
+            facets = get_backend().marshal_facets(
+                conn=conn,
+                mapann_value=mapann_value,
+                query=query,
+                case_sensitive=case_sensitive,
+                mapann_ns=mapann_ns,
+                mapann_names=mapann_names,
+                group_id=group_id,
+                experimenter_id=experimenter_id)
     except ApiUsageException as e:
         return HttpResponseBadRequest(e.serverStackTrace)
     except ServerError as e:
@@ -398,17 +649,18 @@ def api_mapannotation_list(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'maps': mapannotations,
-                         'screens': screens, 'projects': projects})
+    return _json_response({'facets': facets})
 
 
 @login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
 def api_datasets_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
     try:
-        mapann_ns = _get_ns(mapr_settings, menu)
-        mapann_names = _get_keys(mapr_settings, menu)
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
 
         page = _get_page(request)
         limit = get_long_or_default(request, 'limit', settings.PAGE)
@@ -420,14 +672,17 @@ def api_datasets_list(request, menu, conn=None, **kwargs):
         query = get_bool_or_default(request, 'query', False)
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
 
     datasets = []
     try:
-        if _get_wildcard(mapr_settings, menu) or mapann_value:
-            # Get the images
-            datasets = marshal_datasets(
+        if _get_menu(menu).wildcard or mapann_value:
+            # Get the datasets
+            datasets = _marshal_children(
                 conn=conn,
-                project_id=project_id,
+                menu=menu,
+                ctype='dataset',
+                parent_id=project_id,
                 mapann_value=mapann_value,
                 query=query,
                 mapann_ns=mapann_ns,
@@ -443,16 +698,18 @@ def api_datasets_list(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'datasets': datasets})
+    return _json_response({'datasets': datasets})
 
 
 @login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
 def api_plate_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
     try:
-        mapann_ns = _get_ns(mapr_settings, menu)
-        mapann_names = _get_keys(mapr_settings, menu)
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
 
         page = _get_page(request)
         limit = get_long_or_default(request, 'limit', settings.PAGE)
@@ -464,14 +721,17 @@ def api_plate_list(request, menu, conn=None, **kwargs):
         query = get_bool_or_default(request, 'query', False)
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
 
     plates = []
     try:
-        if _get_wildcard(mapr_settings, menu) or mapann_value:
-            # Get the images
-            plates = marshal_plates(
+        if _get_menu(menu).wildcard or mapann_value:
+            # Get the plates
+            plates = _marshal_children(
                 conn=conn,
-                screen_id=screen_id,
+                menu=menu,
+                ctype='plate',
+                parent_id=screen_id,
                 mapann_value=mapann_value,
                 query=query,
                 mapann_ns=mapann_ns,
@@ -487,16 +747,18 @@ def api_plate_list(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'plates': plates})
+    return _json_response({'plates': plates})
 
 
 @login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
 def api_image_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
     try:
-        mapann_ns = _get_ns(mapr_settings, menu)
-        mapann_names = _get_keys(mapr_settings, menu)
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
 
         page = _get_page(request)
         limit = get_long_or_default(request, 'limit', settings.PAGE)
@@ -510,14 +772,16 @@ def api_image_list(request, menu, conn=None, **kwargs):
         parent_id = get_long_or_default(request, 'id', None)
         mapann_value = get_unicode_or_default(request, 'value', None)
         query = get_bool_or_default(request, 'query', False)
+        columns = _get_columns(request)
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
 
     images = []
     try:
-        if _get_wildcard(mapr_settings, menu) or mapann_value:
+        if _get_menu(menu).wildcard or mapann_value:
             # Get the images
-            images = marshal_images(
+            images = get_backend().marshal_images(
                 conn=conn,
                 parent=parent,
                 parent_id=parent_id,
@@ -539,7 +803,104 @@ def api_image_list(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'images': images})
+    return _json_response({'images': _rows(images, columns)})
+
+
+def _get_terms(request, name):
+    """
+    Return the (menu, value) pairs of the <menu>:<value> parameters
+    """
+    terms = []
+    for term in request.GET.getlist(name):
+        menu, sep, value = term.partition(':')
+        if not sep or not value or menu not in mapr_settings.CONFIG:
+            raise ValueError("Invalid term %r" % term)
+        terms.append((menu, value))
+    return terms
+
+
+@login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
+def api_image_query(request, conn=None, **kwargs):
+    """
+    Page through the images matching a boolean combination of values
+    of any menus, e.g. ?all=gene:CDC20&all=phenotype:<value>&none=...
+    Images must match all of the `all` terms and one of the `any`
+    terms, but none of the `none` terms. Every term is resolved to the
+    sorted IDs of its images, which are combined with set algebra.
+    """
+
+    # Get parameters
+    try:
+        all_terms = _get_terms(request, 'all')
+        any_terms = _get_terms(request, 'any')
+        none_terms = _get_terms(request, 'none')
+
+        page = _get_page(request)
+        limit = get_long_or_default(request, 'limit', settings.PAGE)
+        group_id = get_long_or_default(request, 'group', -1)
+        load_pixels = get_bool_or_default(request, 'sizeXYZ', False)
+        thumb_version = get_bool_or_default(request, 'thumbVersion', False)
+        date = get_bool_or_default(request, 'date', False)
+        experimenter_id = get_long_or_default(request,
+                                              'experimenter_id', -1)
+        columns = _get_columns(request)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid parameter value')
+    if not all_terms and not any_terms:
+        return HttpResponseBadRequest('No all or any terms')
+    timing.mark('params')
+
+    backend = get_backend()
+    terms = all_terms + any_terms + none_terms
+    sets = [None] * len(terms)
+    calls = []
+    for i, (menu, value) in enumerate(terms):
+        # the value indexes hold the images of all groups and users
+        # seen by the user they were built as
+        index = None
+        if group_id == -1 and experimenter_id == -1:
+            index = get_value_index(conn, menu)
+        if index is not None:
+            sets[i] = bitmaps.from_ids(index.image_ids(value))
+            continue
+        calls.append((i, (backend.image_ids, dict(
+            conn=conn,
+            mapann_value=value,
+            mapann_ns=_get_menu(menu).ns,
+            mapann_names=_get_menu(menu).keys,
+            group_id=group_id,
+            experimenter_id=experimenter_id))))
+
+    try:
+        found = run_concurrently(*[call for i, call in calls])
+        for (i, call), ids in zip(calls, found):
+            sets[i] = bitmaps.from_ids(ids)
+        with timing.phase('bitmaps'):
+            n_all = len(all_terms)
+            n_any = n_all + len(any_terms)
+            ids = bitmaps.evaluate(sets[:n_all], sets[n_all:n_any],
+                                   sets[n_any:])
+            total = len(ids)
+            ids = bitmaps.page_ids(ids, page, limit)
+        images = backend.marshal_images_by_id(
+            conn=conn,
+            image_ids=ids,
+            load_pixels=load_pixels,
+            group_id=group_id,
+            date=date,
+            thumb_version=thumb_version)
+    except ApiUsageException as e:
+        return HttpResponseBadRequest(e.serverStackTrace)
+    except ServerError as e:
+        return HttpResponseServerError(e.serverStackTrace)
+    except IceException as e:
+        return HttpResponseServerError(e.message)
+
+    return _json_response({'images': _rows(images, columns),
+                           'meta': {'page': page, 'limit': limit,
+                                    'totalCount': total}})
 
 
 @login_required()
@@ -571,25 +932,42 @@ def load_metadata_details(request, c_type, conn=None, share_id=None,
 
 
 @login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
 def api_annotations(request, menu, conn=None, **kwargs):
 
     # Get parameters
     try:
-        mapann_ns = _get_ns(mapr_settings, menu)
+        mapann_ns = _get_menu(menu).ns
 
         mapann_value = get_unicode_or_default(request, 'map', None)
-        mapann_names = _get_keys(mapr_settings, menu)
+        mapann_names = _get_menu(menu).keys
+
+        page = _get_page(request)
+        limit = get_long_or_default(request, 'limit', settings.PAGE)
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
 
     anns = []
     exps = []
+    total = 0
     try:
-        anns, exps = load_mapannotation(
+        anns, exps = get_backend().load_mapannotation(
             conn=conn,
             mapann_ns=mapann_ns,
             mapann_names=mapann_names,
-            mapann_value=mapann_value)
+            mapann_value=mapann_value,
+            page=page,
+            limit=limit)
+        if len(anns) < limit and page == 1:
+            total = len(anns)
+        else:
+            total = get_backend().count_annotations(
+                conn=conn,
+                mapann_ns=mapann_ns,
+                mapann_names=mapann_names,
+                mapann_value=mapann_value)
     except ApiUsageException as e:
         return HttpResponseBadRequest(e.serverStackTrace)
     except ServerError as e:
@@ -597,16 +975,20 @@ def api_annotations(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'annotations': anns, 'experimenters': exps})
+    return _json_response({'annotations': anns, 'experimenters': exps,
+                           'meta': {'page': page, 'limit': limit,
+                                    'totalCount': total}})
 
 
 @login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
 def mapannotations_autocomplete(request, menu, conn=None, **kwargs):
 
     # Get parameters
     try:
-        mapann_ns = _get_ns(mapr_settings, menu)
-        mapann_names = _get_keys(mapr_settings, menu)
+        mapann_ns = _get_menu(menu).ns
+        mapann_names = _get_menu(menu).keys
 
         page = _get_page(request)
         limit = get_long_or_default(request, 'limit', settings.PAGE)
@@ -614,18 +996,19 @@ def mapannotations_autocomplete(request, menu, conn=None, **kwargs):
         experimenter_id = get_long_or_default(request, 'experimenter_id', -1)
         mapann_value = get_unicode_or_default(request, 'value', None)
         query = get_bool_or_default(request, 'query', True)
-        if _get_case_sensitive(mapr_settings, menu):
+        if _get_menu(menu).case_sensitive:
             case_sensitive = get_bool_or_default(
                 request, 'case_sensitive', False)
         else:
             case_sensitive = False
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
 
     autocomplete = []
     try:
         if mapann_value:
-            autocomplete = marshal_autocomplete(
+            autocomplete = get_backend().marshal_autocomplete(
                 conn=conn,
                 mapann_value=mapann_value,
                 query=query,
@@ -643,10 +1026,76 @@ def mapannotations_autocomplete(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse(list(autocomplete), safe=False)
+    return _json_response(list(autocomplete), safe=False)
+
+
+@login_required()
+@rate_limited(EXPENSIVE)
+@timing.profiled
+def api_search(request, conn=None, **kwargs):
+    """
+    Search a value in every menu at once, returning for each menu the
+    number of matching values and the best matches for autocomplete.
+    The per menu queries run concurrently on the mapr executor.
+    """
+
+    # Get parameters
+    try:
+        limit = get_long_or_default(request, 'limit', 10)
+        group_id = get_long_or_default(request, 'group', -1)
+        experimenter_id = get_long_or_default(request, 'experimenter_id', -1)
+        mapann_value = get_unicode_or_default(request, 'value', None)
+        query = get_bool_or_default(request, 'query', True)
+        case_sensitive = get_bool_or_default(
+            request, 'case_sensitive', False)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid parameter value')
+    timing.mark('params')
+
+    results = []
+    if not mapann_value:
+        return _json_response({'results': results})
+
+    menus = list(mapr_settings.CONFIG)
+    backend = get_backend()
+    calls = []
+    for menu in menus:
+        params = dict(
+            conn=conn,
+            mapann_value=mapann_value,
+            query=query,
+            case_sensitive=(case_sensitive and
+                            _get_menu(menu).case_sensitive),
+            mapann_ns=_get_menu(menu).ns,
+            mapann_names=_get_menu(menu).keys,
+            group_id=group_id,
+            experimenter_id=experimenter_id)
+        calls.append((backend.count_mapannotations, params))
+        calls.append((backend.marshal_autocomplete,
+                      dict(params, page=1, limit=limit)))
+
+    try:
+        found = run_concurrently(*calls)
+    except ApiUsageException as e:
+        return HttpResponseBadRequest(e.serverStackTrace)
+    except ServerError as e:
+        return HttpResponseServerError(e.serverStackTrace)
+    except IceException as e:
+        return HttpResponseServerError(e.message)
+
+    for i, menu in enumerate(menus):
+        results.append({
+            'menu': menu,
+            'label': _get_menu(menu).label,
+            'count': found[2 * i],
+            'matches': list(found[2 * i + 1]),
+        })
+    results.sort(key=lambda r: -r['count'])
+    return _json_response({'results': results})
 
 
 @login_required()
+@rate_limited(CHEAP)
 def mapannotations_favicon(request, conn=None, **kwargs):
 
     icon = None
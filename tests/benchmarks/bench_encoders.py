@@ -0,0 +1,67 @@
+"""
+Compares the JSON encoders of omero_mapr.utils.encoder on payloads
+shaped like the mapr responses.
+
+    $ python tests/benchmarks/bench_encoders.py [--repeat 20]
+"""
+
+import argparse
+import random
+import timeit
+
+from omero_mapr.utils.encoder import ENCODERS
+
+
+PERMS = ["canEdit canAnnotate canLink canDelete canChgrp",
+         "canAnnotate canLink isOwned",
+         ""]
+
+
+def images_page(size=1000):
+    """ An /images/ page with sizeXYZ=true and date=true """
+    return {'images': [{
+        'id': 1000000 + i,
+        'name': "plate1_A%d_field%d.tif" % (i // 10, i % 10),
+        'ownerId': 2,
+        'permsCss': random.choice(PERMS),
+        'filesetId': 500000 + i // 10,
+        'sizeX': 1344,
+        'sizeY': 1024,
+        'sizeZ': 1,
+        'acqDate': 1420070400000 + i,
+        'date': 1420070400000 + i,
+        'thumbVersion': 3000000 + i,
+    } for i in range(size)]}
+
+
+def maps_page(size=1000):
+    """ A wildcard listing of map values """
+    return {'maps': [{
+        'id': "GENE%05d" % i,
+        'name': "GENE%05d (%d)" % (i, i % 97),
+        'ownerId': -1,
+        'permsCss': "",
+        'childCount': i % 13,
+        'extra': {'counter': i % 97},
+    } for i in range(size)], 'truncated': False}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--size', type=int, default=1000)
+    args = parser.parse_args()
+
+    payloads = [('images', images_page(args.size)),
+                ('maps', maps_page(args.size))]
+    for label, data in payloads:
+        for name, encoder in sorted(ENCODERS.items()):
+            size = len(encoder(data))
+            best = min(timeit.repeat(lambda: encoder(data),
+                                     number=1, repeat=args.repeat))
+            print("%-8s %-8s %8.2f ms %9d bytes"
+                  % (label, name, best * 1000, size))
+
+
+if __name__ == '__main__':
+    main()
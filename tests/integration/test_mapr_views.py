@@ -30,6 +30,8 @@ from django.core.urlresolvers import reverse
 
 from omeroweb.testlib import get_json
 
+from omero_mapr import tree
+
 
 class TestMaprViews(object):
 
@@ -138,3 +140,136 @@ class TestMaprViews(object):
             names = ["%s (%d)" % (k, v) for k, v in ac['res_value'].items()]
             for r in response['maps']:
                 assert r['name'] in names
+
+    @pytest.mark.parametrize('menu, value', (
+        ('organism', 'Homo sapiens'),
+        ('gene', 'cdc14'),
+    ))
+    def test_api_paths_to_objects(self, imaprtest, menu, value):
+        screen_id = imaprtest.screen.id.val
+        plate_id = imaprtest.plate.id.val
+
+        request_url = reverse("mapannotations_api_paths_to_objects",
+                              args=[menu])
+        response = get_json(
+            imaprtest.django_client, request_url,
+            {'map.value': value, 'screen': screen_id, 'plate': plate_id})
+
+        # same paths as resolving the objects one at a time
+        request_url = reverse("mapannotations_api_paths_to_object",
+                              args=[menu])
+        for t, oid in (('screen', screen_id), ('plate', plate_id)):
+            single = get_json(
+                imaprtest.django_client, request_url,
+                {'map.value': value, t: oid})
+            paths = response['paths']['%s-%s' % (t, oid)]
+            assert len(paths) > 0
+            assert sorted(paths, key=json.dumps) == \
+                sorted(single['paths'], key=json.dumps)
+
+    def test_api_search(self, imaprtest):
+        request_url = reverse("mapr_search")
+        response = get_json(imaprtest.django_client, request_url,
+                            {'value': 'cdc14', 'query': 'false'})
+
+        results = dict((r['menu'], r) for r in response['results'])
+        assert results['gene']['count'] > 0
+        assert 'cdc14' in [m['value'].lower()
+                           for m in results['gene']['matches']]
+        assert results['organism']['count'] == 0
+
+    def test_api_image_query(self, imaprtest):
+        request_url = reverse("mapr_image_query")
+        response = get_json(imaprtest.django_client, request_url,
+                            {'all': 'gene:cdc14'})
+        assert response['meta']['totalCount'] > 0
+        assert len(response['images']) == response['meta']['totalCount']
+
+        response = get_json(imaprtest.django_client, request_url,
+                            {'all': 'gene:cdc14', 'none': 'gene:cdc14'})
+        assert response['meta']['totalCount'] == 0
+        assert response['images'] == []
+
+    def _query_ids(self, imaprtest, data):
+        request_url = reverse("mapr_image_query")
+        response = get_json(imaprtest.django_client, request_url,
+                            dict(data, limit=100))
+        return response['meta']['totalCount'], \
+            set(i['id'] for i in response['images'])
+
+    def test_api_image_query_none_subset(self, imaprtest):
+        # the wells of YFR028C are two of the four of cdc14
+        count, ids = self._query_ids(imaprtest, {'all': 'gene:cdc14'})
+        subset_count, subset = self._query_ids(
+            imaprtest, {'all': 'gene:YFR028C'})
+        assert 0 < subset_count < count
+        assert subset < ids
+
+        total, found = self._query_ids(
+            imaprtest, {'all': 'gene:cdc14', 'none': 'gene:YFR028C'})
+        assert total == count - subset_count
+        assert found == ids - subset
+
+        total, found = self._query_ids(
+            imaprtest, {'any': ['gene:cdc14', 'gene:YFR028C']})
+        assert total == count
+        assert found == ids
+
+    def test_api_image_query_max_rows(self, imaprtest, settings,
+                                      monkeypatch):
+        expected = [
+            self._query_ids(imaprtest, data) for data in (
+                {'all': 'gene:cdc14'},
+                {'all': 'gene:cdc14', 'none': 'gene:YFR028C'})]
+        # the ID sets are read whole, one row per query
+        settings.MAPR_MAX_ROWS = 1
+        monkeypatch.setattr(tree, 'ID_BATCH_SIZE', 1)
+        request_url = reverse("mapr_image_query")
+        for data, (count, ids) in zip((
+                {'all': 'gene:cdc14'},
+                {'all': 'gene:cdc14', 'none': 'gene:YFR028C'}), expected):
+            pages = set()
+            for page in range(1, count + 1):
+                response = get_json(imaprtest.django_client, request_url,
+                                    dict(data, limit=1, page=page))
+                assert response['meta']['totalCount'] == count
+                pages.update(i['id'] for i in response['images'])
+            assert pages == ids
+
+    def test_api_images_columns(self, imaprtest):
+        request_url = reverse("mapannotations_api_images", args=['gene'])
+        data = {'value': 'cdc14', 'node': 'plate',
+                'id': imaprtest.plate.id.val}
+        rows = get_json(imaprtest.django_client, request_url,
+                        data)['images']
+        data['format'] = 'columns'
+        images = get_json(imaprtest.django_client, request_url,
+                          data)['images']
+        assert images['count'] == len(rows)
+        assert images['columns']['id'] == [r['id'] for r in rows]
+        perms = images['dictionaries'].get('permsCss')
+        if perms is not None:
+            assert [perms[i] for i in images['columns']['permsCss']] == \
+                [r['permsCss'] for r in rows]
+
+    def test_api_expand(self, imaprtest):
+        screen_id = imaprtest.screen.id.val
+        plate_id = imaprtest.plate.id.val
+
+        request_url = reverse("mapannotations_api_expand", args=['gene'])
+        response = get_json(
+            imaprtest.django_client, request_url,
+            {'value': 'cdc14', 'container': 'screen-%s' % screen_id,
+             'child': 'plate-%s' % plate_id})
+
+        # same as the separate calls of the tree
+        for name, key, data in (
+                ('mapannotations_api_mapannotations', 'screens', {}),
+                ('mapannotations_api_plates', 'plates', {'id': screen_id}),
+                ('mapannotations_api_images', 'images',
+                 {'id': plate_id, 'node': 'plate'})):
+            data['value'] = 'cdc14'
+            single = get_json(imaprtest.django_client,
+                              reverse(name, args=['gene']), data)
+            assert response[key] == single[key]
+        assert response['experimenter']['childCount'] > 0
@@ -0,0 +1,27 @@
+import pytest
+
+from omero_mapr.utils import bitmaps
+
+
+class TestBitmaps(object):
+
+    """
+    Tests the set algebra over image IDs
+    """
+
+    def test_evaluate(self):
+        a = bitmaps.from_ids([5, 1, 3, 3, 7])
+        b = bitmaps.from_ids([3, 4, 5, 7])
+        c = bitmaps.from_ids([7])
+        assert bitmaps.page_ids(bitmaps.evaluate([a, b])) == [3, 5, 7]
+        assert bitmaps.page_ids(bitmaps.evaluate([a, b], [], [c])) == [3, 5]
+        assert bitmaps.page_ids(bitmaps.evaluate([], [b, c], [a])) == [4]
+        assert bitmaps.page_ids(bitmaps.evaluate([c], [a, b])) == [7]
+        with pytest.raises(ValueError):
+            bitmaps.evaluate([], [], [a])
+
+    def test_page(self):
+        ids = bitmaps.from_ids(range(10))
+        assert bitmaps.page_ids(ids, 2, 4) == [4, 5, 6, 7]
+        assert bitmaps.page_ids(ids, 3, 4) == [8, 9]
+        assert bitmaps.page_ids(ids, 4, 4) == []
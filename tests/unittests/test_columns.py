@@ -0,0 +1,27 @@
+from omero_mapr.utils.columns import to_columns
+
+
+class TestColumns(object):
+
+    """
+    Tests the columnar encoding of marshalled rows
+    """
+
+    def test_columns(self):
+        rows = [{'id': i, 'name': "image%d" % i,
+                 'permsCss': "canLink" if i % 3 else "",
+                 'extra': {'counter': i}} for i in range(6)]
+        rows[5]['sizeX'] = 512
+        rv = to_columns(rows)
+        assert rv['count'] == 6
+        columns = rv['columns']
+        assert columns['id'] == list(range(6))
+        assert columns['name'] == ["image%d" % i for i in range(6)]
+        assert columns['extra.counter'] == list(range(6))
+        assert columns['sizeX'] == [None] * 5 + [512]
+        assert rv['dictionaries'] == {'permsCss': ["", "canLink"]}
+        assert columns['permsCss'] == [0, 1, 1, 0, 1, 1]
+
+    def test_empty(self):
+        assert to_columns([]) == {'count': 0, 'columns': {},
+                                  'dictionaries': {}}
@@ -0,0 +1,34 @@
+import json
+import datetime
+import pytest
+
+from omero_mapr.utils import encoder
+
+
+DATA = {'images': [{'id': 1, 'name': u"écran", 'ownerId': 2,
+                    'date': datetime.datetime(2020, 1, 2, 3, 4, 5)}],
+        'counts': {3: 4},
+        'keys': ("Gene Symbol",)}
+
+
+class TestEncoder(object):
+
+    """
+    Tests the JSON encoders of the mapr responses
+    """
+
+    @pytest.mark.parametrize("name", sorted(encoder.ENCODERS))
+    def test_encode(self, name):
+        rv = json.loads(encoder.get_encoder(name)(DATA).decode('utf-8'))
+        assert rv == {'images': [{'id': 1, 'name': u"écran",
+                                  'ownerId': 2,
+                                  'date': "2020-01-02T03:04:05"}],
+                      'counts': {'3': 4},
+                      'keys': ["Gene Symbol"]}
+
+    def test_get_encoder(self):
+        assert encoder.get_encoder('json') is encoder.dumps_json
+        assert encoder.get_encoder('auto') in encoder.ENCODERS.values()
+        assert encoder.check_encoder('auto') == 'auto'
+        with pytest.raises(ValueError):
+            encoder.check_encoder('yaml')
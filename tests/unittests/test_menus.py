@@ -0,0 +1,52 @@
+import json
+import pytest
+
+from omero_mapr.utils import config_list_to_dict, compile_menu, compile_menus
+
+
+GENE = {"menu": "gene", "config": {
+    "default": ["Gene Symbol"],
+    "all": ["Gene Symbol", "Gene Identifier"],
+    "ns": ["openmicroscopy.org/mapr/gene"],
+    "label": "Gene",
+    "case_sensitive": "true",
+    "wildcard": {"enabled": True, "limit": 1000}}}
+
+
+class TestConfig(object):
+
+    """
+    Tests the compilation of omero.web.mapr.config
+    """
+
+    def test_compile(self):
+        menus = compile_menus(config_list_to_dict(json.dumps([GENE])))
+        gene = menus['gene']
+        assert gene.label == "Gene"
+        assert gene.keys == ("Gene Symbol", "Gene Identifier")
+        assert gene.ns == ("openmicroscopy.org/mapr/gene",)
+        assert gene.case_sensitive is True
+        assert gene.wildcard is True
+        assert gene.wildcard_limit == 1000
+        with pytest.raises(TypeError):
+            menus['other'] = gene
+
+    def test_defaults(self):
+        menu = compile_menu("any", {"default": ["Any Value"], "all": [],
+                                    "label": "Any"})
+        assert menu.ns == ()
+        assert menu.case_sensitive is False
+        assert menu.wildcard is False
+        assert menu.wildcard_limit == 0
+
+    @pytest.mark.parametrize("config", [
+        {"all": [], "label": "Any"},
+        {"default": ["Any Value"], "all": "Any Value", "label": "Any"},
+        {"default": ["Any Value"], "all": [], "label": "Any",
+         "wildcard": {"limit": "10"}},
+        {"default": ["Any Value"], "all": []},
+    ])
+    def test_malformed(self, config):
+        with pytest.raises(ValueError):
+            config_list_to_dict(json.dumps(
+                [{"menu": "any", "config": config}]))
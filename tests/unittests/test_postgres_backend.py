@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from psycopg2.extensions import make_dsn  # noqa
+
+from omero_mapr.backends.postgres import PostgresBackend  # noqa
+
+
+DSN = os.environ.get("MAPR_TEST_POSTGRES_DSN")
+NS = "openmicroscopy.org/mapr/gene"
+SCHEMA = "mapr_test"
+
+pytestmark = pytest.mark.skipif(
+    not DSN, reason="MAPR_TEST_POSTGRES_DSN is not set")
+
+SEED = """
+    DROP SCHEMA IF EXISTS %(s)s CASCADE;
+    CREATE SCHEMA %(s)s;
+    SET search_path = %(s)s;
+    CREATE TABLE experimentergroup (id bigint, permissions bigint);
+    CREATE TABLE annotation (id bigint, ns text,
+        owner_id bigint, group_id bigint);
+    CREATE TABLE annotation_mapvalue (annotation_id bigint, index int,
+        name text, value text);
+    CREATE TABLE image (id bigint, name text,
+        owner_id bigint, group_id bigint);
+    CREATE TABLE well (id bigint, plate bigint,
+        owner_id bigint, group_id bigint);
+    CREATE TABLE wellsample (id bigint, image bigint, well bigint,
+        owner_id bigint, group_id bigint);
+    CREATE TABLE screen (id bigint, name text,
+        owner_id bigint, group_id bigint);
+    CREATE TABLE imageannotationlink (id bigint, parent bigint,
+        child bigint, owner_id bigint, group_id bigint);
+    CREATE TABLE wellannotationlink (id bigint, parent bigint,
+        child bigint, owner_id bigint, group_id bigint);
+    CREATE TABLE screenplatelink (id bigint, parent bigint, child bigint);
+    CREATE TABLE datasetimagelink (id bigint, parent bigint, child bigint);
+    CREATE TABLE projectdatasetlink (id bigint, parent bigint,
+        child bigint);
+
+    -- group 3 is read-only (rwr---), group 4 private (rw----)
+    INSERT INTO experimentergroup VALUES (3, -56), (4, -120);
+    INSERT INTO annotation VALUES (1, '%(ns)s', 5, 3), (2, '%(ns)s', 5, 4);
+    INSERT INTO annotation_mapvalue VALUES
+        (1, 0, 'Gene Symbol', 'CDC20'), (2, 0, 'Gene Symbol', 'PLK1');
+
+    -- image 10 in project 50, image 11 in screen 30
+    INSERT INTO image VALUES (10, 'a', 5, 3), (11, 'b', 5, 4);
+    INSERT INTO datasetimagelink VALUES (1, 40, 10);
+    INSERT INTO projectdatasetlink VALUES (1, 50, 40);
+    INSERT INTO imageannotationlink VALUES
+        (1, 10, 1, 5, 3), (2, 11, 2, 5, 4);
+    INSERT INTO well VALUES (60, 20, 5, 4);
+    INSERT INTO wellsample VALUES (70, 11, 60, 5, 4);
+    INSERT INTO wellannotationlink VALUES (1, 60, 2, 5, 4);
+    INSERT INTO screenplatelink VALUES (1, 30, 20);
+    INSERT INTO screen VALUES (30, 'screen', 5, 4);
+"""
+
+
+class EventContext(object):
+
+    def __init__(self, user_id, member_of, leader_of=(), admin=False):
+        self.userId = user_id
+        self.memberOfGroups = list(member_of)
+        self.leaderOfGroups = list(leader_of)
+        self.isAdmin = admin
+
+
+class Conn(object):
+
+    def __init__(self, *args, **kwargs):
+        self.ctx = EventContext(*args, **kwargs)
+
+    def getEventContext(self):
+        return self.ctx
+
+    def getUserId(self):
+        return self.ctx.userId
+
+
+@pytest.fixture(scope="module")
+def backend():
+    db = psycopg2.connect(DSN)
+    try:
+        with db.cursor() as cur:
+            cur.execute(SEED % {'s': SCHEMA, 'ns': NS})
+        db.commit()
+    finally:
+        db.close()
+    return PostgresBackend(
+        make_dsn(DSN, options="-c search_path=%s" % SCHEMA), 2)
+
+
+class TestPostgresBackend(object):
+
+    """
+    Tests the postgres backend applies the OMERO visibility rules
+    """
+
+    @pytest.mark.parametrize('conn, count', [
+        (Conn(2, [3, 4]), 1),
+        (Conn(2, [3, 4], leader_of=[4]), 2),
+        (Conn(5, [3, 4]), 2),
+        (Conn(2, [4]), 0),
+        (Conn(0, [0], admin=True), 2),
+    ])
+    def test_count(self, backend, conn, count):
+        assert backend.count_mapannotations(
+            conn, None, mapann_ns=[NS]) == count
+
+    def test_mapannotations(self, backend):
+        maps = backend.marshal_mapannotations(
+            Conn(5, [3, 4]), "cdc", query=True, mapann_ns=[NS], limit=10)
+        assert [(m['id'], m['childCount']) for m in maps] == [("CDC20", 1)]
+
+    def test_screens(self, backend):
+        assert backend.marshal_screens(
+            Conn(2, [3, 4]), "PLK1", mapann_ns=[NS], limit=10) == []
+        screens = backend.marshal_screens(
+            Conn(5, [3, 4]), "PLK1", mapann_ns=[NS], limit=10)
+        assert len(screens) == 1
+        assert screens[0]['name'] == "screen (1)"
+        assert 'isOwned' in screens[0]['permsCss']
+        assert screens[0]['extra'] == {'counter': 1, 'value': "PLK1"}
+
+    def test_pool_exhausted(self, backend):
+        # more concurrent queries than the 2 pooled connections
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            counts = list(executor.map(
+                lambda i: backend.count_mapannotations(
+                    Conn(5, [3, 4]), None, mapann_ns=[NS]), range(16)))
+        assert counts == [2] * 16
@@ -0,0 +1,226 @@
+import os
+import uuid
+import threading
+
+import pytest
+
+from omero_mapr import ratelimit
+from omero_mapr.mapr_settings import MaprSettings
+from omero_mapr.ratelimit import client_key, take_token, rate_limited, \
+    BUCKET_KEY, CHEAP, EXPENSIVE
+from omero_mapr.utils import executor
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+
+REDIS_URL = os.environ.get("MAPR_TEST_REDIS_URL")
+
+needs_redis = pytest.mark.skipif(
+    redis is None or not REDIS_URL,
+    reason="redis or MAPR_TEST_REDIS_URL is not available")
+
+
+class FakeRequest(object):
+
+    def __init__(self, **meta):
+        self.META = meta
+
+
+class FakeConn(object):
+
+    def __init__(self, user_id=None):
+        self.user_id = user_id
+
+    def isAnonymous(self):
+        return self.user_id is None
+
+    def getUserId(self):
+        return self.user_id
+
+
+class Clock(object):
+
+    """
+    Stands for the time module, the time being set by the test
+    """
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestClientKey(object):
+
+    """
+    Tests the key requests are counted by
+    """
+
+    def test_user(self):
+        request = FakeRequest(REMOTE_ADDR="10.0.0.1")
+        assert client_key(request, FakeConn(5)) == "u5"
+
+    def test_remote_addr(self, monkeypatch):
+        monkeypatch.setattr(MaprSettings, 'TRUSTED_PROXIES', 0)
+        request = FakeRequest(REMOTE_ADDR="10.0.0.1",
+                              HTTP_X_FORWARDED_FOR="1.2.3.4")
+        assert client_key(request, FakeConn()) == "ip10.0.0.1"
+
+    def test_trusted_proxies(self, monkeypatch):
+        # the client sets the first entry, the two proxies the others
+        request = FakeRequest(REMOTE_ADDR="10.0.0.2",
+                              HTTP_X_FORWARDED_FOR="6.6.6.6, 1.2.3.4, "
+                                                   "10.0.0.1")
+        monkeypatch.setattr(MaprSettings, 'TRUSTED_PROXIES', 1)
+        assert client_key(request) == "ip10.0.0.1"
+        monkeypatch.setattr(MaprSettings, 'TRUSTED_PROXIES', 2)
+        assert client_key(request) == "ip1.2.3.4"
+
+    def test_behind_proxy(self, monkeypatch):
+        # REMOTE_ADDR is nginx for every visitor
+        alice = FakeRequest(REMOTE_ADDR="127.0.0.1",
+                            HTTP_X_FORWARDED_FOR="1.2.3.4")
+        bob = FakeRequest(REMOTE_ADDR="127.0.0.1",
+                          HTTP_X_FORWARDED_FOR="5.6.7.8")
+        monkeypatch.setattr(MaprSettings, 'TRUSTED_PROXIES', 0)
+        assert client_key(alice) == client_key(bob) == "ip127.0.0.1"
+        monkeypatch.setattr(MaprSettings, 'TRUSTED_PROXIES', 1)
+        assert client_key(alice) == "ip1.2.3.4"
+        assert client_key(bob) == "ip5.6.7.8"
+
+    def test_too_few_entries(self, monkeypatch):
+        monkeypatch.setattr(MaprSettings, 'TRUSTED_PROXIES', 2)
+        request = FakeRequest(REMOTE_ADDR="10.0.0.1",
+                              HTTP_X_FORWARDED_FOR="1.2.3.4")
+        assert client_key(request) == "ip10.0.0.1"
+
+
+@needs_redis
+class TestTokenBucket(object):
+
+    """
+    Tests the token bucket script against redis
+    """
+
+    @pytest.fixture
+    def bucket(self, monkeypatch):
+        cache = redis.StrictRedis.from_url(REDIS_URL)
+        clock = Clock(1000.0)
+        key = uuid.uuid4().hex
+        monkeypatch.setattr(ratelimit, 'get_redis', lambda: cache)
+        monkeypatch.setattr(ratelimit, 'time', clock)
+        monkeypatch.setattr(MaprSettings, 'RATE_LIMITS',
+                            {EXPENSIVE: [0.5, 2]})
+        yield clock, key
+        cache.delete(BUCKET_KEY % (EXPENSIVE, key))
+
+    def test_burst(self, bucket):
+        clock, key = bucket
+        assert take_token(EXPENSIVE, key) == 0
+        assert take_token(EXPENSIVE, key) == 0
+        assert take_token(EXPENSIVE, key) > 0
+
+    def test_refill(self, bucket):
+        clock, key = bucket
+        take_token(EXPENSIVE, key)
+        take_token(EXPENSIVE, key)
+        clock.now += 2
+        assert take_token(EXPENSIVE, key) == 0
+        assert take_token(EXPENSIVE, key) > 0
+        # a long idle time refills no more than the burst
+        clock.now += 3600
+        assert take_token(EXPENSIVE, key) == 0
+        assert take_token(EXPENSIVE, key) == 0
+        assert take_token(EXPENSIVE, key) > 0
+
+    def test_retry_after(self, bucket):
+        clock, key = bucket
+        take_token(EXPENSIVE, key)
+        take_token(EXPENSIVE, key)
+        # a token comes back every 2 seconds
+        assert take_token(EXPENSIVE, key) == 2
+        clock.now += 1
+        assert take_token(EXPENSIVE, key) == 1
+        clock.now += 1
+        assert take_token(EXPENSIVE, key) == 0
+
+    def test_unlimited(self, bucket):
+        clock, key = bucket
+        for i in range(5):
+            assert take_token(CHEAP, key) == 0
+
+
+class TestShedding(object):
+
+    """
+    Tests rejecting the expensive requests of the public user while
+    the process is overloaded
+    """
+
+    @pytest.fixture
+    def view(self, monkeypatch):
+        monkeypatch.setattr(ratelimit, 'get_redis', lambda: None)
+        monkeypatch.setattr(ratelimit, 'overloaded', lambda: True)
+        monkeypatch.setattr(MaprSettings, 'SHED_LOAD', True)
+        monkeypatch.setattr(MaprSettings, 'TRUSTED_PROXIES', 0)
+
+        def view(request, conn=None, **kwargs):
+            return "served"
+        return view
+
+    def test_overloaded(self, monkeypatch):
+        monkeypatch.setattr(executor, '_executor', object())
+        monkeypatch.setattr(executor, '_slots', threading.BoundedSemaphore(2))
+        monkeypatch.setattr(MaprSettings, 'MAX_WORKERS', 2)
+        assert not executor.overloaded()
+        # one request running its calls on every thread
+        assert executor._slots.acquire(False)
+        assert executor._slots.acquire(False)
+        with executor.in_progress():
+            assert not executor.overloaded()
+            # a second request waits on its own thread
+            with executor.in_progress():
+                assert executor.overloaded()
+            assert not executor.overloaded()
+        executor._slots.release()
+        with executor.in_progress(), executor.in_progress():
+            assert not executor.overloaded()
+        executor._slots.release()
+
+    def test_in_progress(self, view, monkeypatch):
+        counts = []
+
+        def counting(request, conn=None, **kwargs):
+            counts.append(executor._requests)
+            return "served"
+        request = FakeRequest(REMOTE_ADDR="10.0.0.1")
+        rate_limited(EXPENSIVE)(counting)(request, conn=FakeConn(5))
+        rate_limited(CHEAP)(counting)(request, conn=FakeConn(5))
+        assert counts == [1, 0]
+        assert executor._requests == 0
+
+    def test_public_user(self, view):
+        request = FakeRequest(REMOTE_ADDR="10.0.0.1")
+        rsp = rate_limited(EXPENSIVE)(view)(request, conn=FakeConn())
+        assert rsp.status_code == 503
+        assert rsp['Retry-After'] == "5"
+
+    def test_logged_in_user(self, view):
+        request = FakeRequest(REMOTE_ADDR="10.0.0.1")
+        rsp = rate_limited(EXPENSIVE)(view)(request, conn=FakeConn(5))
+        assert rsp == "served"
+
+    def test_cheap(self, view):
+        request = FakeRequest(REMOTE_ADDR="10.0.0.1")
+        rsp = rate_limited(CHEAP)(view)(request, conn=FakeConn())
+        assert rsp == "served"
+
+    def test_disabled(self, view, monkeypatch):
+        monkeypatch.setattr(MaprSettings, 'SHED_LOAD', False)
+        request = FakeRequest(REMOTE_ADDR="10.0.0.1")
+        rsp = rate_limited(EXPENSIVE)(view)(request, conn=FakeConn())
+        assert rsp == "served"
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from omero_mapr.backends.sqlite import create_schema, SqliteBackend, \
+    MemoryBackend
+
+
+NS = "openmicroscopy.org/mapr/gene"
+
+
+@pytest.fixture(params=[SqliteBackend, MemoryBackend])
+def backend(request, tmpdir):
+    path = str(tmpdir.join("index.sqlite"))
+    db = sqlite3.connect(path)
+    create_schema(db)
+    db.executemany("INSERT INTO annotation VALUES (?, ?, ?, ?, ?)", [
+        (1, NS, 2, 3, None),
+        (2, NS, 2, 3, None),
+    ])
+    db.executemany("INSERT INTO mapvalue VALUES (?, ?, ?, ?)", [
+        (1, 0, "Gene Symbol", "CDC20"),
+        (2, 0, "Gene Symbol", "cdc20_b"),
+    ])
+    db.executemany("INSERT INTO link VALUES (?, ?, ?, ?, ?, ?, ?)", [
+        (1, 10, 100, 20, 30, None, None),
+        (1, 11, 101, 20, 30, None, None),
+        (2, 12, None, None, None, 40, 50),
+    ])
+    db.executemany("INSERT INTO container VALUES (?, ?, ?, ?, ?)", [
+        ('screen', 30, "screen", 2, 3),
+        ('plate', 20, "plate", 2, 3),
+        ('project', 50, "project", 2, 3),
+        ('dataset', 40, "dataset", 2, 3),
+    ])
+    db.executemany(
+        "INSERT INTO image VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            (10, "b", 2, 3, 5, 1, 1, 1, None, None),
+            (11, "a", 2, 3, 5, 1, 1, 1, None, None),
+            (12, "c", 2, 3, None, 1, 1, 1, None, None),
+        ])
+    db.commit()
+    db.close()
+    return request.param(path)
+
+
+class TestSqliteBackend(object):
+
+    """
+    Tests the SQLite backend against a small index
+    """
+
+    def test_count(self, backend):
+        assert backend.count_mapannotations(
+            None, "cdc20", query=True, mapann_ns=[NS]) == 2
+        assert backend.count_mapannotations(
+            None, "cdc20", query=True, case_sensitive=True,
+            mapann_ns=[NS]) == 1
+        assert backend.count_mapannotations(
+            None, "CDC2_", query=True, case_sensitive=True,
+            mapann_ns=[NS]) == 0
+
+    def test_mapannotations(self, backend):
+        maps = backend.marshal_mapannotations(
+            None, "cdc20", query=True, mapann_ns=[NS], limit=10)
+        assert [m['name'] for m in maps] == ["CDC20 (2)", "cdc20_b (1)"]
+        assert maps[0]['childCount'] == 1
+
+    def test_facets(self, backend):
+        facets = backend.marshal_facets(
+            None, "cdc20", query=True, mapann_ns=[NS])
+        assert facets == [{'name': "Gene Symbol", 'ns': NS,
+                           'imageCount': 3, 'valueCount': 2}]
+
+    def test_containers(self, backend):
+        screens = backend.marshal_screens(
+            None, "CDC20", mapann_ns=[NS], limit=10)
+        assert screens == [{
+            'id': 30, 'name': "screen (2)", 'ownerId': 2,
+            'childCount': 1, 'permsCss': '',
+            'extra': {'counter': 2, 'value': "CDC20"}}]
+        assert backend.marshal_projects(
+            None, "CDC20", mapann_ns=[NS], limit=10) == []
+        plates = backend.marshal_plates(
+            None, 30, "CDC20", mapann_ns=[NS], limit=10)
+        assert [p['id'] for p in plates] == [20]
+
+    def test_images(self, backend):
+        images = backend.marshal_images(
+            None, 'plate', 20, "CDC20", mapann_ns=[NS],
+            load_pixels=True, limit=10)
+        assert [i['name'] for i in images] == ["a", "b"]
+        assert images[0]['filesetId'] == 5
+        assert images[0]['sizeZ'] == 1
+
+    def test_images_by_id(self, backend):
+        assert backend.image_ids(
+            None, "cdc20", query=True, mapann_ns=[NS]) == [10, 11, 12]
+        images = backend.marshal_images_by_id(None, [12, 10])
+        assert [i['name'] for i in images] == ["b", "c"]
+
+    def test_annotations(self, backend):
+        anns, exps = backend.load_mapannotation(
+            None, "CDC20", mapann_ns=[NS], limit=10)
+        assert [a['id'] for a in anns] == [1]
+        assert anns[0]['values'] == [["Gene Symbol", "CDC20"]]
+        assert backend.count_annotations(
+            None, "CDC20", mapann_ns=[NS]) == 1
+        assert backend.count_annotations(None, None) == 0
+
+    def test_autocomplete(self, backend):
+        values = backend.marshal_autocomplete(
+            None, "dc", mapann_ns=[NS], limit=10)
+        assert [v['value'] for v in values] == ["CDC20", "cdc20_b"]
+
+    def test_paths_to_object(self, backend):
+        paths = backend.paths_to_object(
+            None, "CDC20", mapann_ns=[NS], plate_id=20)
+        assert paths == [[{'type': 'experimenter', 'id': 2},
+                          {'type': 'map', 'id': "CDC20"},
+                          {'type': 'screen', 'id': 30},
+                          {'type': 'plate', 'id': 20}]]
+
+    def test_reopen(self, backend):
+        assert backend.count_mapannotations(
+            None, "cdc20", query=True, mapann_ns=[NS]) == 2
+        # atomically replace the index with one holding one value less
+        tmp = backend.path + ".tmp"
+        db = sqlite3.connect(backend.path)
+        db.execute("VACUUM INTO ?", (tmp,))
+        db.close()
+        db = sqlite3.connect(tmp)
+        db.execute("DELETE FROM mapvalue WHERE ann_id = 2")
+        db.commit()
+        db.close()
+        os.replace(tmp, backend.path)
+        assert backend.count_mapannotations(
+            None, "cdc20", query=True, mapann_ns=[NS]) == 1
+
+    def test_threads(self, backend):
+        results = []
+
+        def count():
+            results.append(backend.count_mapannotations(
+                None, "cdc20", query=True, mapann_ns=[NS]))
+        threads = [threading.Thread(target=count) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [2] * 4
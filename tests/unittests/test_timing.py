@@ -0,0 +1,47 @@
+from omero_mapr import timing
+from omero_mapr.timing import RequestTimer
+
+
+class Clock(object):
+
+    """
+    Stands for the time module, the time being set by the test
+    """
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestRequestTimer(object):
+
+    """
+    Tests the phases recorded for the Server-Timing header
+    """
+
+    def test_nested_phases(self, monkeypatch):
+        clock = Clock(100.0)
+        monkeypatch.setattr(timing, 'time', clock)
+        timer = RequestTimer(None)
+        monkeypatch.setattr(timing._local, 'timer', timer, raising=False)
+
+        clock.now += 1
+        timing.mark('params')
+        with timing.phase('concurrent'):
+            # a query run inline on the request thread
+            with timing.phase('hql', 'image_ids'):
+                clock.now += 2
+            clock.now += 1
+        clock.now += 0.5
+        timing.mark('marshal')
+
+        phases = dict((name, duration) for name, duration, desc
+                      in timer.phases)
+        assert phases['params'] == 1
+        assert phases['hql'] == 2
+        assert phases['concurrent'] == 3
+        # only the top-level phase is excluded from the mark
+        assert phases['marshal'] == 0.5
+        assert timer.depth == 0
@@ -0,0 +1,211 @@
+from omero_mapr import valueindex
+from omero_mapr.valueindex import write_value_index, update_value_index, \
+    ValueIndex, PLATE, DATASET
+
+
+class FakeReader(object):
+
+    """
+    Stands for the HQL link reader, the state of the server being
+    given as the image ID and values of each link, the plate of each
+    well link and the wells counted in each plate
+    """
+
+    links = {}
+    containers = {}
+    well_links = {}
+    plates = {}
+    changed = set()
+    changed_wells = set()
+    user_id = 2
+
+    def __init__(self, conn, menu):
+        pass
+
+    def last_event_id(self):
+        return 20
+
+    def read_all(self, links, well_links):
+        links.update(self.links)
+        well_links.update(self.well_links)
+
+    def changed_links(self, since, until):
+        assert (since, until) == (10, 20)
+        return set(self.changed), set(self.changed_wells)
+
+    def read_links(self, links, link_ids):
+        for link_id in link_ids:
+            if link_id in self.links:
+                links[link_id] = self.links[link_id]
+
+    def read_well_links(self, well_links, link_ids):
+        for link_id in link_ids:
+            if link_id in self.well_links:
+                well_links[link_id] = self.well_links[link_id]
+
+    def read_containers(self, containers, image_ids):
+        for image_id in image_ids:
+            containers[image_id] = self.containers[image_id]
+
+    def read_plates(self, plates, plate_ids):
+        for k, count in self.plates.items():
+            if k[3] in plate_ids:
+                plates[k] = count
+
+
+class TestValueIndex(object):
+
+    """
+    Tests writing, reading and updating the mmap value index
+    """
+
+    def test_lookup(self, tmpdir):
+        path = str(tmpdir.join("gene.idx"))
+        write_value_index(path, {
+            1: (3, ["CDC20"]),
+            2: (1, ["CDC20", "cdc20"]),
+            3: (2, ["Cdc20"]),
+            4: (4, ["cdc20_b"]),
+            5: (5, ["CDC14"]),
+        }, event_id=7)
+        index = ValueIndex(path)
+        assert len(index) == 5
+        assert index.event_id == 7
+        assert list(index.image_ids("cdc20")) == [1, 2, 3]
+        assert list(index.image_ids("CDC20", case_sensitive=True)) == [1, 3]
+        assert list(index.image_ids("Cdc14")) == [5]
+        assert list(index.image_ids("Cdc14", case_sensitive=True)) == []
+        assert list(index.image_ids("cdc2")) == []
+        assert index.values("cdc2") == ["CDC20", "Cdc20", "cdc20", "cdc20_b"]
+        assert index.values("cdc", limit=1) == ["CDC14"]
+        assert index.links()[2] == (1, set(["CDC20", "cdc20"]))
+
+    def test_container_counts(self, tmpdir):
+        path = str(tmpdir.join("gene.idx"))
+        write_value_index(path, {
+            1: (1, ["CDC20"]),
+            2: (2, ["CDC20"]),
+            3: (3, ["CDC20", "CDC14"]),
+        }, {
+            1: [(DATASET, 10, 3, 200)],
+            2: [(DATASET, 10, 4, 201)],
+            3: [(DATASET, 10, 4, 201)],
+        }, {
+            ("CDC20", 10, 3, 100): 4,
+            ("CDC20", 10, 4, 101): 1,
+            ("CDC14", 10, 4, 101): 2,
+        }, {7: 100, 8: 101})
+        index = ValueIndex(path)
+        assert index.container_counts("CDC20", PLATE, 10) == {100: 4, 101: 1}
+        assert index.container_counts("CDC20", DATASET, 10) == {200: 1, 201: 2}
+        assert index.container_counts("CDC14", PLATE, 10) == {101: 2}
+        assert index.container_counts("CDC14", DATASET, 10) == {201: 1}
+        assert index.container_counts("cdc20", PLATE, 10) == {}
+        assert index.container_counts("CDC20", PLATE, 11) == {}
+        assert index.containers()[3] == [(DATASET, 10, 4, 201)]
+        assert index.plates()[("CDC14", 10, 4, 101)] == 2
+        assert index.well_links() == {7: 100, 8: 101}
+
+    def test_container_counts_group(self, tmpdir):
+        path = str(tmpdir.join("gene.idx"))
+        write_value_index(path, {
+            1: (1, ["CDC20"]),
+            2: (2, ["CDC20"]),
+        }, {
+            1: [(DATASET, 10, 3, 200)],
+            2: [(DATASET, 10, 4, 201)],
+        }, {
+            ("CDC20", 10, 3, 100): 4,
+            ("CDC20", 10, 4, 101): 1,
+        })
+        index = ValueIndex(path)
+        assert index.container_counts("CDC20", PLATE, 10, 3) == {100: 4}
+        assert index.container_counts("CDC20", PLATE, 10, 4) == {101: 1}
+        assert index.container_counts("CDC20", DATASET, 10, 4) == {201: 1}
+        assert index.container_counts("CDC20", DATASET, 10, 5) == {}
+
+    def test_plate_values(self, tmpdir):
+        # the wells of a plate are annotated, not always its images
+        path = str(tmpdir.join("gene.idx"))
+        write_value_index(path, {}, plates={("CDC20", 10, 3, 100): 4})
+        index = ValueIndex(path)
+        assert len(index) == 1
+        assert list(index.image_ids("CDC20")) == []
+        assert index.container_counts("CDC20", PLATE, 10) == {100: 4}
+
+    def test_replace(self, tmpdir):
+        path = str(tmpdir.join("gene.idx"))
+        write_value_index(path, {1: (1, ["CDC20"])})
+        old = ValueIndex(path)
+        write_value_index(path, {})
+        new = ValueIndex(path)
+        assert new.inode != old.inode
+        assert len(new) == 0
+        assert list(new.image_ids("cdc20")) == []
+        # the replaced index stays readable
+        assert list(old.image_ids("cdc20")) == [1]
+        assert tmpdir.listdir() == [tmpdir.join("gene.idx")]
+
+    def test_update(self, tmpdir, monkeypatch):
+        path = str(tmpdir.join("gene.idx"))
+        write_value_index(path, {
+            1: (1, ["cdc20"]),
+            2: (2, ["cdc20"]),
+            3: (3, ["cdc14"]),
+        }, {
+            1: [(DATASET, 5, 3, 50)],
+            2: [(DATASET, 5, 3, 50)],
+            3: [(DATASET, 5, 3, 50)],
+        }, {
+            ("cdc20", 6, 3, 60): 2,
+            ("cdc14", 6, 3, 61): 1,
+        }, {7: 60, 8: 61}, event_id=10, user_id=2)
+        # link 1 deleted, link 3 changed, link 4 created
+        monkeypatch.setattr(FakeReader, 'links', {
+            3: (3, ["cdc20"]),
+            4: (4, ["cdc14"]),
+        })
+        monkeypatch.setattr(FakeReader, 'containers', {
+            3: [(DATASET, 5, 3, 51)],
+            4: [(DATASET, 5, 3, 51)],
+        })
+        monkeypatch.setattr(FakeReader, 'changed', set([1, 3, 4]))
+        # well link 8 moved from plate 61 to plate 62
+        monkeypatch.setattr(FakeReader, 'well_links', {7: 60, 8: 62})
+        monkeypatch.setattr(FakeReader, 'plates', {
+            ("cdc20", 6, 3, 60): 5,
+            ("cdc14", 6, 3, 62): 3,
+        })
+        monkeypatch.setattr(FakeReader, 'changed_wells', set([8]))
+        monkeypatch.setattr(valueindex, '_LinkReader', FakeReader)
+
+        assert update_value_index(None, "gene", path) == 4
+        index = ValueIndex(path)
+        assert index.event_id == 20
+        assert list(index.image_ids("cdc20")) == [2, 3]
+        assert list(index.image_ids("cdc14")) == [4]
+        assert index.container_counts("cdc20", DATASET, 5) == {50: 1, 51: 1}
+        assert index.container_counts("cdc14", DATASET, 5) == {51: 1}
+        # only the plates of the changed well links are counted again
+        assert index.container_counts("cdc20", PLATE, 6) == {60: 2}
+        assert index.container_counts("cdc14", PLATE, 6) == {62: 3}
+        assert index.well_links() == {7: 60, 8: 62}
+        # nothing logged since
+        assert update_value_index(None, "gene", path) == 0
+
+    def test_user(self, tmpdir, monkeypatch):
+        path = str(tmpdir.join("gene.idx"))
+        write_value_index(path, {1: (1, ["cdc20"])}, event_id=10,
+                          user_id=3)
+        assert ValueIndex(path).user_id == 3
+        monkeypatch.setattr(FakeReader, 'links', {4: (4, ["cdc14"])})
+        monkeypatch.setattr(FakeReader, 'containers', {4: []})
+        monkeypatch.setattr(valueindex, '_LinkReader', FakeReader)
+
+        # updated as another user, the index is built again
+        assert update_value_index(None, "gene", path) == 1
+        index = ValueIndex(path)
+        assert index.user_id == 2
+        assert index.event_id == 20
+        assert list(index.image_ids("cdc20")) == []
+        assert list(index.image_ids("cdc14")) == [4]
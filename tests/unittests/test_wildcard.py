@@ -0,0 +1,72 @@
+import pytest
+
+from omero_mapr.utils import wildcard
+
+
+def listing(total):
+    """ A fetch function paging through total rows """
+    calls = []
+
+    def fetch(page, limit):
+        calls.append((page, limit))
+        start = (page - 1) * limit
+        return list(range(total))[start:start + limit]
+    fetch.calls = calls
+    return fetch
+
+
+class TestWildcard(object):
+
+    """
+    Tests the paging of wildcard listings bounded by the wildcard limit
+    """
+
+    @pytest.mark.parametrize("wc_limit, page, limit, expected", [
+        (0, 3, 200, (200, None)),
+        (1000, 1, 200, (200, 1000)),
+        (1000, 5, 200, (200, 200)),
+        (1000, 6, 200, (200, 0)),
+        (100, 1, 200, (100, 100)),
+        (100, 2, 200, (100, 0)),
+        (500, 3, 200, (200, 100)),
+    ])
+    def test_window(self, wc_limit, page, limit, expected):
+        assert wildcard.window(wc_limit, page, limit) == expected
+
+    @pytest.mark.parametrize("total, wc_limit, page, limit, rows, truncated", [
+        # no wildcard limit
+        (5000, 0, 2, 200, 200, False),
+        # the limit fits in the first page
+        (5000, 100, 1, 200, 100, True),
+        (100, 100, 1, 200, 100, False),
+        (50, 100, 1, 200, 50, False),
+        # the limit is a multiple of the page size
+        (5000, 1000, 4, 200, 200, False),
+        (5000, 1000, 5, 200, 200, True),
+        (1000, 1000, 5, 200, 200, False),
+        (5000, 1000, 6, 200, 0, True),
+        # fewer values than the limit
+        (700, 1000, 4, 200, 100, False),
+        (700, 1000, 6, 200, 0, False),
+        # partial last page
+        (5000, 500, 3, 200, 100, True),
+        (500, 500, 3, 200, 100, False),
+    ])
+    def test_fetch_window(self, total, wc_limit, page, limit, rows,
+                          truncated):
+        fetch = listing(total)
+        result, flag = wildcard.fetch_window(fetch, wc_limit, page, limit)
+        assert len(result) == rows
+        assert flag is truncated
+        if result:
+            start = (page - 1) * min(limit, wc_limit or limit)
+            assert result[0] == start
+
+    def test_no_probe(self):
+        # pages ending before the limit need no extra query
+        fetch = listing(5000)
+        wildcard.fetch_window(fetch, 1000, 2, 200)
+        assert fetch.calls == [(2, 200)]
+        fetch = listing(5000)
+        wildcard.fetch_window(fetch, 1000, 5, 200)
+        assert fetch.calls == [(5, 200), (1001, 1)]